@@ -0,0 +1,75 @@
+"""
+このファイルは、検索結果の関連度に応じて、LLMに渡すドキュメント数（k）を自動で増減させるRetrieverのファイルです。
+関連度が最低値に満たないドキュメントと、最も関連度の高いドキュメントから大きく離れたドキュメントは除外するため、
+的を絞った質問では文脈が小さくなり、関連する社内文書の無い質問では検索結果が空になります。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import logging
+from pydantic import ConfigDict
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+import constants as ct
+
+
+############################################################
+# クラス定義
+############################################################
+
+class AdaptiveRetriever(BaseRetriever):
+    """
+    ベクターストアから関連度付きで検索し、関連度による足切りを行うRetriever
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    vectorstore: VectorStore
+    # 取得するドキュメント数の下限（関連度の最低値を満たすものがある場合）・上限
+    min_k: int = ct.RETRIEVER_MIN_DOCUMENT_COUNT
+    max_k: int = ct.RETRIEVER_DOCUMENT_COUNT
+    # 関連度の最低値
+    min_score: float = ct.RETRIEVER_MIN_RELEVANCE_SCORE
+    # 最も関連度の高いドキュメントからの関連度の差の上限（最も高い関連度に対する割合）
+    max_gap: float = ct.RETRIEVER_MAX_RELATIVE_GAP
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        logger = logging.getLogger(ct.LOGGER_NAME)
+
+        docs_and_scores = self.vectorstore.similarity_search_with_relevance_scores(query, k=self.max_k)
+        documents = select_by_score(docs_and_scores, self.min_k, self.min_score, self.max_gap)
+        logger.info(
+            f"検索結果の関連度: {', '.join(f'{score:.3f}' for _, score in docs_and_scores)}"
+            f"（{len(docs_and_scores)}件中{len(documents)}件を使用）"
+        )
+        return documents
+
+
+############################################################
+# 関数定義
+############################################################
+
+def select_by_score(docs_and_scores, min_k=ct.RETRIEVER_MIN_DOCUMENT_COUNT, min_score=ct.RETRIEVER_MIN_RELEVANCE_SCORE, max_gap=ct.RETRIEVER_MAX_RELATIVE_GAP):
+    """
+    関連度による足切りを行い、使うドキュメントを選ぶ
+
+    Args:
+        docs_and_scores: (ドキュメント, 関連度)のタプルのリスト（関連度の高い順）
+        min_k: 関連度の最低値を満たすものがある場合に、関連度の差に関わらず使うドキュメント数
+        min_score: 関連度の最低値（満たさないドキュメントは使わない）
+        max_gap: 最も関連度の高いドキュメントからの関連度の差の上限（最も高い関連度に対する割合）
+
+    Returns:
+        使うドキュメントのリスト（関連度の高い順。関連するものが無い場合は空のリスト）
+    """
+    candidates = [(document, score) for document, score in docs_and_scores if score >= min_score]
+    if not candidates:
+        return []
+
+    top_score = candidates[0][1]
+    documents = []
+    for document, score in candidates:
+        if len(documents) >= min_k and top_score - score > abs(top_score) * max_gap:
+            break
+        documents.append(document)
+    return documents
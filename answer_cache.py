@@ -0,0 +1,299 @@
+"""
+このファイルは、会話履歴のない質問（セッションの最初の質問）への回答を保持する回答キャッシュのファイルです。
+同じモードで同じ質問（全角・半角、空白、末尾の「？」などの違いは無視）が送信された場合は、LLMを呼び出さずに保持した回答を返します。
+インデックスの作成時にprewarm_cache.pyで作成した、よく聞かれる質問の回答も起動時に読み込みます。
+参照先データや回答に関わる設定が変わった場合、事前に作成した回答は読み込まず、起動後にファイルの変更を反映した場合は保持した回答を破棄します。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import json
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from collections import OrderedDict
+from langchain_core.documents import Document as LangchainDoc
+from ingest_filters import normalize_text
+from metrics import count_cache
+import constants as ct
+
+
+############################################################
+# 変数の定義
+############################################################
+# プロセス内で共有する回答キャッシュ（初回利用時に作成）
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+# 質問の末尾にあっても、同じ質問とみなす文字
+QUESTION_TRAILING_CHARS = "?!。.、 "
+
+
+############################################################
+# クラス定義
+############################################################
+
+class AnswerCache:
+    """
+    回答を保持するLRUキャッシュ（上限を超えた場合は最も長く使われていないものから削除）
+    """
+
+    def __init__(self, max_size=ct.ANSWER_CACHE_SIZE):
+        """
+        Args:
+            max_size: 保持する回答の上限数
+        """
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        # 保持している回答の作成に使ったインデックスの、ファイルの変更を反映した回数
+        self._update_count = None
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, mode, question, update_count=0):
+        """
+        回答を取得
+
+        Args:
+            mode: 回答モード（ct.ANSWER_MODE_1 / ct.ANSWER_MODE_2）
+            question: ユーザー入力値
+            update_count: 現在のインデックスの、ファイルの変更を反映した回数
+
+        Returns:
+            LLMからの回答と同じ形式の辞書（キャッシュにない場合はNone）
+        """
+        key = get_cache_key(mode, question)
+        with self._lock:
+            self._check_update_count(update_count)
+            entry = self._items.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self._items.move_to_end(key)
+                self.hits += 1
+        count_cache("answer", entry is not None)
+        return None if entry is None else from_entry(entry)
+
+    def put(self, mode, question, response, update_count=0):
+        """
+        回答を保持
+
+        Args:
+            mode: 回答モード（ct.ANSWER_MODE_1 / ct.ANSWER_MODE_2）
+            question: ユーザー入力値
+            response: LLMからの回答
+            update_count: 回答の作成に使ったインデックスの、ファイルの変更を反映した回数
+        """
+        self.load([to_entry(question, mode, response)], update_count)
+
+    def load(self, entries, update_count=0):
+        """
+        to_entryで変換した回答をまとめて保持
+
+        Args:
+            entries: 回答のリスト
+            update_count: 回答の作成に使ったインデックスの、ファイルの変更を反映した回数
+        """
+        with self._lock:
+            self._check_update_count(update_count)
+            for entry in entries:
+                key = get_cache_key(entry["mode"], entry["question"])
+                self._items[key] = entry
+                self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def _check_update_count(self, update_count):
+        # 起動後にファイルの変更を反映した場合、それ以前の回答は検索結果が変わっている可能性があるため破棄する
+        if self._update_count is not None and update_count != self._update_count and self._items:
+            logger = logging.getLogger(ct.LOGGER_NAME)
+            logger.info(f"参照先データの変更を反映したため、回答キャッシュを破棄しました（{len(self._items)}件）")
+            self._items.clear()
+        self._update_count = update_count
+
+
+############################################################
+# 関数定義
+############################################################
+
+def get_answer_cache():
+    """
+    プロセス内で共有する回答キャッシュを取得（初回のみ作成し、事前に作成した回答を読み込む）
+
+    Returns:
+        AnswerCache
+    """
+    global _answer_cache
+
+    with _answer_cache_lock:
+        if _answer_cache is None:
+            _answer_cache = AnswerCache()
+            load_prewarmed_answers(_answer_cache)
+        return _answer_cache
+
+
+def normalize_query(question):
+    """
+    回答キャッシュの照合用に質問を正規化（全角・半角、空白、大文字・小文字、末尾の「？」「。」などの違いを無視）
+
+    Args:
+        question: 質問
+
+    Returns:
+        正規化した質問
+    """
+    return normalize_text(question).lower().rstrip(QUESTION_TRAILING_CHARS)
+
+
+def get_cache_key(mode, question):
+    """
+    回答キャッシュのキーを作成
+
+    Args:
+        mode: 回答モード
+        question: 質問
+
+    Returns:
+        キャッシュのキー
+    """
+    return mode, normalize_query(question)
+
+
+def get_settings_key():
+    """
+    回答の内容に関わる設定（モデル・プロンプト・検索の設定）から、事前に作成した回答を使えるかどうかの判定用の値を作成
+
+    Returns:
+        設定のハッシュ値
+    """
+    settings = (
+        ct.MODEL, ct.TEMPERATURE, ct.SYSTEM_PROMPT_DOC_SEARCH, ct.SYSTEM_PROMPT_INQUIRY, ct.HUMAN_PROMPT_WITH_CONTEXT,
+        ct.NO_DOC_MATCH_ANSWER, ct.INQUIRY_NO_MATCH_ANSWER,
+        ct.RETRIEVER_DOCUMENT_COUNT, ct.RETRIEVER_SCORE_CUTOFF_ENABLED, ct.RETRIEVER_MIN_DOCUMENT_COUNT,
+        ct.RETRIEVER_MIN_RELEVANCE_SCORE, ct.RETRIEVER_MAX_RELATIVE_GAP,
+        ct.CONTEXT_PACKING_ENABLED, ct.CONTEXT_TOKEN_BUDGET
+    )
+    return hashlib.sha1(repr(settings).encode("utf-8")).hexdigest()
+
+
+def to_entry(question, mode, response):
+    """
+    LLMからの回答を、保持・ファイル出力用の辞書に変換
+
+    Args:
+        question: ユーザー入力値
+        mode: 回答モード
+        response: LLMからの回答
+
+    Returns:
+        回答の辞書
+    """
+    return {
+        "question": question,
+        "mode": mode,
+        "input": response.get("input", question),
+        "answer": response["answer"],
+        "context": [{"page_content": doc.page_content, "metadata": doc.metadata} for doc in response.get("context", [])],
+        "no_match": bool(response.get("no_match"))
+    }
+
+
+def from_entry(entry):
+    """
+    保持した回答の辞書を、LLMからの回答と同じ形式に戻す
+
+    Args:
+        entry: to_entryで変換した回答の辞書
+
+    Returns:
+        LLMからの回答と同じ形式の辞書
+    """
+    response = {
+        "input": entry["input"],
+        "chat_history": [],
+        "context": [LangchainDoc(page_content=doc["page_content"], metadata=doc["metadata"]) for doc in entry["context"]],
+        "answer": entry["answer"],
+        "success": True,
+        "cached": True
+    }
+    if entry.get("no_match"):
+        response["no_match"] = True
+    return response
+
+
+def write_prewarmed_answers(version, fingerprint, entries):
+    """
+    事前に作成した回答を、インデックスの世代のフォルダに書き出す
+
+    Args:
+        version: 回答の作成に使ったインデックスの世代名
+        fingerprint: インデックスの作成元データの指紋
+        entries: to_entryで変換した回答のリスト
+
+    Returns:
+        書き出したファイルのパス
+    """
+    from index_artifacts import get_answers_path
+
+    path = get_answers_path(version)
+    data = {
+        "version": version,
+        "fingerprint": fingerprint,
+        "settings": get_settings_key(),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "entries": entries
+    }
+    # 書き出し途中のファイルを読み込まれないよう、一時ファイルに書き出してから置き換える
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_prewarmed_answers(cache):
+    """
+    CURRENTの世代の事前に作成した回答を、回答キャッシュに読み込む
+    参照先データ・回答に関わる設定が作成時から変わっている場合は読み込まない
+
+    Args:
+        cache: 読み込み先の回答キャッシュ
+
+    Returns:
+        読み込んだ回答の件数
+    """
+    from index_artifacts import get_current, get_answers_path
+    from initialize import get_data_fingerprint
+
+    logger = logging.getLogger(ct.LOGGER_NAME)
+
+    version = get_current()
+    if version is None:
+        return 0
+    try:
+        with open(get_answers_path(version), encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return 0
+    except (OSError, ValueError) as e:
+        logger.warning(f"事前に作成した回答の読み込みエラー: {version} - {e}")
+        return 0
+
+    if data.get("settings") != get_settings_key():
+        logger.info(f"回答に関わる設定が変わっているため、事前に作成した回答を読み込みません: {version}")
+        return 0
+    if data.get("fingerprint") != get_data_fingerprint():
+        logger.info(f"参照先データが更新されているため、事前に作成した回答を読み込みません: {version}")
+        return 0
+
+    entries = data.get("entries", [])
+    cache.load(entries)
+    logger.info(f"事前に作成した回答を読み込みました: {version}（{len(entries)}件）")
+    return len(entries)
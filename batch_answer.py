@@ -0,0 +1,143 @@
+"""
+このファイルは、画面を使わずに質問への回答をまとめて生成するバッチ処理のファイルです。
+
+使い方:
+    python batch_answer.py questions.jsonl -o answers.jsonl --workers 4
+
+入力ファイル（JSONL）の1行は、以下の形式の質問です。
+    {"id": "q1", "question": "質問文", "mode": "社内問い合わせ"}
+「mode」には「社内文書検索」「社内問い合わせ」のほか、「search」「inquiry」も指定できます（省略時は「社内問い合わせ」）。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import sys
+import json
+import time
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import utils
+from initialize import initialize_logger, build_retriever
+import constants as ct
+
+
+############################################################
+# 関数定義
+############################################################
+
+def load_questions(path):
+    """
+    質問ファイル（JSONL）の読み込み
+
+    Args:
+        path: 質問ファイルのパス
+
+    Returns:
+        質問の辞書のリスト
+    """
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            mode = item.get("mode", ct.ANSWER_MODE_2)
+            mode = ct.BATCH_MODE_ALIASES.get(mode, mode)
+            if mode not in (ct.ANSWER_MODE_1, ct.ANSWER_MODE_2):
+                raise ValueError(f"{path}:{line_number} 不明なモードです: {mode}")
+            questions.append({
+                "id": item.get("id", line_number),
+                "question": item["question"],
+                "mode": mode
+            })
+
+    return questions
+
+
+def answer_question(retriever, question):
+    """
+    1件の質問に対する回答の生成
+
+    Args:
+        retriever: 検索に使うRetriever
+        question: 質問の辞書
+
+    Returns:
+        回答・参照元・処理時間を含む辞書
+    """
+    start_time = time.perf_counter()
+    llm_response = utils.generate_answer(question["question"], retriever, question["mode"], [])
+    latency = time.perf_counter() - start_time
+
+    result = {
+        "id": question["id"],
+        "question": question["question"],
+        "mode": question["mode"],
+        "answer": llm_response["answer"],
+        "sources": utils.get_source_list(llm_response.get("context", [])),
+        "latency_sec": round(latency, 3),
+        "success": bool(llm_response.get("success") or llm_response.get("is_csv_result"))
+    }
+
+    return result
+
+
+def run_batch(input_path, output_path, workers):
+    """
+    質問ファイルの全質問に回答し、結果をJSONLで書き出す
+
+    Args:
+        input_path: 質問ファイルのパス
+        output_path: 回答ファイルのパス
+        workers: 同時に回答を生成する数
+
+    Returns:
+        回答に失敗した質問の件数
+    """
+    logger = logging.getLogger(ct.LOGGER_NAME)
+
+    questions = load_questions(input_path)
+    logger.info(f"バッチ回答開始: {len(questions)}件 (workers={workers})")
+
+    # インデックスの作成は最初に1回のみ行い、全質問で共有する
+    retriever = build_retriever()
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(lambda question: answer_question(retriever, question), questions))
+    elapsed = time.perf_counter() - start_time
+
+    # 入力と同じ順番で書き出すことで、前回の結果との差分を取りやすくする
+    with open(output_path, "w", encoding="utf-8") as f:
+        for result in results:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+    failed_count = sum(1 for result in results if not result["success"])
+    logger.info(f"バッチ回答完了: {len(results)}件, 失敗{failed_count}件, {elapsed:.1f}秒")
+
+    return failed_count
+
+
+def main(argv=None):
+    """
+    コマンドラインからの実行
+    """
+    parser = argparse.ArgumentParser(description="社内文書をもとに、質問ファイルの全質問へ回答します。")
+    parser.add_argument("input", help="質問ファイル（JSONL）のパス")
+    parser.add_argument("-o", "--output", default="answers.jsonl", help="回答ファイル（JSONL）の出力先")
+    parser.add_argument("-w", "--workers", type=int, default=ct.BATCH_DEFAULT_WORKERS, help="同時に回答を生成する数")
+    args = parser.parse_args(argv)
+
+    initialize_logger(session_id=ct.BATCH_SESSION_ID)
+
+    failed_count = run_batch(args.input, args.output, max(1, args.workers))
+    print(f"回答を出力しました: {args.output}（失敗: {failed_count}件）")
+
+    return 1 if failed_count else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
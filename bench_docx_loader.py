@@ -0,0 +1,172 @@
+"""
+このファイルは、Word文書（.docx）の読み込み方法ごとに、処理時間・メモリ使用量・表の行の残り方を比較するベンチマークのファイルです。
+
+使い方:
+    python bench_docx_loader.py                    参照先フォルダ（./data）内の全Word文書で比較
+    python bench_docx_loader.py --large 20000      段落・表を指定数だけ含む大きなWord文書を作成して比較
+    python bench_docx_loader.py a.docx b.docx --repeat 10
+
+比較対象:
+    docx_loader    XMLを先頭から順に解析するdata loader（docx_loader.DocxLoader）
+    docx2txt       これまでのdata loader（Docx2txtLoader）
+    python-docx    python-docxで段落・表を取り出す方法（以前のextract_docx_textと同じ処理）
+計測が互いに影響しないよう、読み込み方法ごとに別プロセスで実行します。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+import multiprocessing
+import constants as ct
+
+
+############################################################
+# 変数の定義
+############################################################
+# 比較対象（表示名）
+BENCH_TARGETS = ["docx_loader", "docx2txt", "python-docx"]
+# 表の行と判定する区切り文字
+TABLE_CELL_SEPARATOR = " | "
+
+
+############################################################
+# 関数定義
+############################################################
+
+def extract_with_python_docx(path):
+    """
+    python-docxで段落・表を取り出す（段落の後に、全ての表の行をまとめて並べる）
+    """
+    from docx import Document
+
+    doc = Document(path)
+    lines = [para.text.strip() for para in doc.paragraphs if para.text.strip()]
+    for table in doc.tables:
+        for row in table.rows:
+            cells = [cell.text.strip() for cell in row.cells if cell.text.strip()]
+            if cells:
+                lines.append(TABLE_CELL_SEPARATOR.join(cells))
+    return "\n".join(lines)
+
+
+def create_extractor(name):
+    """
+    比較対象の読み込み方法を、パスを受け取ってテキストを返す関数として作成
+    """
+    if name == "docx_loader":
+        from docx_loader import DocxLoader
+        return lambda path: "\n".join(doc.page_content for doc in DocxLoader(path).lazy_load())
+    if name == "docx2txt":
+        from langchain_community.document_loaders import Docx2txtLoader
+        return lambda path: "\n".join(doc.page_content for doc in Docx2txtLoader(path).load())
+    return extract_with_python_docx
+
+
+def run_target(name, paths, repeat, result_queue):
+    """
+    1種類の読み込み方法について計測（子プロセスで実行）
+    """
+    from ingest_pipeline import peak_memory_mb
+
+    extract = create_extractor(name)
+    # モジュールの読み込みなどの初回のみの処理を計測に含めないよう、1回読み込んでおく
+    extract(paths[0])
+    base_memory = peak_memory_mb()
+
+    latencies = []
+    texts = {}
+    for _ in range(repeat):
+        for path in paths:
+            started_at = time.perf_counter()
+            texts[path] = extract(path)
+            latencies.append(time.perf_counter() - started_at)
+
+    peak_memory = peak_memory_mb()
+    result_queue.put({
+        "total_sec": sum(latencies),
+        "p50_ms": statistics.median(latencies) * 1000,
+        "max_ms": max(latencies) * 1000,
+        "peak_mb": None if peak_memory is None else peak_memory - base_memory,
+        "chars": sum(len(text) for text in texts.values()),
+        "table_rows": sum(1 for text in texts.values() for line in text.splitlines() if TABLE_CELL_SEPARATOR in line)
+    })
+
+
+def create_large_docx(path, paragraph_count):
+    """
+    段落・見出し・表を多く含む、ベンチマーク用の大きなWord文書を作成
+    """
+    from docx import Document
+
+    doc = Document()
+    for i in range(paragraph_count):
+        if i % 100 == 0:
+            doc.add_heading(f"{i // 100 + 1}. 見出し", level=1)
+        doc.add_paragraph(f"段落{i}: 株式会社EcoTeeのサービスに関するサンプルテキストです。" * 3)
+        if i % 500 == 0:
+            table = doc.add_table(rows=5, cols=3)
+            for row_index, row in enumerate(table.rows):
+                for col_index, cell in enumerate(row.cells):
+                    cell.text = f"行{row_index}列{col_index}"
+    doc.save(path)
+
+
+def find_docx_files(folder):
+    """
+    フォルダ内の全Word文書のパスを取得
+    """
+    paths = []
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        paths += [os.path.join(root, file) for file in sorted(files) if file.lower().endswith(".docx")]
+    return paths
+
+
+def main(argv=None):
+    """
+    コマンドラインからの実行
+    """
+    parser = argparse.ArgumentParser(description="Word文書の読み込み方法ごとの性能を比較します。")
+    parser.add_argument("paths", nargs="*", help="比較に使うWord文書（省略時は参照先フォルダ内の全Word文書）")
+    parser.add_argument("--repeat", type=int, default=5, help="全ファイルを読み込む回数")
+    parser.add_argument("--large", type=int, default=0, help="指定した段落数の大きなWord文書を作成して比較に使う")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = args.paths or find_docx_files(ct.RAG_TOP_FOLDER_PATH)
+        if args.large:
+            paths = [os.path.join(tmp_dir, "large.docx")]
+            create_large_docx(paths[0], args.large)
+        if not paths:
+            print("比較に使うWord文書がありません", file=sys.stderr)
+            return 1
+
+        context = multiprocessing.get_context("spawn")
+        reports = {}
+        for name in BENCH_TARGETS:
+            result_queue = context.Queue()
+            process = context.Process(target=run_target, args=(name, paths, max(1, args.repeat), result_queue))
+            process.start()
+            reports[name] = result_queue.get()
+            process.join()
+
+    print(f"files={len(paths)}, repeat={args.repeat}, size={sum(os.path.getsize(path) for path in paths) / 1024:.0f}KB" if not args.large else f"large document: paragraphs={args.large}, repeat={args.repeat}")
+    print(f"{'loader':<14}{'total[s]':>10}{'p50[ms]':>10}{'max[ms]':>10}{'peak[MB]':>10}{'chars':>10}{'table rows':>12}")
+    for name, report in reports.items():
+        peak = "-" if report["peak_mb"] is None else f"{report['peak_mb']:.1f}"
+        print(
+            f"{name:<14}{report['total_sec']:>10.3f}{report['p50_ms']:>10.2f}{report['max_ms']:>10.2f}"
+            f"{peak:>10}{report['chars']:>10}{report['table_rows']:>12}"
+        )
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
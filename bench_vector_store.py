@@ -0,0 +1,167 @@
+"""
+このファイルは、ベクターストアの種類ごとにメモリ使用量・作成時間・検索時間を比較するベンチマークのファイルです。
+
+使い方:
+    python bench_vector_store.py --chunks 5000 --queries 200
+
+OpenAIのAPIを呼ばずに比較できるよう、埋め込みには決定的なダミーの埋め込みモデルを使います。
+計測が互いに影響しないよう、ベクターストアごとに別プロセスで実行します。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import sys
+import time
+import argparse
+import statistics
+import multiprocessing
+
+
+############################################################
+# 変数の定義
+############################################################
+# 比較対象（表示名, ベクターストアの種類, numpyベクターストアの保存形式）
+BENCH_TARGETS = [
+    ("chroma", "chroma", None),
+    ("numpy-float32", "numpy", "float32"),
+    ("numpy-float16", "numpy", "float16"),
+    ("numpy-int8", "numpy", "int8"),
+]
+# 埋め込みベクトルの次元数（OpenAIEmbeddingsの既定モデルと同じ）
+EMBEDDING_SIZE = 1536
+
+
+############################################################
+# 関数定義
+############################################################
+
+def get_rss_bytes():
+    """
+    現在のプロセスの物理メモリ使用量（RSS）を取得
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    # /procが使えない環境では最大使用量で代用
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def normalize(vectors):
+    """
+    ベクトルの一覧をL2ノルム1に正規化したfloat32の行列に変換
+    """
+    import numpy as np
+    matrix = np.asarray(vectors, dtype=np.float32)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+def make_corpus(chunk_count):
+    """
+    ベンチマーク用のダミーのチャンクを作成
+    """
+    return [f"社内文書のチャンク{i}: " + "サンプルテキスト" * (i % 20 + 1) for i in range(chunk_count)]
+
+
+def run_target(backend, dtype, chunk_count, query_count, k, result_queue):
+    """
+    1種類のベクターストアについて計測（子プロセスで実行）
+    """
+    start_rss = get_rss_bytes()
+
+    start_time = time.perf_counter()
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+    if backend == "chroma":
+        from langchain_community.vectorstores import Chroma
+    else:
+        from vector_store import NumpyVectorStore
+    import_time = time.perf_counter() - start_time
+
+    embedding = DeterministicFakeEmbedding(size=EMBEDDING_SIZE)
+    texts = make_corpus(chunk_count)
+    ids = [str(i) for i in range(chunk_count)]
+    # 埋め込みの計算時間はどのベクターストアでも同じため、作成時間に含めないよう先に計算しておく
+    # また、どちらも同じ尺度で比較できるよう、ベクトルは正規化しておく
+    vectors = normalize(embedding.embed_documents(texts))
+    query_vectors = normalize(embedding.embed_documents([f"質問{i}" for i in range(query_count)]))
+    base_rss = get_rss_bytes()
+
+    start_time = time.perf_counter()
+    if backend == "chroma":
+        store = Chroma(embedding_function=embedding)
+        for start in range(0, chunk_count, 500):
+            end = start + 500
+            store._collection.add(ids=ids[start:end], embeddings=vectors[start:end].tolist(), documents=texts[start:end])
+    else:
+        store = NumpyVectorStore(embedding, dtype=dtype)
+        store.add_embeddings(texts, vectors, ids=ids)
+    build_time = time.perf_counter() - start_time
+
+    # numpyベクターストアは行列のサイズを、Chromaは（内部で確保するメモリを直接数えられないため）RSSの増分を使う
+    if backend == "chroma":
+        store_bytes = get_rss_bytes() - base_rss
+    else:
+        store_bytes = store.nbytes
+
+    latencies = []
+    results = []
+    for query_vector in query_vectors.tolist():
+        start_time = time.perf_counter()
+        docs = store.similarity_search_by_vector(query_vector, k=k)
+        latencies.append(time.perf_counter() - start_time)
+        results.append([doc.page_content for doc in docs])
+
+    result_queue.put({
+        "import_sec": import_time,
+        "build_sec": build_time,
+        "store_mb": max(0, store_bytes) / 1024 / 1024,
+        "total_mb": (get_rss_bytes() - start_rss) / 1024 / 1024,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": statistics.quantiles(latencies, n=20)[-1] * 1000 if len(latencies) > 1 else latencies[0] * 1000,
+        "results": results
+    })
+
+
+def main(argv=None):
+    """
+    コマンドラインからの実行
+    """
+    parser = argparse.ArgumentParser(description="ベクターストアの種類ごとの性能を比較します。")
+    parser.add_argument("--chunks", type=int, default=5000, help="格納するチャンク数")
+    parser.add_argument("--queries", type=int, default=200, help="検索の実行回数")
+    parser.add_argument("-k", type=int, default=5, help="検索で取得するドキュメント数")
+    args = parser.parse_args(argv)
+
+    context = multiprocessing.get_context("spawn")
+    reports = {}
+    for name, backend, dtype in BENCH_TARGETS:
+        result_queue = context.Queue()
+        process = context.Process(target=run_target, args=(backend, dtype, args.chunks, args.queries, args.k, result_queue))
+        process.start()
+        reports[name] = result_queue.get()
+        process.join()
+
+    # 厳密検索であるfloat32の結果を正解として、各ストアの検索結果の一致率を算出
+    expected = reports["numpy-float32"]["results"]
+
+    print(f"chunks={args.chunks}, queries={args.queries}, k={args.k}, dim={EMBEDDING_SIZE}")
+    print(f"{'backend':<15}{'import[s]':>10}{'build[s]':>10}{'store[MB]':>11}{'total[MB]':>11}{'p50[ms]':>9}{'p95[ms]':>9}{'recall':>8}")
+    for name, report in reports.items():
+        matches = sum(len(set(got) & set(want)) for got, want in zip(report["results"], expected))
+        recall = matches / max(1, sum(len(want) for want in expected))
+        print(
+            f"{name:<15}{report['import_sec']:>10.2f}{report['build_sec']:>10.2f}{report['store_mb']:>11.1f}"
+            f"{report['total_mb']:>11.1f}{report['p50_ms']:>9.2f}{report['p95_ms']:>9.2f}{recall:>8.3f}"
+        )
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,276 @@
+"""
+このファイルは、アプリを起動せずにインデックス（スナップショット）を作成するコマンドのファイルです。
+cronやCIで実行し、作成したインデックスを新しい世代として保存してから、アプリが読み込む世代（CURRENT）を切り替えます。
+アプリ側で「INDEX_PREBUILT_ONLY=1」とすると、アプリはここで作成したインデックスの読み込みのみを行います。
+
+使い方:
+    python build_index.py             作成して、問題がなければCURRENTを切り替える
+    python build_index.py --no-promote 作成のみ行い、CURRENTは切り替えない
+    python build_index.py --force     CURRENTの世代より悪化していても切り替える
+    python build_index.py --no-prewarm 切り替え前に、よく聞かれる質問の回答を事前に作成しない
+
+終了コード:
+    0: 成功, 1: 作成に失敗, 2: CURRENTの世代より悪化（チャンク数・ファイル数の減少など）している（--forceの場合は0）
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import sys
+import time
+import argparse
+import logging
+from collections import Counter
+from initialize import initialize_logger, get_data_fingerprint, build_vector_store
+from ingest_pipeline import format_savings
+import index_artifacts
+import constants as ct
+
+
+############################################################
+# 変数の定義
+############################################################
+# 終了コード
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_REGRESSION = 2
+
+
+############################################################
+# 関数定義
+############################################################
+
+def compute_chunk_stats(db):
+    """
+    作成したベクターストアのチャンクの統計を集計
+
+    Args:
+        db: 作成したベクターストア
+
+    Returns:
+        チャンク数・ファイル数・拡張子ごとのチャンク数・文字数の分布などの辞書
+    """
+    data = db.get(include=["documents", "metadatas"])
+    lengths = sorted(len(text) for text in data["documents"])
+    sources = [(metadata or {}).get("source", "") for metadata in data["metadatas"]]
+    extensions = Counter(
+        "web" if source.startswith(("http://", "https://")) else os.path.splitext(source)[1].lower() or "(なし)"
+        for source in sources
+    )
+
+    def percentile(ratio):
+        return lengths[round(ratio * (len(lengths) - 1))] if lengths else 0
+
+    return {
+        "chunks": len(lengths),
+        "sources": len(set(sources)),
+        "chunks_by_extension": dict(sorted(extensions.items())),
+        "length": {
+            "min": lengths[0] if lengths else 0,
+            "mean": round(sum(lengths) / len(lengths), 1) if lengths else 0,
+            "p50": percentile(0.5),
+            "p95": percentile(0.95),
+            "max": lengths[-1] if lengths else 0
+        },
+        "short_chunks": sum(1 for length in lengths if length < ct.INDEX_SHORT_CHUNK_LENGTH)
+    }
+
+
+def find_regressions(manifest, previous):
+    """
+    CURRENTの世代と比べて、作成したインデックスが悪化していないかを確認
+
+    Args:
+        manifest: 作成したインデックスの付加情報
+        previous: CURRENTの世代の付加情報（まだ無い場合はNone）
+
+    Returns:
+        悪化の内容のリスト（問題がない場合は空のリスト）
+    """
+    regressions = []
+    chunk_stats = manifest["chunk_stats"]
+    if chunk_stats["chunks"] == 0:
+        regressions.append("チャンクが1件も作成されませんでした")
+    if previous is None or "chunk_stats" not in previous:
+        return regressions
+
+    for key, label in (("chunks", "チャンク数"), ("sources", "ファイル数")):
+        before = previous["chunk_stats"][key]
+        after = chunk_stats[key]
+        if before and (before - after) / before > ct.INDEX_REGRESSION_MAX_DROP:
+            regressions.append(f"{label}が減少しました: {before} → {after}")
+
+    before = previous.get("stats", {}).get("empty_files", 0)
+    after = manifest["stats"]["empty_files"]
+    if after > before:
+        regressions.append(f"内容を読み込めなかったファイルが増えました: {before} → {after}")
+
+    return regressions
+
+
+def format_report(manifest, previous):
+    """
+    作成結果を、コンソール出力用の文字列に変換
+
+    Args:
+        manifest: 作成したインデックスの付加情報
+        previous: CURRENTの世代の付加情報（まだ無い場合はNone）
+
+    Returns:
+        コンソール出力用の文字列
+    """
+    timings = manifest["timings"]
+    stats = manifest["stats"]
+    chunk_stats = manifest["chunk_stats"]
+    previous_stats = (previous or {}).get("chunk_stats", {})
+
+    def compare(key):
+        return f"（CURRENT: {previous_stats[key]}）" if key in previous_stats else ""
+
+    peak_memory = "不明" if stats["peak_memory_mb"] is None else f"{stats['peak_memory_mb']:.0f}MB"
+
+    lines = [
+        "処理時間:",
+        f"  指紋の計算    {timings['fingerprint']:8.2f}秒",
+        f"  取り込み      {timings['ingest']:8.2f}秒"
+        f"（各段階: 読み込み{stats['load_time']:.2f}秒, 分割{stats['split_time']:.2f}秒, "
+        f"埋め込み{stats['embed_time']:.2f}秒, 追加{stats['insert_time']:.2f}秒）",
+        f"  統計の集計    {timings['chunk_stats']:8.2f}秒",
+        f"  書き出し      {timings['write']:8.2f}秒",
+        f"  合計          {sum(timings.values()):8.2f}秒",
+        "チャンクの統計:",
+        f"  ファイル数    {chunk_stats['sources']}{compare('sources')}（読み込み{stats['files']}件, 内容なし{stats['empty_files']}件）",
+        f"  チャンク数    {chunk_stats['chunks']}{compare('chunks')}",
+        f"  拡張子ごと    {', '.join(f'{key}: {value}' for key, value in chunk_stats['chunks_by_extension'].items())}",
+        "  文字数        " + ", ".join(f"{key}: {value}" for key, value in chunk_stats["length"].items()),
+        f"  短いチャンク  {chunk_stats['short_chunks']}件（{ct.INDEX_SHORT_CHUNK_LENGTH}文字未満）",
+        f"  {format_savings(stats)}",
+        f"  最大メモリ使用量 {peak_memory}"
+    ]
+    return "\n".join(lines)
+
+
+def run_build():
+    """
+    インデックスを作成し、新しい世代として保存（CURRENTは切り替えない）
+
+    Returns:
+        作成したインデックスの付加情報
+    """
+    from langchain_openai import OpenAIEmbeddings
+
+    timings = {}
+    embeddings = OpenAIEmbeddings()
+
+    started_at = time.perf_counter()
+    fingerprint = get_data_fingerprint()
+    timings["fingerprint"] = time.perf_counter() - started_at
+
+    # スナップショットに書き出すため、設定に関わらずnumpyベクターストアで作成
+    started_at = time.perf_counter()
+    db, stats = build_vector_store(embeddings, backend="numpy")
+    timings["ingest"] = time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    chunk_stats = compute_chunk_stats(db)
+    timings["chunk_stats"] = time.perf_counter() - started_at
+
+    manifest = {"fingerprint": fingerprint, "stats": stats, "chunk_stats": chunk_stats, "timings": dict(timings)}
+    started_at = time.perf_counter()
+    version = index_artifacts.write_artifact(db, manifest)
+    # 書き出し時間は書き出し後に分かるため、保存するmanifestには含めず、画面出力用にのみ追加する
+    timings["write"] = time.perf_counter() - started_at
+
+    return dict(manifest, version=version, timings=timings)
+
+
+def prewarm_answers(version):
+    """
+    切り替える世代で、よく聞かれる質問の回答を事前に作成（失敗してもインデックスの作成は成功とする）
+
+    Args:
+        version: 切り替える世代名
+    """
+    from prewarm_cache import run_prewarm, format_prewarm_stats
+
+    logger = logging.getLogger(ct.LOGGER_NAME)
+
+    try:
+        stats = run_prewarm(version)
+    except Exception as e:
+        logger.warning(f"回答の事前作成に失敗しました: {e}")
+        print(f"回答の事前作成に失敗しました（python prewarm_cache.py で作成し直せます）: {e}", file=sys.stderr)
+        return
+    print(format_prewarm_stats(stats))
+
+
+def write_metrics():
+    """
+    作成にかかった時間などのメトリクスを、textfile collectorで読み込めるファイルに書き出す（失敗してもログ出力のみ）
+    """
+    import metrics
+
+    logger = logging.getLogger(ct.LOGGER_NAME)
+
+    if not ct.METRICS_ENABLED:
+        return
+    path = metrics.get_snapshot_path(ct.INDEX_BUILD_SESSION_ID)
+    try:
+        metrics.write_snapshot(path)
+        print(f"メトリクスを書き出しました: {path}")
+    except OSError as e:
+        logger.warning(f"メトリクスの書き出しエラー: {path} - {e}")
+
+
+def main(argv=None):
+    """
+    コマンドラインからの実行
+    """
+    parser = argparse.ArgumentParser(description="社内文書のインデックスを作成し、アプリが読み込む世代を切り替えます。")
+    parser.add_argument("--no-promote", action="store_true", help="作成のみ行い、CURRENTを切り替えない")
+    parser.add_argument("--force", action="store_true", help="CURRENTの世代より悪化していても切り替える")
+    parser.add_argument("--keep", type=int, default=ct.INDEX_KEEP_VERSIONS, help="残しておく世代数")
+    parser.add_argument("--no-prewarm", action="store_true", help="切り替え前に、よく聞かれる質問の回答を事前に作成しない")
+    args = parser.parse_args(argv)
+
+    initialize_logger(session_id=ct.INDEX_BUILD_SESSION_ID)
+    logger = logging.getLogger(ct.LOGGER_NAME)
+
+    current = index_artifacts.get_current()
+    previous = index_artifacts.read_manifest(current) if current else None
+
+    try:
+        manifest = run_build()
+    except Exception as e:
+        logger.error(f"インデックスの作成に失敗しました: {e}")
+        print(f"インデックスの作成に失敗しました: {e}", file=sys.stderr)
+        return EXIT_FAILED
+
+    print(f"インデックスを作成しました: {manifest['version']}")
+    print(format_report(manifest, previous))
+
+    regressions = find_regressions(manifest, previous)
+    for regression in regressions:
+        logger.warning(f"インデックスの悪化: {regression}")
+        print(f"悪化: {regression}", file=sys.stderr)
+
+    if args.no_promote:
+        print("CURRENTは切り替えませんでした（--no-promote）")
+    elif regressions and not args.force:
+        print(f"CURRENTの世代（{current}）より悪化しているため、切り替えませんでした（--forceで切り替え）", file=sys.stderr)
+    else:
+        # 切り替えた直後に起動したアプリも回答キャッシュを読み込めるよう、回答は切り替える前に作成しておく
+        if ct.ANSWER_PREWARM_ENABLED and not args.no_prewarm:
+            prewarm_answers(manifest["version"])
+        index_artifacts.set_current(manifest["version"])
+        logger.info(f"CURRENTを切り替えました: {current} → {manifest['version']}")
+        print(f"CURRENTを切り替えました: {current} → {manifest['version']}")
+    index_artifacts.prune_versions(args.keep)
+    write_metrics()
+
+    return EXIT_REGRESSION if regressions and not args.force else EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,13 +2,6 @@
 このファイルは、固定の文字列や数値などのデータを変数として一括管理するファイルです。
 """
 
-############################################################
-# ライブラリの読み込み
-############################################################
-from langchain_community.document_loaders import PyMuPDFLoader, Docx2txtLoader, TextLoader
-from langchain_community.document_loaders.csv_loader import CSVLoader
-
-
 ############################################################
 # 共通変数の定義
 ############################################################
@@ -25,6 +18,14 @@ LINK_SOURCE_ICON = ":material/link: "
 WARNING_ICON = ":material/warning:"
 ERROR_ICON = ":material/error:"
 SPINNER_TEXT = "回答生成中..."
+INDEX_PROGRESS_INTERVAL = 1      # インデックス作成の進捗表示を更新する間隔（秒）
+INDEX_LOADING_TEXT = "社内文書を読み込み中です（ファイル: {files_loaded}/{files_total}件）。完了するまでしばらくお待ちください。"
+INDEX_EMBEDDING_TEXT = "社内文書の検索準備中です（ファイル: {files_loaded}/{files_total}件, チャンク: {chunks_embedded}/{chunks_total}件）。完了するまでは簡易検索で回答します。"
+DEGRADED_SEARCH_MESSAGE = "社内文書の検索準備中のため、簡易検索の結果をもとに回答しました。"
+SEARCH_MAIN_MESSAGE = "入力内容に関する情報は、以下のファイルに含まれている可能性があります。"
+SEARCH_SUB_TITLE = "関連資料"
+SEARCH_SUB_MESSAGE = "その他、参考になりそうな資料はこちらです。"
+CONTACT_SOURCE_TITLE = "情報源"
 
 
 # ==========================================
@@ -51,6 +52,10 @@ LOG_DIR_PATH = "./logs"
 LOGGER_NAME = "ApplicationLog"
 LOG_FILE = "application.log"
 APP_BOOT_MESSAGE = "アプリが起動されました。"
+PROFILE_DIR_PATH = f"{LOG_DIR_PATH}/profile"  # 隠しコマンド「/profile」での計測結果の保存先
+PROFILE_TOP_N = 15               # 計測結果として表示・保存する関数・メモリ確保箇所の数
+PROFILE_TRACEMALLOC_FRAMES = 1   # メモリ確保の計測で記録する呼び出し履歴の深さ
+PROFILE_ENABLED_MESSAGE = "次の質問の処理を計測します（cProfile・tracemalloc）。"
 
 
 # ==========================================
@@ -58,17 +63,34 @@ APP_BOOT_MESSAGE = "アプリが起動されました。"
 # ==========================================
 MODEL = "gpt-4o-mini"
 TEMPERATURE = 0.5
+LLM_GATEWAY_ENABLED = True       # LLMの呼び出しを、プロセス内で共有するゲートウェイ経由で行うかどうか
+LLM_MAX_CONCURRENCY = 4          # 同時に実行するLLM呼び出しの上限。環境変数「LLM_MAX_CONCURRENCY」で上書き可能
+LLM_RATE_LIMIT_PER_MINUTE = 300  # 1分あたりのLLM呼び出し数の上限（再試行を含む）。環境変数「LLM_RATE_LIMIT_PER_MINUTE」で上書き可能
+LLM_RATE_LIMIT_BURST = 10        # 瞬間的に許容するLLM呼び出し数
+LLM_MAX_RETRIES = 4              # レート制限などの一時的なエラーの場合に再試行する最大回数
+LLM_RETRY_BASE_DELAY = 0.5       # 再試行までの待機秒数の基準（試行ごとに2倍、0〜その値でランダム）
+LLM_RETRY_MAX_DELAY = 20.0       # 再試行までの待機秒数の上限
+LLM_QUEUE_TIMEOUT = 60           # 同時実行数・呼び出し頻度の上限で待機する最大秒数
+REQUEST_ASYNC_ENABLED = True     # 画面からの回答生成を共有のイベントループで非同期に実行し、結果が不要になった場合にLLM呼び出しをキャンセルするかどうか
+REQUEST_POLL_INTERVAL = 0.2      # 回答生成の完了を待つ間に、画面の再実行・セッションの終了を確認する間隔（秒）
 
 
 # ==========================================
 # RAG参照用のデータソース系
 # ==========================================
 RAG_TOP_FOLDER_PATH = "./data"
+PDF_PAGE_STREAMING = True        # PDFを1ページずつ読み込んでチャンク分割に渡すかどうか（Falseの場合はPyMuPDFLoaderで全ページを一度に読み込む）
+PDF_MAX_PAGES = 1000             # 1つのPDFから読み込む最大ページ数（超えた分のページは読み込まない）
+PDF_MAX_FILE_SIZE = 200 * 1024 * 1024  # 読み込むPDFの最大ファイルサイズ（バイト、超えたファイルは読み込まない）
+PDF_NORMALIZE_TEXT = True        # PDFのページごとに、Unicode正規化（NFKC）・行の途中での改行の連結・連続する空白の除去を行うかどうか
+PDF_WRAP_MIN_WIDTH_RATIO = 0.8   # 行の途中での改行とみなす行の幅（ページ内で最も長い行に対する割合）の下限
+DOCX_STREAMING = True            # Word文書をXMLから直接読み込み、表を「 | 」区切りの行として残すかどうか（Falseの場合はDocx2txtLoaderで読み込む）
+# 拡張子ごとのdata loader（モジュール名, クラス名, 引数）。起動を速くするため、モジュールは初回利用時に読み込む
 SUPPORTED_EXTENSIONS = {
-    ".pdf": PyMuPDFLoader,
-    ".docx": Docx2txtLoader,
-    ".csv": lambda path: CSVLoader(path, encoding="utf-8"),
-    ".txt": TextLoader  # TXTファイル対応を追加
+    ".pdf": ("pdf_loader", "PdfPageLoader", {}) if PDF_PAGE_STREAMING else ("langchain_community.document_loaders", "PyMuPDFLoader", {}),
+    ".docx": ("docx_loader", "DocxLoader", {}) if DOCX_STREAMING else ("langchain_community.document_loaders", "Docx2txtLoader", {}),
+    ".csv": ("langchain_community.document_loaders.csv_loader", "CSVLoader", {"encoding": "utf-8"}),
+    ".txt": ("langchain_community.document_loaders", "TextLoader", {})  # TXTファイル対応を追加
 }
 WEB_URL_LOAD_TARGETS = [
     "https://generative-ai.web-camp.io/"
@@ -78,11 +100,135 @@ WEB_URL_LOAD_TARGETS = [
 # ==========================================
 # RAG設定系
 # ==========================================
-RETRIEVER_DOCUMENT_COUNT = 5     # 検索結果として取得するドキュメント数
+RETRIEVER_DOCUMENT_COUNT = 5     # 検索結果として取得するドキュメント数（関連度による足切りを行う場合は上限）
+RETRIEVER_SCORE_CUTOFF_ENABLED = True  # 検索結果の関連度に応じて、使うドキュメント数を減らすかどうか
+RETRIEVER_MIN_DOCUMENT_COUNT = 1 # 関連度の最低値を満たすものがある場合に、関連度の差に関わらず使うドキュメント数
+# 使うドキュメントの関連度の最低値（1件も満たさない場合はLLMを呼び出さずに「該当なし」と回答）。関連度は「1 - (2 - 2 * コサイン類似度) / √2」
+# 0.69はコサイン類似度0.78に相当（0.6 = 0.72では、ada-002で無関係な日本語の文どうしも上回るため引き上げた暫定値）
+# 埋め込みモデル・正解データを変えた場合は「python eval_retrieval.py --calibrate --openai」の推奨値（社内文書に関する質問の95%以上に検索結果が残り、社内文書に無い質問を最も多く「該当なし」にできる値）で見直す
+RETRIEVER_MIN_RELEVANCE_SCORE = 0.69
+RETRIEVER_MAX_RELATIVE_GAP = 0.1 # 最も関連度の高いドキュメントから、関連度がこの割合を超えて低いドキュメントは使わない
 CHUNK_SIZE = 500                 # チャンク分割サイズ
 CHUNK_OVERLAP = 50               # チャンク分割時のオーバーラップサイズ
 CSV_CHUNK_SIZE = 1               # CSVファイル用のチャンク分割サイズ（行単位）
 CSV_CHUNK_OVERLAP = 0            # CSVファイル用のチャンク分割時のオーバーラップサイズ
+STRUCTURED_SPLIT_ENABLED = True  # 見出しのある文書（議事録・サービス資料など）を見出し単位でチャンク分割するかどうか
+STRUCTURED_CHUNK_MAX_SIZE = 800  # 見出し単位のチャンクの最大文字数（隣り合う見出しをこの範囲でまとめ、1つで超える場合は通常の方法で分割）
+STRUCTURED_MIN_HEADINGS = 2      # 見出し単位で分割する文書（ページ）に必要な見出しの数
+STRUCTURED_HEADING_MAX_LENGTH = 40 # 見出しとみなす行の最大文字数
+REWRITE_HISTORY_MAX_MESSAGES = 6 # 質問の言い換えに使う直近の会話履歴のメッセージ数
+REWRITE_CACHE_SIZE = 256         # 質問の言い換え結果をキャッシュする件数の上限
+SPECULATIVE_RETRIEVAL_ENABLED = True  # 質問の言い換えと並行して、ユーザー入力のままで先に検索を始めるかどうか
+SPECULATIVE_MIN_SIMILARITY = 0.8 # 先に検索した結果を使う、ユーザー入力と言い換え後の質問の類似度（文字bigram）の下限
+SPECULATIVE_RETRIEVAL_WORKERS = 8  # 先に行う検索を実行するスレッド数（プロセス内の全セッションで共有）
+CONTEXT_PACKING_ENABLED = True   # 検索結果のチャンクを結合・選別してからLLMに渡すかどうか
+CONTEXT_TOKEN_BUDGET = 2000      # LLMに渡す文脈（検索結果のチャンク）のトークン数の上限
+CONTEXT_MERGE_MAX_GAP = 2        # 同じファイル・ページのチャンクを隣接とみなす最大の間隔（文字数）
+CONTEXT_MERGE_MIN_OVERLAP = 10   # 位置が分からないチャンク同士を重複とみなす最小の一致文字数
+VECTOR_STORE_BACKEND = "chroma"  # ベクターストアの種類（「chroma」または「numpy」）。環境変数「VECTOR_STORE_BACKEND」で上書き可能
+NUMPY_STORE_DTYPE = "int8"       # numpyベクターストアの保存形式（「float32」「float16」「int8」）
+NUMPY_STORE_BLOCK_ROWS = 8192    # numpyベクターストア（float16）で類似度をまとめて計算する行数
+INDEX_SNAPSHOT_ENABLED = True    # インデックスのスナップショット（mmapで共有できる単一ファイル）を使うかどうか
+INDEX_DIR_PATH = "./index"       # インデックスのスナップショットの保存先
+INDEX_BUILDS_DIR_PATH = f"{INDEX_DIR_PATH}/builds"   # 世代ごとのスナップショットの保存先
+INDEX_CURRENT_PATH = f"{INDEX_DIR_PATH}/CURRENT"     # アプリが読み込む世代名を記録するファイル
+INDEX_KEEP_VERSIONS = 3          # 残しておくスナップショットの世代数（CURRENTの世代は常に残す）
+INDEX_PREBUILT_ONLY = False      # Trueの場合、アプリではインデックスを作成せず、build_index.pyで作成済みのものだけを読み込む。環境変数「INDEX_PREBUILT_ONLY」で上書き可能
+INDEX_REGRESSION_MAX_DROP = 0.1  # build_index.pyで、CURRENTの世代からチャンク数・ファイル数がこの割合を超えて減った場合は切り替えない
+INDEX_SHORT_CHUNK_LENGTH = 20    # build_index.pyのチャンクの統計で、短すぎるチャンクとして数える文字数
+INDEX_WAIT_TIMEOUT = 120         # ファイルの読み込み中に質問された場合、検索できるようになるまで待機する最大秒数
+EMBEDDING_BATCH_SIZE = 100       # ベクターストア作成時に、まとめて埋め込むチャンク数（進捗表示の単位）
+INGEST_QUEUE_SIZE = 4            # 取り込みの各段階（読み込み・分割・埋め込み・追加）の間で待機させる件数の上限（超えると前段が待つ）
+INGEST_EMBED_WORKERS = 2         # 取り込み時に同時に埋め込みを行うスレッド数
+INGEST_LOG_INTERVAL = 10         # 取り込み中の処理件数・メモリ使用量をログ出力する間隔（秒）
+INGEST_DEDUP_ENABLED = True      # 取り込み時に、同じファイル内で正規化したテキストが同じチャンクを1件だけ埋め込むかどうか
+BOILERPLATE_STRIP_ENABLED = True # 取り込み時に、PDFのほとんどのページに現れるヘッダー・フッター・ページ番号の行を取り除くかどうか
+BOILERPLATE_SAMPLE_PAGES = 10    # ヘッダー・フッターの判定に使う、ファイル先頭からのページ数（この分だけ読み込みを先行させる）
+BOILERPLATE_MIN_PAGES = 3        # ヘッダー・フッターの判定を行うファイルの最小ページ数
+BOILERPLATE_MIN_PAGE_RATIO = 0.6 # この割合以上のページの先頭・末尾に現れる行をヘッダー・フッターとみなす
+BOILERPLATE_EDGE_LINES = 2       # ページの先頭・末尾から、ヘッダー・フッターの候補にする行数
+
+
+# ==========================================
+# ファイル監視系
+# ==========================================
+FILE_WATCH_ENABLED = True        # 参照先フォルダの変更を監視し、インデックスに自動で反映するかどうか
+FILE_WATCH_BACKEND = "auto"      # 監視方法（「auto」: inotifyを優先、「inotify」、「polling」）
+FILE_WATCH_DEBOUNCE = 1.0        # 最後の変更からこの秒数だけ変更がなければ、まとめて反映する
+FILE_WATCH_MAX_DELAY = 10.0      # 変更が続く場合でも、最初の変更からこの秒数が経てば反映する
+FILE_WATCH_POLL_INTERVAL = 2.0   # ポーリングで監視する場合の確認間隔（秒）
+
+
+# ==========================================
+# インデックスサーバー系
+# ==========================================
+INDEX_SERVER_URL = ""            # インデックスサーバーの接続先（「http://127.0.0.1:8765」「unix:///tmp/index.sock」など。空の場合はプロセス内でインデックスを作成）。環境変数「INDEX_SERVER_URL」で上書き可能
+INDEX_SERVER_HOST = "127.0.0.1"  # index_server.pyが待ち受けるホスト
+INDEX_SERVER_PORT = 8765         # index_server.pyが待ち受けるポート番号
+INDEX_SERVER_BATCH_WAIT = 0.005  # 同時に届いた検索のクエリをまとめて埋め込むために待つ秒数
+INDEX_SERVER_BATCH_SIZE = 64     # まとめて埋め込むクエリ数の上限
+INDEX_CLIENT_POOL_SIZE = 8       # インデックスサーバーへの接続を使い回す数の上限（プロセスごと）
+INDEX_CLIENT_TIMEOUT = 30        # インデックスサーバーへのリクエストのタイムアウト（秒）
+INDEX_CLIENT_STATUS_TTL = 2.0    # インデックスサーバーの作成状況を問い合わせ直すまでの秒数（画面の再描画ごとに問い合わせない）
+
+
+# ==========================================
+# 回答キャッシュ系
+# ==========================================
+ANSWER_CACHE_ENABLED = True      # 会話履歴のない質問（セッションの最初の質問）の回答をキャッシュし、同じ質問にはLLMを呼び出さずに回答するかどうか
+ANSWER_CACHE_SIZE = 512          # 回答をキャッシュする件数の上限（事前に作成した回答を含む）
+ANSWER_PREWARM_ENABLED = True    # build_index.pyでインデックスを作成した後に、よく聞かれる質問の回答を事前に作成するかどうか
+ANSWER_PREWARM_TOP_N = 50        # 回答を事前に作成する質問数の上限（サイドバーの入力例を含む）
+ANSWER_PREWARM_MIN_COUNT = 2     # ログから選ぶ質問の最低の出現回数（サイドバーの入力例は常に選ぶ）
+ANSWER_PREWARM_WORKERS = 4       # 回答を事前に作成する際の同時実行数
+ANSWER_PREWARM_SESSION_ID = "prewarm-cache"  # 回答の事前作成（prewarm_cache.py）時にログへ出力するセッションID
+
+
+# ==========================================
+# メトリクス系
+# ==========================================
+METRICS_ENABLED = True           # 処理件数・処理時間などのメトリクスを、Prometheusのテキスト形式で公開・書き出すかどうか
+METRICS_HOST = "127.0.0.1"       # メトリクスを公開するHTTPの待ち受けホスト
+METRICS_PORT = 9464              # メトリクスを公開するHTTPのポート番号（「/metrics」。0の場合は公開しない）。環境変数「METRICS_PORT」で上書き可能
+METRICS_PORT_RANGE = 16          # 同じホストで複数のプロセスを起動する場合に、METRICS_PORTから順に空きを探すポート数（環境変数「METRICS_WORKER_ID」が数値の場合は「METRICS_PORT + ワーカー番号」を使う）
+METRICS_DIR_PATH = f"{LOG_DIR_PATH}/metrics"  # メトリクスのファイル（「app_<プロセスの識別名>.prom」など）の書き出し先
+METRICS_SNAPSHOT_INTERVAL = 15   # メトリクスをファイルに書き出す間隔（秒、0の場合は書き出さない）
+METRICS_LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60]  # 処理時間のヒストグラムのバケット（秒）
+METRICS_BUILD_BUCKETS = [1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600]       # インデックスの作成時間のヒストグラムのバケット（秒）
+
+
+# ==========================================
+# 会話ログ系
+# ==========================================
+SESSION_MAX_TURNS = 200          # 1セッションで保持する会話ログの件数の上限（超えた場合は古いものから削除）
+SESSION_MAX_BYTES = 512 * 1024   # 1セッションの会話ログのメモリ使用量の上限（バイト、概算）
+SESSION_IDLE_TIMEOUT = 3600      # この秒数だけ操作のないセッションの会話ログを削除する
+SESSION_SWEEP_INTERVAL = 300     # 操作のないセッションの確認・メモリ使用量のログ出力を行う間隔（秒）
+
+
+# ==========================================
+# バッチ処理系
+# ==========================================
+BATCH_DEFAULT_WORKERS = 4        # バッチ回答時の同時実行数
+BATCH_SESSION_ID = "batch"       # バッチ処理時にログへ出力するセッションID
+INDEX_BUILD_SESSION_ID = "build-index"  # インデックス作成（build_index.py）時にログへ出力するセッションID
+BATCH_MODE_ALIASES = {
+    "search": ANSWER_MODE_1,
+    "inquiry": ANSWER_MODE_2
+}
+
+
+# ==========================================
+# 検索精度の評価系
+# ==========================================
+EVAL_GOLDEN_SET_PATH = "./eval/golden_set.jsonl"  # 質問と、回答の根拠となるファイル・ページの組（正解データ）のファイル
+EVAL_CHUNK_SIZES = [300, 500, 800]   # eval_retrieval.pyで比較するチャンク分割サイズ
+EVAL_CHUNK_OVERLAPS = [0, 50, 100]   # eval_retrieval.pyで比較するチャンク分割時のオーバーラップサイズ
+EVAL_K_VALUES = [1, 3, 5, 10]        # eval_retrieval.pyで比較する検索結果のドキュメント数
+EVAL_EMBEDDING_SIZE = 1024       # eval_retrieval.pyで使う、APIを呼ばない決定的な埋め込みの次元数
+EVAL_SESSION_ID = "eval-retrieval"  # 検索精度の評価（eval_retrieval.py）時にログへ出力するセッションID
+EVAL_SCORE_THRESHOLDS = [round(0.40 + 0.02 * i, 2) for i in range(26)]  # eval_retrieval.py --calibrateで比較する関連度の最低値（0.40〜0.90）
+EVAL_MIN_ANSWERED_RATIO = 0.95   # 関連度の最低値を選ぶ際に、社内文書に関する質問で検索結果が残る割合の下限
 
 
 # ==========================================
@@ -106,11 +252,8 @@ SYSTEM_PROMPT_DOC_SEARCH = """
     以下の条件に基づき、ユーザー入力に対して回答してください。
 
     【条件】
-    1. ユーザー入力内容と以下の文脈との間に関連性がある場合、空文字「""」を返してください。
-    2. ユーザー入力内容と以下の文脈との関連性が明らかに低い場合、「該当資料なし」と回答してください。
-
-    【文脈】
-    {context}
+    1. ユーザー入力内容と、ユーザー入力の後の【文脈】との間に関連性がある場合、空文字「""」を返してください。
+    2. ユーザー入力内容と、ユーザー入力の後の【文脈】との関連性が明らかに低い場合、「該当資料なし」と回答してください。
 """
 
 SYSTEM_PROMPT_INQUIRY = """
@@ -118,15 +261,22 @@ SYSTEM_PROMPT_INQUIRY = """
     以下の条件に基づき、ユーザー入力に対して回答してください。
 
     【条件】
-    1. ユーザー入力内容と以下の文脈との間に関連性がある場合のみ、以下の文脈に基づいて回答してください。
-    2. ユーザー入力内容と以下の文脈との関連性が明らかに低い場合、「回答に必要な情報が見つかりませんでした。」と回答してください。
-    3. 憶測で回答せず、あくまで以下の文脈を元に回答してください。
+    1. ユーザー入力内容と、ユーザー入力の後の【文脈】との間に関連性がある場合のみ、【文脈】に基づいて回答してください。
+    2. ユーザー入力内容と【文脈】との関連性が明らかに低い場合、「回答に必要な情報が見つかりませんでした。」と回答してください。
+    3. 憶測で回答せず、あくまで【文脈】を元に回答してください。
     4. できる限り詳細に、マークダウン記法を使って回答してください。
     5. マークダウン記法で回答する際にhタグの見出しを使う場合、最も大きい見出しをh3としてください。
     6. 複雑な質問の場合、各項目についてそれぞれ詳細に回答してください。
-    7. 必要と判断した場合は、以下の文脈に基づかずとも、一般的な情報を回答してください。
+    7. 必要と判断した場合は、【文脈】に基づかずとも、一般的な情報を回答してください。
+"""
+
+# 回答用のプロンプトの最後のメッセージ（ユーザー入力と、検索結果の文脈）
+# 質問ごとに変わる文脈を最後に置き、システムプロンプト・会話履歴までの先頭部分を毎回同じにして、
+# OpenAI側のプロンプトキャッシュが効くようにする
+HUMAN_PROMPT_WITH_CONTEXT = """{input}
 
-    {context}
+【文脈】
+{context}
 """
 
 
@@ -149,8 +299,12 @@ NO_DOC_MATCH_MESSAGE = """
 CONVERSATION_LOG_ERROR_MESSAGE = "過去の会話履歴の表示に失敗しました。"
 GET_LLM_RESPONSE_ERROR_MESSAGE = "回答生成に失敗しました。"
 DISP_ANSWER_ERROR_MESSAGE = "回答表示に失敗しました。"
+DISP_ANSWER_RETRY_MESSAGE = "回答の表示中にエラーが発生しました。もう一度お試しください。"
 INVALID_RESPONSE_ERROR = "無効な応答形式です。もう一度お試しください。"
 RETRIEVER_NOT_INITIALIZED_ERROR = "情報検索システムの準備ができていません。"
+INDEX_NOT_BUILT_MESSAGE = "作成済みのインデックスがありません。「python build_index.py」で作成してください。"
+INDEX_SERVER_UNAVAILABLE_MESSAGE = "インデックスサーバーに接続できません。「python index_server.py」が起動しているか確認してください。"
+LLM_QUEUE_TIMEOUT_MESSAGE = "回答生成の混雑のため、一定時間内に処理を開始できませんでした。"
 
 
 # ==========================================
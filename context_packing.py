@@ -0,0 +1,190 @@
+"""
+このファイルは、検索で取得したチャンクを、LLMに渡す文脈（{context}）へ詰め込む処理のファイルです。
+同じファイル・ページの隣接・重複するチャンクを結合して重複部分を除き、トークン数の上限内に関連性の高い順で詰め込みます。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import logging
+from langchain_core.documents import Document as LangchainDoc
+import utils
+import constants as ct
+
+
+############################################################
+# 関数定義
+############################################################
+
+def pack_documents(documents, token_budget=ct.CONTEXT_TOKEN_BUDGET):
+    """
+    検索結果のチャンクを、トークン数の上限内に収まるよう結合・選別
+
+    Args:
+        documents: 検索結果のチャンク（関連性が高い順）
+        token_budget: 文脈に使うトークン数の上限
+
+    Returns:
+        結合・選別後のチャンクのリスト（関連性が高い順）
+    """
+    logger = logging.getLogger(ct.LOGGER_NAME)
+
+    if not documents:
+        return []
+
+    merged_docs = merge_documents(documents)
+
+    packed_docs = []
+    used_tokens = 0
+    for doc in merged_docs:
+        tokens = utils.count_tokens(doc.page_content)
+        if used_tokens + tokens > token_budget:
+            # 最も関連性が高いチャンクは、上限を超える場合でも切り詰めて必ず残す
+            if not packed_docs:
+                packed_docs.append(truncate_document(doc, token_budget))
+                used_tokens = token_budget
+            continue
+        packed_docs.append(doc)
+        used_tokens += tokens
+
+    original_tokens = sum(utils.count_tokens(doc.page_content) for doc in documents)
+    logger.info(
+        f"文脈の詰め込み: {len(documents)}件→{len(packed_docs)}件, "
+        f"{original_tokens}→{used_tokens}トークン（上限{token_budget}）"
+    )
+
+    return packed_docs
+
+
+def merge_documents(documents):
+    """
+    同じファイル・ページのチャンクのうち、隣接・重複するものを1つに結合
+    結合後のチャンクは、含まれるチャンクのうち最も関連性が高いものの順位に置く
+
+    Args:
+        documents: 検索結果のチャンク（関連性が高い順）
+
+    Returns:
+        結合後のチャンクのリスト（関連性が高い順）
+    """
+    # (ファイル, ページ) → 結合対象のチャンクのグループ（グループの順番が関連性の順位になる）
+    groups = {}
+    seen_texts = set()
+    for doc in documents:
+        # 完全に同じ内容のチャンクは1つだけ残す
+        if doc.page_content in seen_texts:
+            continue
+        seen_texts.add(doc.page_content)
+        key = (doc.metadata.get("source"), doc.metadata.get("page"))
+        groups.setdefault(key, []).append(doc)
+
+    merged_docs = []
+    for group in groups.values():
+        merged_docs.extend(_merge_group(group))
+
+    # グループ内で分かれたチャンクも含め、元の関連性の順位で並べ直す
+    rank = {id(doc): i for i, doc in enumerate(documents)}
+    merged_docs.sort(key=lambda item: rank[id(item[0])])
+
+    return [doc for _, doc in merged_docs]
+
+
+def _merge_group(group):
+    """
+    同じファイル・ページのチャンクのグループを、元の文書内の位置順に並べて結合
+
+    Returns:
+        (グループ内で最も関連性が高い元のチャンク, 結合後のチャンク)のタプルのリスト
+    """
+    if len(group) == 1:
+        return [(group[0], group[0])]
+
+    # 元の文書内の位置（start_index）が分かるチャンクは位置順に、分からない場合は関連性の順のまま扱う
+    if all("start_index" in doc.metadata for doc in group):
+        ordered = sorted(group, key=lambda doc: doc.metadata["start_index"])
+    else:
+        ordered = list(group)
+    rank = {id(doc): i for i, doc in enumerate(group)}
+
+    results = []
+    current_text = ordered[0].page_content
+    current_best = ordered[0]
+    current_end = _end_index(ordered[0])
+    for doc in ordered[1:]:
+        overlap = _overlap_length(current_text, current_end, doc)
+        if overlap is None:
+            results.append((current_best, _merged_document(current_best, current_text)))
+            current_text = doc.page_content
+            current_best = doc
+        else:
+            current_text = _join(current_text, doc.page_content[overlap:], gap=overlap == 0)
+            if rank[id(doc)] < rank[id(current_best)]:
+                current_best = doc
+        current_end = _end_index(doc) if current_end is None or _end_index(doc) is None else max(current_end, _end_index(doc))
+    results.append((current_best, _merged_document(current_best, current_text)))
+
+    return results
+
+
+def _overlap_length(current_text, current_end, doc):
+    """
+    直前までの結合済みテキストと次のチャンクが重複・隣接しているかを判定
+
+    Returns:
+        次のチャンクの先頭から除く文字数（隣接している場合は0）。離れている場合はNone
+    """
+    start = doc.metadata.get("start_index")
+    if current_end is not None and start is not None:
+        # チャンク分割時に取り除かれた区切り文字の分だけ離れている場合も隣接とみなす
+        if start > current_end + ct.CONTEXT_MERGE_MAX_GAP:
+            return None
+        return max(0, min(current_end - start, len(doc.page_content)))
+
+    # 位置が分からない場合、前のチャンクの末尾と次のチャンクの先頭が一致する長さから重複を判定
+    text = doc.page_content
+    max_length = min(len(current_text), len(text), ct.CHUNK_OVERLAP * 2)
+    for length in range(max_length, ct.CONTEXT_MERGE_MIN_OVERLAP - 1, -1):
+        if current_text.endswith(text[:length]):
+            return length
+    return None
+
+
+def _end_index(doc):
+    start = doc.metadata.get("start_index")
+    return None if start is None else start + len(doc.page_content)
+
+
+def _join(text, addition, gap):
+    if not addition:
+        return text
+    return f"{text}\n{addition}" if gap else text + addition
+
+
+def _merged_document(best_doc, text):
+    if text == best_doc.page_content:
+        return best_doc
+    return LangchainDoc(page_content=text, metadata=dict(best_doc.metadata))
+
+
+def truncate_document(doc, token_budget):
+    """
+    チャンクの末尾を削り、トークン数を上限内に収める
+
+    Args:
+        doc: 対象のチャンク
+        token_budget: トークン数の上限
+
+    Returns:
+        切り詰めたチャンク
+    """
+    text = doc.page_content
+    low, high = 0, len(text)
+    # 上限に収まる最長の先頭部分を二分探索で求める
+    while low < high:
+        middle = (low + high + 1) // 2
+        if utils.count_tokens(text[:middle]) <= token_budget:
+            low = middle
+        else:
+            high = middle - 1
+
+    return LangchainDoc(page_content=text[:low], metadata=dict(doc.metadata))
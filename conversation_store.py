@@ -0,0 +1,290 @@
+"""
+このファイルは、会話ログを画面表示とLLMへの会話履歴の両方で共有する、省メモリの形式で保持するファイルです。
+参照元のドキュメントは、ドキュメント本体ではなく（ファイルパス, ページ番号）の番号だけを保持します。
+セッションごとの会話ログには上限を設け、一定時間操作のないセッションの会話ログは削除します。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import sys
+import time
+import logging
+import threading
+from dataclasses import dataclass
+from metrics import set_session_memory
+import constants as ct
+
+
+############################################################
+# 変数の定義
+############################################################
+# 会話ログ1件の表示形式
+KIND_TEXT = "text"              # テキストをそのまま表示
+KIND_SEARCH = "search"          # 「社内文書検索」: 関連性の高いファイルのありかを表示
+KIND_NO_MATCH = "no_match"      # 「社内文書検索」: 関連するファイルが見つからなかった旨を表示
+KIND_CONTACT = "contact"        # 「社内問い合わせ」: 回答と情報源のありかを表示
+KIND_ERROR = "error"            # 回答の表示に失敗した旨を表示
+
+# プロセス内で共有する参照元の一覧・セッションごとの会話ログ（初回利用時に作成）
+_source_table = None
+_registry = None
+_shared_lock = threading.Lock()
+
+
+############################################################
+# クラス定義
+############################################################
+
+@dataclass(slots=True)
+class Turn:
+    """
+    会話ログ1件分（ユーザー入力またはLLMからの回答）
+    """
+    # 「user」または「assistant」
+    role: str
+    # ユーザー入力値、またはLLMからの回答（会話履歴としてLLMに渡す内容）
+    text: str
+    # 回答モード
+    mode: str = ""
+    # 画面での表示形式
+    kind: str = KIND_TEXT
+    # 参照元の番号（SourceTableに登録した番号）
+    sources: tuple = ()
+    # LLMへの会話履歴に含めるかどうか（隠しコマンドや、回答取得に失敗した入力は含めない）
+    in_history: bool = True
+
+
+class SourceTable:
+    """
+    参照元の（ファイルパス, ページ番号）に番号を振り、全セッションで共有する一覧
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._items = []
+        self._lock = threading.Lock()
+
+    def intern(self, source, page=None):
+        """
+        参照元の番号を取得（未登録の場合は登録）
+
+        Args:
+            source: ファイルパスまたはURL
+            page: ページ番号
+
+        Returns:
+            参照元の番号
+        """
+        key = (source, page)
+        with self._lock:
+            source_id = self._ids.get(key)
+            if source_id is None:
+                source_id = len(self._items)
+                self._ids[key] = source_id
+                self._items.append(key)
+            return source_id
+
+    def get(self, source_id):
+        """
+        番号から参照元を取得
+
+        Returns:
+            (ファイルパス, ページ番号)のタプル
+        """
+        return self._items[source_id]
+
+
+class ConversationStore:
+    """
+    1セッション分の会話ログ（上限を超えた場合は古いものから削除）
+    """
+    __slots__ = ("turns", "nbytes", "last_access")
+
+    def __init__(self):
+        self.turns = []
+        # 会話ログが使っているメモリの概算（バイト）
+        self.nbytes = 0
+        self.last_access = time.monotonic()
+
+    def __len__(self):
+        return len(self.turns)
+
+    def add(self, turn):
+        """
+        会話ログを追加
+
+        Args:
+            turn: 追加する会話ログ
+        """
+        self.turns.append(turn)
+        self.nbytes += _turn_size(turn)
+        # 件数・メモリの上限を超えた場合、古い会話ログから削除
+        evicted = False
+        while len(self.turns) > 1 and (len(self.turns) > ct.SESSION_MAX_TURNS or self.nbytes > ct.SESSION_MAX_BYTES):
+            self.nbytes -= _turn_size(self.turns.pop(0))
+            evicted = True
+        # 質問を削除した回答が先頭に残らないよう、先頭がユーザー入力になるまで削除
+        while evicted and len(self.turns) > 1 and self.turns[0].role != "user":
+            self.nbytes -= _turn_size(self.turns.pop(0))
+
+    def chat_history(self):
+        """
+        LLMに渡す会話履歴を作成
+
+        Returns:
+            LangChainのメッセージのリスト
+        """
+        from langchain_core.messages import AIMessage, HumanMessage
+
+        return [
+            HumanMessage(content=turn.text) if turn.role == "user" else AIMessage(content=turn.text)
+            for turn in self.turns if turn.in_history
+        ]
+
+
+class SessionRegistry:
+    """
+    全セッションの会話ログを保持し、一定時間操作のないセッションの会話ログを削除するクラス
+    """
+
+    def __init__(self):
+        self._stores = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def get(self, session_id):
+        """
+        セッションの会話ログを取得（存在しない・削除済みの場合は新規作成）
+
+        Args:
+            session_id: セッションID
+
+        Returns:
+            ConversationStore
+        """
+        now = time.monotonic()
+        with self._lock:
+            store = self._stores.get(session_id)
+            if store is None:
+                store = ConversationStore()
+                self._stores[session_id] = store
+            store.last_access = now
+            sweep = now - self._last_sweep >= ct.SESSION_SWEEP_INTERVAL
+            if sweep:
+                self._last_sweep = now
+        if sweep:
+            self.evict_idle()
+        return store
+
+    def evict_idle(self, idle_timeout=ct.SESSION_IDLE_TIMEOUT):
+        """
+        一定時間操作のないセッションの会話ログを削除し、メモリ使用量をログとメトリクスに出力
+
+        Args:
+            idle_timeout: 削除するまでの操作のない秒数
+
+        Returns:
+            削除したセッション数
+        """
+        logger = logging.getLogger(ct.LOGGER_NAME)
+
+        now = time.monotonic()
+        with self._lock:
+            idle_ids = [session_id for session_id, store in self._stores.items() if now - store.last_access > idle_timeout]
+            for session_id in idle_ids:
+                del self._stores[session_id]
+
+        stats = self.memory_stats()
+        set_session_memory(stats, len(idle_ids))
+        logger.info(
+            f"会話ログのメモリ使用量: {stats['bytes'] / 1024:.1f}KB"
+            f"（{stats['sessions']}セッション, {stats['turns']}件, 操作のない{len(idle_ids)}セッションを削除）"
+        )
+        return len(idle_ids)
+
+    def memory_stats(self):
+        """
+        会話ログのメモリ使用量を集計
+
+        Returns:
+            セッション数（sessions）・会話ログの件数（turns）・メモリ使用量の概算（bytes）の辞書
+        """
+        with self._lock:
+            stores = list(self._stores.values())
+        return {
+            "sessions": len(stores),
+            "turns": sum(len(store) for store in stores),
+            "bytes": sum(store.nbytes for store in stores)
+        }
+
+
+############################################################
+# 関数定義
+############################################################
+
+def get_source_table():
+    """
+    プロセス内で共有する参照元の一覧を取得
+
+    Returns:
+        SourceTable
+    """
+    global _source_table
+
+    with _shared_lock:
+        if _source_table is None:
+            _source_table = SourceTable()
+        return _source_table
+
+
+def get_registry():
+    """
+    プロセス内で共有する全セッションの会話ログを取得
+
+    Returns:
+        SessionRegistry
+    """
+    global _registry
+
+    with _shared_lock:
+        if _registry is None:
+            _registry = SessionRegistry()
+        return _registry
+
+
+def get_conversation(session_id):
+    """
+    セッションの会話ログを取得
+
+    Args:
+        session_id: セッションID
+
+    Returns:
+        ConversationStore
+    """
+    return get_registry().get(session_id)
+
+
+def source_ids(documents):
+    """
+    ドキュメントの参照元を、重複を除いた番号のタプルに変換（関連性の順序は保つ）
+
+    Args:
+        documents: ドキュメントのリスト
+
+    Returns:
+        参照元の番号のタプル
+    """
+    table = get_source_table()
+    ids = []
+    for document in documents:
+        source_id = table.intern(document.metadata.get("source"), document.metadata.get("page"))
+        if source_id not in ids:
+            ids.append(source_id)
+    return tuple(ids)
+
+
+def _turn_size(turn):
+    # 会話ログ1件のメモリ使用量の概算（文字列・参照元の番号を含む）
+    return sys.getsizeof(turn) + sys.getsizeof(turn.text) + sys.getsizeof(turn.sources)
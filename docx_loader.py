@@ -0,0 +1,176 @@
+"""
+このファイルは、Word文書（.docx）を、zipの中の「word/document.xml」から直接読み込むdata loaderのファイルです。
+python-docxのように文書全体のオブジェクトを作らず、XMLを先頭から順に解析しながら（iterparse）テキストを取り出すため、速く省メモリです。
+段落・見出し・表の行を文書内の順序のまま取り出し、表の行はセルを「 | 」でつないだ1行にして、表の構造が分かるようにします。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import zipfile
+import logging
+import xml.etree.ElementTree as ET
+from langchain_core.documents import Document as LangchainDoc
+from langchain_core.document_loaders import BaseLoader
+import constants as ct
+
+
+############################################################
+# 変数の定義
+############################################################
+# WordprocessingMLの名前空間
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+# 互換用の代替表現（テキストボックスなどが同じ内容で2回現れる）の名前空間
+MC = "{http://schemas.openxmlformats.org/markup-compatibility/2006}"
+
+# 取り出す要素の種類
+BLOCK_PARAGRAPH = "paragraph"
+BLOCK_HEADING = "heading"
+BLOCK_TABLE_ROW = "table_row"
+
+# 表の行で、セルをつなぐ文字列
+TABLE_CELL_SEPARATOR = " | "
+
+
+############################################################
+# クラス定義
+############################################################
+
+class DocxLoader(BaseLoader):
+    """
+    Word文書（.docx）の段落・見出し・表を、文書内の順序のまま1つのドキュメントとして読み込むdata loader
+    （メタデータはDocx2txtLoaderと同じ形式）
+    """
+
+    def __init__(self, file_path):
+        """
+        Args:
+            file_path: Word文書のパス
+        """
+        self.file_path = file_path
+
+    def lazy_load(self):
+        """
+        Word文書を読み込む
+
+        Returns:
+            ドキュメントのジェネレーター（1ファイルにつき1件）
+        """
+        text = "\n".join(text for _, text in iter_docx_blocks(self.file_path))
+        yield LangchainDoc(page_content=text, metadata={"source": self.file_path})
+
+
+############################################################
+# 関数定義
+############################################################
+
+def iter_docx_blocks(path):
+    """
+    Word文書の段落・見出し・表の行を、文書内の順序で1つずつ取り出す
+
+    Args:
+        path: Word文書のパス
+
+    Returns:
+        (要素の種類, テキスト)のタプルのジェネレーター（空の段落は含まない）
+    """
+    with zipfile.ZipFile(path) as docx:
+        heading_styles = read_heading_styles(docx)
+
+        with docx.open("word/document.xml") as document_xml:
+            body = None
+            # 解析中の段落のテキスト（テキストボックスでは段落の中に段落があるため、入れ子ごとに持つ）
+            paragraphs = []
+            # 解析中の表の行・セル（表の中の表は、外側のセルのテキストとしてまとめる）
+            rows = []
+            cells = []
+            # 互換用の代替表現（mc:Fallback）の中は、同じ内容の重複のため読み飛ばす
+            skip_depth = 0
+            heading = False
+
+            for event, elem in ET.iterparse(document_xml, events=("start", "end")):
+                tag = elem.tag
+
+                if tag == f"{MC}Fallback":
+                    skip_depth += 1 if event == "start" else -1
+                    continue
+                if skip_depth:
+                    continue
+
+                if event == "start":
+                    if tag == f"{W}body":
+                        body = elem
+                    elif tag == f"{W}p":
+                        paragraphs.append([])
+                    elif tag == f"{W}tr":
+                        rows.append([])
+                    elif tag == f"{W}tc":
+                        cells.append([])
+                    continue
+
+                # 以降は要素の終わり（子要素まで読み込み済み）
+                if tag == f"{W}t" and paragraphs:
+                    paragraphs[-1].append(elem.text or "")
+                elif tag == f"{W}tab" and paragraphs:
+                    paragraphs[-1].append("\t")
+                elif tag in (f"{W}br", f"{W}cr") and paragraphs:
+                    paragraphs[-1].append("\n")
+                elif tag == f"{W}pStyle":
+                    heading = elem.get(f"{W}val") in heading_styles
+                elif tag == f"{W}outlineLvl":
+                    # アウトラインレベル「9」は本文
+                    heading = elem.get(f"{W}val") != "9"
+                elif tag == f"{W}p":
+                    text = "".join(paragraphs.pop()).strip()
+                    is_heading, heading = heading, False
+                    if text and cells:
+                        cells[-1].append(" ".join(text.split()))
+                    elif text:
+                        yield (BLOCK_HEADING if is_heading else BLOCK_PARAGRAPH), text
+                elif tag == f"{W}tc":
+                    cell = " ".join(cells.pop())
+                    if cells:
+                        # 表の中の表のセルは、外側のセルのテキストに含める
+                        cells[-1].append(cell)
+                    elif rows:
+                        rows[-1].append(cell)
+                elif tag == f"{W}tr":
+                    row = rows.pop()
+                    if cells:
+                        cells[-1].append(TABLE_CELL_SEPARATOR.join(cell for cell in row if cell))
+                    elif any(row):
+                        yield BLOCK_TABLE_ROW, TABLE_CELL_SEPARATOR.join(row)
+
+                # 読み終えた本文直下の段落・表は解放し、文書全体の要素をメモリに溜め込まない
+                if body is not None and tag in (f"{W}p", f"{W}tbl", f"{W}sdt") and not paragraphs and not cells:
+                    body.clear()
+
+
+def read_heading_styles(docx):
+    """
+    見出しのスタイルのIDを取得（日本語版のWordではスタイルIDが「1」「2」などになるため、スタイル名で判定する）
+
+    Args:
+        docx: Word文書のzipファイル
+
+    Returns:
+        見出しのスタイルIDの集合
+    """
+    logger = logging.getLogger(ct.LOGGER_NAME)
+
+    heading_styles = set()
+    try:
+        with docx.open("word/styles.xml") as styles_xml:
+            for _, elem in ET.iterparse(styles_xml):
+                if elem.tag != f"{W}style":
+                    continue
+                name = elem.find(f"{W}name")
+                name = (name.get(f"{W}val") if name is not None else "").lower()
+                outline_level = elem.find(f"{W}pPr/{W}outlineLvl")
+                if name.startswith(("heading", "title", "見出し", "表題")) or (outline_level is not None and outline_level.get(f"{W}val") != "9"):
+                    heading_styles.add(elem.get(f"{W}styleId"))
+                elem.clear()
+    except KeyError:
+        # スタイルの定義が無い文書は、スタイルIDだけで判定する
+        logger.debug(f"スタイルの定義がありません: {docx.filename}")
+    return heading_styles | {"Heading1", "Heading2", "Heading3", "Heading4", "Heading5", "Heading6", "Title"}
@@ -0,0 +1,399 @@
+"""
+このファイルは、チャンク分割の設定と検索結果のドキュメント数（k）ごとに、検索精度と速度を比較する評価のファイルです。
+
+使い方:
+    python eval_retrieval.py
+    python eval_retrieval.py --chunk-sizes 300 500 --chunk-overlaps 50 -k 1 3 5 -o eval_report.json
+    python eval_retrieval.py --calibrate --openai   関連度の最低値（RETRIEVER_MIN_RELEVANCE_SCORE）をOpenAIの埋め込みで調整
+
+正解データ（JSONL）の1行は、以下の形式の質問と、回答の根拠となるファイル・ページの組です。
+    {"id": "g01", "question": "質問文", "sources": [{"source": "会社について/会社概要.pdf", "page": 0}]}
+「source」は参照先フォルダ（./data）からの相対パス、「page」はPDFの0始まりのページ番号です（ページの無いファイルは省略）。
+「sources」のいずれかが検索結果に含まれていれば正解とみなします。
+社内文書に無い質問（「該当なし」と回答すべき質問）は、「"sources": [], "off_topic": true」とします。
+
+OpenAIのAPIを呼ばずに何度でも比較できるよう、埋め込みには文字bigramを特徴量ハッシュで固定長にした決定的な埋め込みを使います。
+そのため精度の値はOpenAIの埋め込みでの値とは一致しませんが、設定の違いによる増減の傾向を比べることはできます。
+Webページは取得のたびに内容が変わりうるため、評価には含めません。
+関連度の値は埋め込みモデルによって大きく変わるため、関連度の最低値の調整（--calibrate）は、--openaiでアプリと同じ埋め込みを使って行います。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import warnings
+import itertools
+import statistics
+from collections import Counter
+from functools import lru_cache
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from initialize import initialize_logger, create_splitters, create_vector_store, iter_target_files
+from adaptive_retriever import select_by_score
+from ingest_pipeline import IngestPipeline
+from lexical_index import tokenize
+import constants as ct
+
+
+############################################################
+# クラス定義
+############################################################
+
+class HashingEmbeddings(Embeddings):
+    """
+    索引語（文字bigramと英数字の単語）の出現回数を、特徴量ハッシュで固定長のベクトルにする決定的な埋め込み
+    同じテキストからは常に同じベクトルを作成するため、評価の結果を再現できる
+    """
+
+    def __init__(self, size=ct.EVAL_EMBEDDING_SIZE):
+        """
+        Args:
+            size: 埋め込みベクトルの次元数
+        """
+        self.size = size
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+    def _embed(self, text):
+        vector = np.zeros(self.size, dtype=np.float32)
+        for term, count in Counter(tokenize(text)).items():
+            index, sign = _hash_term(term, self.size)
+            # 長い文書で頻出語の影響が大きくなりすぎないよう、出現回数は対数で重み付けする
+            vector[index] += sign * (1.0 + np.log(count))
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+        return vector.tolist()
+
+
+############################################################
+# 関数定義
+############################################################
+
+def load_golden_set(path):
+    """
+    正解データ（JSONL）の読み込み
+
+    Args:
+        path: 正解データのパス
+
+    Returns:
+        質問の辞書のリスト（「expected」は正解とみなす（ファイルパス, ページ番号）の集合。社内文書に無い質問は空の集合）
+    """
+    items = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            off_topic = bool(item.get("off_topic"))
+            if off_topic and item.get("sources"):
+                raise ValueError(f"{path}:{line_number} 社内文書に無い質問に、正解のファイルが指定されています")
+            if not off_topic and not item.get("sources"):
+                raise ValueError(f"{path}:{line_number} 正解のファイルが指定されていません")
+            for source in item["sources"]:
+                if not os.path.exists(os.path.join(ct.RAG_TOP_FOLDER_PATH, source["source"])):
+                    raise ValueError(f"{path}:{line_number} 正解のファイルが見つかりません: {source['source']}")
+            items.append({
+                "id": item.get("id", line_number),
+                "question": item["question"],
+                "expected": {(os.path.normpath(source["source"]), source.get("page")) for source in item["sources"]},
+                "off_topic": off_topic
+            })
+
+    return items
+
+
+def find_rank(documents, expected):
+    """
+    検索結果の中で、最初に正解のファイル・ページが現れる順位を取得
+
+    Args:
+        documents: 検索結果のドキュメントのリスト（関連性の高い順）
+        expected: 正解とみなす（ファイルパス, ページ番号）の集合
+
+    Returns:
+        1始まりの順位（含まれない場合はNone）
+    """
+    for rank, document in enumerate(documents, start=1):
+        source = os.path.normpath(os.path.relpath(document.metadata.get("source", ""), ct.RAG_TOP_FOLDER_PATH))
+        # ページ番号を指定していない正解は、ファイルが一致すればどのページでもよい
+        if (source, None) in expected or (source, document.metadata.get("page")) in expected:
+            return rank
+    return None
+
+
+def build_eval_store(embeddings, chunk_size, chunk_overlap, structured):
+    """
+    評価用のベクターストアを作成
+
+    Args:
+        embeddings: 埋め込みモデル
+        chunk_size: チャンク分割サイズ
+        chunk_overlap: チャンク分割時のオーバーラップサイズ
+        structured: 見出しのある文書を見出し単位で分割するかどうか
+
+    Returns:
+        (作成したベクターストア, 取り込みの集計, 作成にかかった秒数)のタプル
+    """
+    # アプリでスナップショットに書き出すものと同じ、numpyベクターストアで作成
+    db = create_vector_store(embeddings, backend="numpy")
+    splitters = create_splitters(chunk_size, chunk_overlap, structured)
+    started_at = time.perf_counter()
+    stats = IngestPipeline(db, embeddings, splitters=splitters).run(iter_target_files(ct.RAG_TOP_FOLDER_PATH))
+    return db, stats, time.perf_counter() - started_at
+
+
+def evaluate_config(golden_set, embeddings, chunk_size, chunk_overlap, k_values, structured):
+    """
+    1つのチャンク分割の設定でベクターストアを作成し、正解データの全質問（社内文書に無い質問を除く）で検索精度と速度を計測
+
+    Args:
+        golden_set: 正解データ
+        embeddings: 埋め込みモデル
+        chunk_size: チャンク分割サイズ
+        chunk_overlap: チャンク分割時のオーバーラップサイズ
+        k_values: 比較する検索結果のドキュメント数のリスト
+        structured: 見出しのある文書を見出し単位で分割するかどうか
+
+    Returns:
+        計測結果の辞書
+    """
+    db, stats, build_time = build_eval_store(embeddings, chunk_size, chunk_overlap, structured)
+    golden_set = [item for item in golden_set if not item["off_topic"]]
+
+    # 検索は最大のkで1回だけ行い、上位から切り出して各kの精度を求める
+    max_k = max(k_values)
+    ranks = []
+    latencies = []
+    for item in golden_set:
+        started_at = time.perf_counter()
+        documents = db.similarity_search(item["question"], k=max_k)
+        latencies.append(time.perf_counter() - started_at)
+        ranks.append(find_rank(documents, item["expected"]))
+
+    return {
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "chunks": stats["chunks"],
+        "index_mb": db.nbytes / 1024 / 1024,
+        "build_sec": build_time,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": statistics.quantiles(latencies, n=20)[-1] * 1000 if len(latencies) > 1 else latencies[0] * 1000,
+        # recall@k: 上位k件に正解のファイル・ページが含まれていた質問の割合
+        "recall": {k: sum(1 for rank in ranks if rank is not None and rank <= k) / len(ranks) for k in k_values},
+        # MRR: 正解が最初に現れた順位の逆数の平均（上位max_k件に無い場合は0）
+        "mrr": sum(1 / rank for rank in ranks if rank is not None) / len(ranks),
+        "misses": [item["id"] for item, rank in zip(golden_set, ranks) if rank is None]
+    }
+
+
+def format_report(results, k_values):
+    """
+    計測結果を、設定ごとに1行で並べたコンソール出力用の文字列に変換
+
+    Args:
+        results: evaluate_configの計測結果のリスト
+        k_values: 比較した検索結果のドキュメント数のリスト
+
+    Returns:
+        コンソール出力用の文字列
+    """
+    lines = [
+        f"{'size':>6}{'overlap':>9}{'chunks':>8}{'index[MB]':>11}{'build[s]':>10}{'p50[ms]':>9}{'p95[ms]':>9}"
+        + "".join(f"{f'R@{k}':>7}" for k in k_values)
+        + f"{'MRR':>7}"
+    ]
+    for result in results:
+        # 現在の設定の行に印を付ける
+        mark = "*" if (result["chunk_size"], result["chunk_overlap"]) == (ct.CHUNK_SIZE, ct.CHUNK_OVERLAP) else " "
+        lines.append(
+            f"{mark}{result['chunk_size']:>5}{result['chunk_overlap']:>9}{result['chunks']:>8}{result['index_mb']:>11.2f}"
+            f"{result['build_sec']:>10.2f}{result['p50_ms']:>9.2f}{result['p95_ms']:>9.2f}"
+            + "".join(f"{result['recall'][k]:>7.3f}" for k in k_values)
+            + f"{result['mrr']:>7.3f}"
+        )
+    lines.append(f"*: 現在の設定（CHUNK_SIZE={ct.CHUNK_SIZE}, CHUNK_OVERLAP={ct.CHUNK_OVERLAP}, RETRIEVER_DOCUMENT_COUNT={ct.RETRIEVER_DOCUMENT_COUNT}）")
+    return "\n".join(lines)
+
+
+def calibrate_min_score(golden_set, embeddings, thresholds, chunk_size=ct.CHUNK_SIZE, chunk_overlap=ct.CHUNK_OVERLAP,
+                        structured=ct.STRUCTURED_SPLIT_ENABLED):
+    """
+    関連度の最低値ごとに、社内文書に関する質問で検索結果が残る割合・正解が残る割合と、
+    社内文書に無い質問で検索結果が空になる（LLMを呼び出さずに「該当なし」と回答する）割合を計測
+
+    Args:
+        golden_set: 正解データ（社内文書に無い質問を含む）
+        embeddings: 埋め込みモデル
+        thresholds: 比較する関連度の最低値のリスト
+        chunk_size: チャンク分割サイズ
+        chunk_overlap: チャンク分割時のオーバーラップサイズ
+        structured: 見出しのある文書を見出し単位で分割するかどうか
+
+    Returns:
+        {"results": 最低値ごとの計測結果のリスト, "scores": 質問ごとの最も高い関連度の辞書}
+    """
+    db, _, _ = build_eval_store(embeddings, chunk_size, chunk_overlap, structured)
+
+    # 検索は質問ごとに1回だけ行い、最低値を変えて足切りの結果を比べる
+    # 関連の低いものは関連度が0未満になり警告が出るが、足切りの比較には影響しないため出力しない
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message="Relevance scores must be between 0 and 1")
+        searched = [
+            (item, db.similarity_search_with_relevance_scores(item["question"], k=ct.RETRIEVER_DOCUMENT_COUNT))
+            for item in golden_set
+        ]
+    on_topic = [(item, docs_and_scores) for item, docs_and_scores in searched if not item["off_topic"]]
+    off_topic = [(item, docs_and_scores) for item, docs_and_scores in searched if item["off_topic"]]
+
+    results = []
+    for threshold in thresholds:
+        def select(docs_and_scores):
+            return select_by_score(docs_and_scores, min_score=threshold)
+
+        results.append({
+            "min_score": threshold,
+            # 関連度と同じ尺度（1 - (2 - 2 * コサイン類似度) / √2）から求めた、コサイン類似度での最低値
+            "min_cosine": 1.0 - (1.0 - threshold) * np.sqrt(2) / 2,
+            "answered": sum(1 for _, docs_and_scores in on_topic if select(docs_and_scores)) / max(1, len(on_topic)),
+            "recall": sum(
+                1 for item, docs_and_scores in on_topic if find_rank(select(docs_and_scores), item["expected"]) is not None
+            ) / max(1, len(on_topic)),
+            "rejected": sum(1 for _, docs_and_scores in off_topic if not select(docs_and_scores)) / max(1, len(off_topic))
+        })
+
+    scores = {item["id"]: docs_and_scores[0][1] if docs_and_scores else None for item, docs_and_scores in searched}
+    return {"results": results, "scores": scores, "on_topic": len(on_topic), "off_topic": len(off_topic)}
+
+
+def recommend_min_score(results, min_answered=ct.EVAL_MIN_ANSWERED_RATIO):
+    """
+    社内文書に関する質問で検索結果が残る割合を保ちつつ、社内文書に無い質問を最も多く「該当なし」にできる最低値を選ぶ
+
+    Args:
+        results: calibrate_min_scoreの計測結果のリスト
+        min_answered: 社内文書に関する質問で検索結果が残る割合の下限
+
+    Returns:
+        選んだ計測結果（下限を満たすものが無い場合はNone）
+    """
+    candidates = [result for result in results if result["answered"] >= min_answered]
+    if not candidates:
+        return None
+    # 同じ割合で「該当なし」にできる場合は、社内文書に関する質問への影響が小さい低い方を選ぶ
+    return max(candidates, key=lambda result: (result["rejected"], result["recall"], -result["min_score"]))
+
+
+def format_calibration(calibration, recommended):
+    """
+    関連度の最低値ごとの計測結果を、コンソール出力用の文字列に変換
+
+    Args:
+        calibration: calibrate_min_scoreの戻り値
+        recommended: recommend_min_scoreで選んだ計測結果
+
+    Returns:
+        コンソール出力用の文字列
+    """
+    lines = [f"{'min_score':>10}{'cosine':>8}{'answered':>10}{'recall':>8}{'rejected':>10}"]
+    for result in calibration["results"]:
+        mark = "*" if abs(result["min_score"] - ct.RETRIEVER_MIN_RELEVANCE_SCORE) < 1e-9 else " "
+        mark += ">" if result is recommended else " "
+        lines.append(
+            f"{mark}{result['min_score']:>8.2f}{result['min_cosine']:>8.3f}{result['answered']:>10.3f}"
+            f"{result['recall']:>8.3f}{result['rejected']:>10.3f}"
+        )
+    lines.append(
+        f"answered: 社内文書に関する質問（{calibration['on_topic']}件）で検索結果が残った割合, recall: 正解が残った割合, "
+        f"rejected: 社内文書に無い質問（{calibration['off_topic']}件）で「該当なし」になった割合"
+    )
+    lines.append(f"*: 現在の設定（RETRIEVER_MIN_RELEVANCE_SCORE={ct.RETRIEVER_MIN_RELEVANCE_SCORE}）, "
+                 f">: answeredが{ct.EVAL_MIN_ANSWERED_RATIO}以上でrejectedが最も高い最低値")
+    if recommended is None:
+        lines.append(f"answeredが{ct.EVAL_MIN_ANSWERED_RATIO}以上になる最低値がありません")
+    return "\n".join(lines)
+
+
+@lru_cache(maxsize=65536)
+def _hash_term(term, size):
+    # 索引語から、ベクトルの位置と符号を決める（Pythonのhashは実行ごとに変わるため使わない）
+    digest = int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+    return digest % size, 1.0 if digest >> 63 else -1.0
+
+
+def main(argv=None):
+    """
+    コマンドラインからの実行
+    """
+    parser = argparse.ArgumentParser(description="チャンク分割の設定と検索結果のドキュメント数ごとに、検索精度と速度を比較します。")
+    parser.add_argument("--golden", default=ct.EVAL_GOLDEN_SET_PATH, help="正解データ（JSONL）のパス")
+    parser.add_argument("--chunk-sizes", type=int, nargs="+", default=ct.EVAL_CHUNK_SIZES, help="比較するチャンク分割サイズ")
+    parser.add_argument("--chunk-overlaps", type=int, nargs="+", default=ct.EVAL_CHUNK_OVERLAPS, help="比較するオーバーラップサイズ")
+    parser.add_argument("-k", type=int, nargs="+", default=ct.EVAL_K_VALUES, help="比較する検索結果のドキュメント数")
+    parser.add_argument("--no-structured", action="store_true", help="見出しのある文書も見出し単位で分割せずに比較する")
+    parser.add_argument("--calibrate", action="store_true", help="現在のチャンク分割の設定で、関連度の最低値ごとの「該当なし」の判定を比較する")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=ct.EVAL_SCORE_THRESHOLDS, help="--calibrateで比較する関連度の最低値")
+    parser.add_argument("--openai", action="store_true", help="アプリと同じOpenAIの埋め込みを使う（APIを呼び出す）")
+    parser.add_argument("-o", "--output", help="計測結果（JSON）の出力先")
+    args = parser.parse_args(argv)
+
+    initialize_logger(session_id=ct.EVAL_SESSION_ID)
+
+    golden_set = load_golden_set(args.golden)
+    k_values = sorted(set(args.k))
+    if args.openai:
+        from langchain_openai import OpenAIEmbeddings
+        embeddings = OpenAIEmbeddings()
+    else:
+        embeddings = HashingEmbeddings()
+    structured = ct.STRUCTURED_SPLIT_ENABLED and not args.no_structured
+    embedding_name = getattr(embeddings, "model", None) or f"hashing(dim={embeddings.size})"
+
+    if args.calibrate:
+        calibration = calibrate_min_score(golden_set, embeddings, sorted(set(args.thresholds)), structured=structured)
+        recommended = recommend_min_score(calibration["results"])
+        print(f"embeddings={embedding_name}, size={ct.CHUNK_SIZE}, overlap={ct.CHUNK_OVERLAP}, structured={structured}")
+        print(format_calibration(calibration, recommended))
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(dict(calibration, recommended=recommended), f, ensure_ascii=False, indent=2)
+            print(f"計測結果を出力しました: {args.output}")
+        return 0
+
+    results = []
+    for chunk_size, chunk_overlap in itertools.product(args.chunk_sizes, args.chunk_overlaps):
+        # オーバーラップがチャンク分割サイズ以上の組み合わせは分割できないため飛ばす
+        if chunk_overlap >= chunk_size:
+            print(f"スキップ: size={chunk_size}, overlap={chunk_overlap}（オーバーラップがチャンク分割サイズ以上）", file=sys.stderr)
+            continue
+        print(f"評価中: size={chunk_size}, overlap={chunk_overlap}", file=sys.stderr)
+        results.append(evaluate_config(golden_set, embeddings, chunk_size, chunk_overlap, k_values, structured))
+
+    print(f"questions={sum(1 for item in golden_set if not item['off_topic'])}, structured={structured}, embeddings={embedding_name}")
+    print(format_report(results, k_values))
+    for result in results:
+        if result["misses"]:
+            print(f"size={result['chunk_size']}, overlap={result['chunk_overlap']} で上位{max(k_values)}件に正解が無かった質問: {', '.join(map(str, result['misses']))}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"計測結果を出力しました: {args.output}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,226 @@
+"""
+このファイルは、LLM呼び出しの同時実行数の制限・再試行などを手元で確認するための、OpenAI互換の簡易サーバーのファイルです。
+チャット（/v1/chat/completions）と埋め込み（/v1/embeddings）に固定の応答を返し、指定した割合でレート制限のエラー（429）を返します。
+
+使い方:
+    python fake_openai_server.py --port 8001 --latency 0.5 --error-rate 0.3
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=dummy python batch_answer.py questions.jsonl -o answers.jsonl
+
+「GET /stats」で、受け付けたリクエスト数・同時に処理していたリクエスト数の最大値などを確認できます。
+OpenAIのプロンプトキャッシュを真似て、以前のリクエストと先頭部分が一致したトークン数を「cached_tokens」として返します。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+############################################################
+# 変数の定義
+############################################################
+# 埋め込みベクトルの次元数（text-embedding-ada-002と同じ）
+EMBEDDING_DIMENSIONS = 1536
+# プロンプトキャッシュの対象となる最小トークン数と、一致を判定する単位（OpenAIと同じ）
+PROMPT_CACHE_MIN_TOKENS = 1024
+PROMPT_CACHE_BLOCK_TOKENS = 128
+# 1トークンあたりの文字数の概算
+CHARS_PER_TOKEN = 4
+
+
+############################################################
+# クラス定義
+############################################################
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """
+    OpenAI互換のAPIに固定の応答を返すリクエストハンドラー
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            with self.server.lock:
+                self._send_json(200, dict(self.server.stats))
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        request = json.loads(body or b"{}")
+
+        with self.server.lock:
+            self.server.stats["requests"] += 1
+            self.server.active += 1
+            self.server.stats["max_active"] = max(self.server.stats["max_active"], self.server.active)
+        try:
+            time.sleep(self.server.latency)
+            if random.random() < self.server.error_rate:
+                with self.server.lock:
+                    self.server.stats["rate_limited"] += 1
+                self._send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}}, {"retry-after": "0.1"})
+            elif self.path.endswith("/chat/completions"):
+                response = chat_completion(request, self.server.prefix_cache, self.server.lock)
+                with self.server.lock:
+                    self.server.stats["prompt_tokens"] += response["usage"]["prompt_tokens"]
+                    self.server.stats["cached_tokens"] += response["usage"]["prompt_tokens_details"]["cached_tokens"]
+                self._send_json(200, response)
+            elif self.path.endswith("/embeddings"):
+                self._send_json(200, embeddings(request))
+            else:
+                self._send_json(404, {"error": {"message": "not found"}})
+        finally:
+            with self.server.lock:
+                self.server.active -= 1
+
+    def log_message(self, format, *args):
+        # 大量のリクエストでコンソールが埋まらないよう、アクセスログは出力しない
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+############################################################
+# 関数定義
+############################################################
+
+def chat_completion(request, prefix_cache=None, lock=None):
+    """
+    チャットの応答を作成（最後のメッセージの先頭部分を含む固定の文章を返す）
+
+    Args:
+        request: リクエストの内容
+        prefix_cache: 以前のリクエストのプロンプトの先頭部分のハッシュ値の集合（プロンプトキャッシュの真似に使う）
+        lock: prefix_cacheを更新する際のロック
+
+    Returns:
+        応答の内容
+    """
+    messages = request.get("messages", [])
+    last_message = messages[-1]["content"] if messages else ""
+    if isinstance(last_message, list):
+        last_message = " ".join(part.get("text", "") for part in last_message)
+    answer = f"（テスト用の回答）{last_message[:50]}"
+
+    # 日本語の1文字が約1.5トークンになるよう、エスケープした文字列の長さで数える
+    prompt = json.dumps(messages)
+    prompt_tokens = len(prompt) // CHARS_PER_TOKEN
+    cached_tokens = 0
+    if prefix_cache is not None and prompt_tokens >= PROMPT_CACHE_MIN_TOKENS:
+        cached_tokens = match_prompt_cache(prompt, prefix_cache, lock)
+
+    return {
+        "id": f"chatcmpl-{hashlib.md5(answer.encode('utf-8')).hexdigest()}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model", ""),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(answer),
+            "total_tokens": prompt_tokens + len(answer),
+            "prompt_tokens_details": {"cached_tokens": cached_tokens}
+        }
+    }
+
+
+def match_prompt_cache(prompt, prefix_cache, lock=None):
+    """
+    プロンプトの先頭部分のうち、以前のリクエストと一致したトークン数を求め、このプロンプトの先頭部分も登録する
+    （最小トークン数から一定トークン数ごとの区切りで、先頭からの一致を判定する）
+
+    Args:
+        prompt: プロンプトの文字列
+        prefix_cache: 以前のリクエストのプロンプトの先頭部分のハッシュ値の集合
+        lock: prefix_cacheを更新する際のロック
+
+    Returns:
+        キャッシュに一致したトークン数
+    """
+    prefixes = [
+        (tokens, hashlib.sha256(prompt[:tokens * CHARS_PER_TOKEN].encode("utf-8")).hexdigest())
+        for tokens in range(PROMPT_CACHE_MIN_TOKENS, len(prompt) // CHARS_PER_TOKEN + 1, PROMPT_CACHE_BLOCK_TOKENS)
+    ]
+    cached_tokens = 0
+    with lock or threading.Lock():
+        for tokens, digest in prefixes:
+            if digest not in prefix_cache:
+                break
+            cached_tokens = tokens
+        prefix_cache.update(digest for _, digest in prefixes)
+    return cached_tokens
+
+
+def embeddings(request):
+    """
+    埋め込みの応答を作成（テキストのハッシュ値から決まる、同じテキストには同じベクトル）
+
+    Args:
+        request: リクエストの内容
+
+    Returns:
+        応答の内容
+    """
+    inputs = request.get("input", [])
+    if not isinstance(inputs, list) or (inputs and isinstance(inputs[0], int)):
+        inputs = [inputs]
+
+    data = []
+    for i, text in enumerate(inputs):
+        seed = int(hashlib.sha256(json.dumps(text, ensure_ascii=False).encode("utf-8")).hexdigest()[:16], 16)
+        generator = random.Random(seed)
+        vector = [generator.gauss(0, 1) for _ in range(EMBEDDING_DIMENSIONS)]
+        norm = sum(value * value for value in vector) ** 0.5
+        data.append({"object": "embedding", "index": i, "embedding": [value / norm for value in vector]})
+
+    return {"object": "list", "data": data, "model": request.get("model", ""), "usage": {"prompt_tokens": 0, "total_tokens": 0}}
+
+
+def main(argv=None):
+    """
+    コマンドラインからの実行
+    """
+    parser = argparse.ArgumentParser(description="OpenAI互換の簡易サーバーを起動します。")
+    parser.add_argument("--host", default="127.0.0.1", help="待ち受けるホスト")
+    parser.add_argument("--port", type=int, default=8001, help="待ち受けるポート番号")
+    parser.add_argument("--latency", type=float, default=0.2, help="応答までの待機秒数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="レート制限のエラー（429）を返す割合（0〜1）")
+    args = parser.parse_args(argv)
+
+    server = ThreadingHTTPServer((args.host, args.port), FakeOpenAIHandler)
+    server.daemon_threads = True
+    server.latency = args.latency
+    server.error_rate = args.error_rate
+    server.lock = threading.Lock()
+    server.active = 0
+    server.stats = {"requests": 0, "rate_limited": 0, "max_active": 0, "prompt_tokens": 0, "cached_tokens": 0}
+    server.prefix_cache = set()
+
+    print(f"http://{args.host}:{args.port}/v1 で待ち受けています（Ctrl+Cで終了）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
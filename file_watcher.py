@@ -0,0 +1,262 @@
+"""
+このファイルは、RAGの参照先フォルダの変更をバックグラウンドで監視するファイルです。
+Linuxではinotifyで変更を即座に検知し、使えない環境では一定間隔でファイルの更新日時を比較します。
+短時間に続けて発生した変更はまとめて（デバウンスして）通知します。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import time
+import errno
+import select
+import struct
+import logging
+import threading
+import ctypes
+import ctypes.util
+import loaders
+import constants as ct
+
+
+############################################################
+# 変数の定義
+############################################################
+# inotifyのイベントの種類（<sys/inotify.h>の定義値）
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+# 監視するイベント（書き込み途中のファイルを読まないよう、変更は書き込み完了時に検知する）
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+# inotifyのイベントのヘッダー（wd, mask, cookie, len）
+EVENT_HEADER = struct.Struct("iIII")
+
+
+############################################################
+# クラス定義
+############################################################
+
+class FileWatcher:
+    """
+    フォルダ配下の変更を監視し、変更されたパスをまとめてコールバックに渡すクラス
+    """
+
+    def __init__(self, path, callback, backend=ct.FILE_WATCH_BACKEND):
+        """
+        Args:
+            path: 監視するフォルダのパス
+            callback: 変更されたパスの集合を受け取る関数（監視用のスレッドから呼ばれる）
+            backend: 監視方法（「auto」「inotify」「polling」）
+        """
+        self.path = path
+        self.callback = callback
+        self.backend = backend
+        self._stop = threading.Event()
+        self._thread = None
+        # デバウンス中の変更されたパスと、最初・最後に変更を検知した時刻
+        self._pending = set()
+        self._first_change = None
+        self._last_change = None
+
+    def start(self):
+        """
+        監視用のスレッドを開始
+        """
+        logger = logging.getLogger(ct.LOGGER_NAME)
+
+        run = self._run_polling
+        if self.backend in ("auto", "inotify"):
+            try:
+                inotify = _Inotify(self.path)
+                run = lambda: self._run_inotify(inotify)
+            except OSError as e:
+                if self.backend == "inotify":
+                    raise
+                logger.info(f"inotifyを使えないため、ポーリングでファイルの変更を監視します: {e}")
+
+        self._thread = threading.Thread(target=run, name="file-watcher", daemon=True)
+        self._thread.start()
+        logger.info(f"ファイルの変更の監視を開始: {self.path}")
+
+    def stop(self):
+        """
+        監視を停止
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run_inotify(self, inotify):
+        try:
+            while not self._stop.is_set():
+                for path in inotify.read_events(timeout=self._wait_timeout(ct.FILE_WATCH_POLL_INTERVAL)):
+                    self._add_change(path)
+                self._flush_if_settled()
+        finally:
+            inotify.close()
+
+    def _run_polling(self):
+        states = _scan(self.path)
+        while not self._stop.wait(self._wait_timeout(ct.FILE_WATCH_POLL_INTERVAL)):
+            current = _scan(self.path)
+            for path in current.keys() | states.keys():
+                if current.get(path) != states.get(path):
+                    self._add_change(path)
+            states = current
+            self._flush_if_settled()
+
+    def _add_change(self, path):
+        # 対応していない拡張子のファイルや、Officeのロックファイルなどの一時ファイルは無視する
+        name = os.path.basename(path)
+        if name.startswith((".", "~$")):
+            return
+        if os.path.splitext(name)[1] and not loaders.is_supported(path):
+            return
+        now = time.monotonic()
+        if not self._pending:
+            self._first_change = now
+        self._pending.add(path)
+        self._last_change = now
+
+    def _wait_timeout(self, interval):
+        # デバウンス中は、通知する時刻まで待機時間を短くする
+        if not self._pending:
+            return interval
+        return max(0.05, min(interval, self._last_change + ct.FILE_WATCH_DEBOUNCE - time.monotonic()))
+
+    def _flush_if_settled(self):
+        """
+        最後の変更から一定時間経った（または変更が続いて最大待機時間を超えた）場合、まとめて通知
+        """
+        if not self._pending:
+            return
+        now = time.monotonic()
+        if now - self._last_change < ct.FILE_WATCH_DEBOUNCE and now - self._first_change < ct.FILE_WATCH_MAX_DELAY:
+            return
+
+        paths, self._pending = self._pending, set()
+        try:
+            self.callback(paths)
+        except Exception as e:
+            logger = logging.getLogger(ct.LOGGER_NAME)
+            logger.error(f"ファイルの変更の通知エラー: {e}")
+
+
+class _Inotify:
+    """
+    ctypesで呼び出すinotifyによる、フォルダ配下（サブフォルダを含む）の監視
+    """
+
+    def __init__(self, path):
+        libc_name = ctypes.util.find_library("c")
+        if not libc_name:
+            raise OSError(errno.ENOSYS, "libcが見つかりません")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotifyに対応していない環境です")
+
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotifyを初期化できません")
+        self.root = path
+        # 監視番号（wd） → フォルダのパス
+        self._dirs = {}
+        self._add_tree(path)
+
+    def read_events(self, timeout):
+        """
+        発生したイベントを読み取り、変更されたパスを返す
+
+        Args:
+            timeout: イベントを待機する最大秒数
+
+        Returns:
+            変更されたパスのリスト
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        paths = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0").decode("utf-8", "surrogateescape")
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                # イベントを取りこぼした場合、フォルダ全体を変更されたものとして扱う
+                paths.append(self.root)
+                continue
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            directory = self._dirs.get(wd)
+            if directory is None or not name:
+                continue
+
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # 新しいフォルダも監視し、監視開始前に作られた中のファイルも変更として扱う
+                    try:
+                        self._add_tree(path)
+                    except OSError:
+                        pass
+                paths.append(path)
+                continue
+            if mask & IN_CREATE:
+                # 作成直後は書き込み途中のため、書き込み完了（IN_CLOSE_WRITE）を待つ
+                continue
+            paths.append(path)
+
+        return paths
+
+    def close(self):
+        os.close(self._fd)
+
+    def _add_tree(self, path):
+        for root, dirs, _ in os.walk(path):
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(root), WATCH_MASK)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f"フォルダを監視できません: {root}")
+            self._dirs[wd] = root
+
+
+############################################################
+# 関数定義
+############################################################
+
+def _scan(path):
+    """
+    フォルダ配下の対応ファイルのサイズと更新日時を取得（ポーリング用）
+
+    Returns:
+        ファイルのパス → (サイズ, 更新日時)の辞書
+    """
+    states = {}
+    for root, _, files in os.walk(path):
+        for file in files:
+            full_path = os.path.join(root, file)
+            if not loaders.is_supported(full_path):
+                continue
+            try:
+                stat = os.stat(full_path)
+            except OSError:
+                continue
+            states[full_path] = (stat.st_size, stat.st_mtime_ns)
+    return states
@@ -0,0 +1,103 @@
+"""
+このファイルは、アプリ起動時（最初の画面表示まで）のモジュール読み込み時間を計測して表示するファイルです。
+
+使い方:
+    python import_report.py --top 15 --limit 1.0
+
+「--limit」を指定した場合、合計の読み込み時間がその秒数を超えると終了コード1を返します。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import sys
+import argparse
+import subprocess
+
+
+############################################################
+# 変数の定義
+############################################################
+# 「main.py」が最初の画面表示までに読み込むモジュール
+STARTUP_MODULES = ["streamlit", "dotenv", "constants", "loaders", "utils", "initialize", "components"]
+
+
+############################################################
+# 関数定義
+############################################################
+
+def measure_import_times(modules):
+    """
+    新しいPythonプロセスで「-X importtime」を使い、モジュールの読み込み時間を計測
+
+    Args:
+        modules: 読み込むモジュール名のリスト
+
+    Returns:
+        (モジュール名, 自身の読み込み時間[秒], 依存を含む読み込み時間[秒], 階層の深さ)のタプルのリスト
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {', '.join(modules)}"],
+        capture_output=True,
+        text=True,
+        check=True
+    )
+
+    records = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+            self_time = int(self_us) / 1e6
+            cumulative_time = int(cumulative_us) / 1e6
+        except ValueError:
+            # 見出し行はスキップ
+            continue
+        depth = (len(name) - len(name.lstrip())) // 2
+        records.append((name.strip(), self_time, cumulative_time, depth))
+
+    return records
+
+
+def main(argv=None):
+    """
+    コマンドラインからの実行
+    """
+    parser = argparse.ArgumentParser(description="アプリ起動時のモジュール読み込み時間を表示します。")
+    parser.add_argument("--top", type=int, default=15, help="表示するパッケージ数")
+    parser.add_argument("--limit", type=float, default=None, help="合計の読み込み時間の上限[秒]")
+    args = parser.parse_args(argv)
+
+    records = measure_import_times(STARTUP_MODULES)
+
+    # 最上位（直接importしたもの）の読み込み時間の合計が、起動時の読み込み時間になる
+    top_level = [record for record in records if record[3] == 0]
+    total_time = sum(record[2] for record in top_level)
+
+    # サードパーティを含むパッケージ単位で、自身の読み込み時間を集計
+    package_times = {}
+    for name, self_time, _, _ in records:
+        package = name.split(".")[0]
+        package_times[package] = package_times.get(package, 0.0) + self_time
+
+    print(f"起動時の読み込み時間の合計: {total_time:.3f}秒")
+    print()
+    print("■ 起動時に読み込むモジュール（依存を含む）")
+    for name, _, cumulative_time, _ in top_level:
+        if name in STARTUP_MODULES:
+            print(f"  {name:<40}{cumulative_time:>8.3f}秒")
+    print()
+    print(f"■ 読み込み時間の長いパッケージ（上位{args.top}件）")
+    for package, package_time in sorted(package_times.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"  {package:<40}{package_time:>8.3f}秒")
+
+    if args.limit is not None and total_time > args.limit:
+        print(f"\n読み込み時間が上限（{args.limit}秒）を超えています。", file=sys.stderr)
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""
+このファイルは、作成したインデックス（スナップショット）を世代ごとのフォルダに保存し、
+アプリが読み込む世代を「CURRENT」ファイルで切り替えるファイルです。
+
+フォルダの構成:
+    index/
+        CURRENT                     アプリが読み込む世代名（一時ファイルに書き出してから置き換える）
+        builds/
+            20250101_120000_xxxxxxxx/
+                snapshot.bin        チャンクと埋め込みベクトル（index_snapshot.pyの形式）
+                manifest.json       作成元データの指紋・作成時の処理時間・チャンクの統計
+                answers.json        よく聞かれる質問の回答（prewarm_cache.pyで作成。回答キャッシュに読み込む）
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import json
+import shutil
+import logging
+from uuid import uuid4
+from datetime import datetime
+import constants as ct
+
+
+############################################################
+# 変数の定義
+############################################################
+SNAPSHOT_FILE_NAME = "snapshot.bin"
+MANIFEST_FILE_NAME = "manifest.json"
+ANSWERS_FILE_NAME = "answers.json"
+
+
+############################################################
+# 関数定義
+############################################################
+
+def write_artifact(db, manifest):
+    """
+    ベクターストアの内容を新しい世代のフォルダに書き出す（CURRENTは切り替えない）
+
+    Args:
+        db: 書き出すnumpyベクターストア
+        manifest: 世代の付加情報（作成元データの指紋・統計など）
+
+    Returns:
+        作成した世代名
+    """
+    version = f"{datetime.now():%Y%m%d_%H%M%S}_{uuid4().hex[:8]}"
+    build_path = os.path.join(ct.INDEX_BUILDS_DIR_PATH, version)
+    # 書き出し途中のフォルダを読み込まれないよう、一時フォルダに書き出してから名前を変える
+    tmp_path = f"{build_path}.tmp"
+    os.makedirs(tmp_path)
+
+    manifest = dict(manifest, version=version, created_at=datetime.now().isoformat(timespec="seconds"))
+    db.write_snapshot(os.path.join(tmp_path, SNAPSHOT_FILE_NAME), info={"fingerprint": manifest.get("fingerprint"), "version": version})
+    with open(os.path.join(tmp_path, MANIFEST_FILE_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, build_path)
+
+    return version
+
+
+def set_current(version):
+    """
+    アプリが読み込む世代を切り替える（一時ファイルに書き出してから置き換えるため、途中の状態は読まれない）
+
+    Args:
+        version: 切り替え先の世代名
+    """
+    if not os.path.exists(get_snapshot_path(version)):
+        raise FileNotFoundError(f"世代のスナップショットがありません: {version}")
+
+    tmp_path = f"{ct.INDEX_CURRENT_PATH}.tmp{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, ct.INDEX_CURRENT_PATH)
+
+
+def get_current():
+    """
+    アプリが読み込む世代名を取得
+
+    Returns:
+        世代名（まだ作成されていない場合はNone）
+    """
+    try:
+        with open(ct.INDEX_CURRENT_PATH, encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def get_snapshot_path(version):
+    """
+    世代のスナップショットファイルのパスを取得
+
+    Args:
+        version: 世代名
+
+    Returns:
+        スナップショットファイルのパス
+    """
+    return os.path.join(ct.INDEX_BUILDS_DIR_PATH, version, SNAPSHOT_FILE_NAME)
+
+
+def get_answers_path(version):
+    """
+    世代の事前に作成した回答のファイルのパスを取得
+
+    Args:
+        version: 世代名
+
+    Returns:
+        事前に作成した回答のファイルのパス
+    """
+    return os.path.join(ct.INDEX_BUILDS_DIR_PATH, version, ANSWERS_FILE_NAME)
+
+
+def read_manifest(version):
+    """
+    世代の付加情報を読み込む
+
+    Args:
+        version: 世代名
+
+    Returns:
+        付加情報の辞書（読み込めない場合はNone）
+    """
+    try:
+        with open(os.path.join(ct.INDEX_BUILDS_DIR_PATH, version, MANIFEST_FILE_NAME), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def prune_versions(keep=ct.INDEX_KEEP_VERSIONS):
+    """
+    古い世代のフォルダを削除（CURRENTの世代と、新しい順に指定数の世代は残す）
+    削除した世代を読み込み中のプロセスがあっても、mmap済みの内容はそのまま読み続けられる
+
+    Args:
+        keep: 残す世代数
+    """
+    logger = logging.getLogger(ct.LOGGER_NAME)
+
+    if not os.path.isdir(ct.INDEX_BUILDS_DIR_PATH):
+        return
+    current = get_current()
+    # 世代名は作成日時から始まるため、名前の順が作成順になる
+    versions = sorted(name for name in os.listdir(ct.INDEX_BUILDS_DIR_PATH) if not name.endswith(".tmp"))
+    for version in versions[:-keep] if keep > 0 else versions:
+        if version == current:
+            continue
+        try:
+            shutil.rmtree(os.path.join(ct.INDEX_BUILDS_DIR_PATH, version))
+            logger.info(f"古いインデックスの世代を削除しました: {version}")
+        except OSError as e:
+            # Windowsでは読み込み中のファイルを削除できないため、次回以降に削除する
+            logger.warning(f"古いインデックスの世代を削除できません: {version} - {e}")
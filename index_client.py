@@ -0,0 +1,290 @@
+"""
+このファイルは、インデックスサーバー（index_server.py）に検索を依頼するクライアントのファイルです。
+環境変数「INDEX_SERVER_URL」を設定すると、アプリのプロセスはインデックスを作成・保持せず、このクライアントを通じて検索します。
+サーバーへの接続はプロセス内の全セッションで使い回すため、リクエストごとに接続し直しません。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import json
+import time
+import queue
+import socket
+import logging
+import threading
+import http.client
+from urllib.parse import urlsplit
+from pydantic import ConfigDict
+from langchain_core.documents import Document as LangchainDoc
+from langchain_core.retrievers import BaseRetriever
+from adaptive_retriever import select_by_score
+import constants as ct
+
+
+############################################################
+# クラス定義
+############################################################
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    Unixドメインソケットで接続するHTTPの接続
+    """
+
+    def __init__(self, path, timeout=ct.INDEX_CLIENT_TIMEOUT):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class IndexClient:
+    """
+    インデックスサーバーへのリクエストを、接続を使い回しながら送るクラス（スレッドセーフ）
+    """
+
+    def __init__(self, url, pool_size=ct.INDEX_CLIENT_POOL_SIZE, timeout=ct.INDEX_CLIENT_TIMEOUT):
+        """
+        Args:
+            url: インデックスサーバーの接続先（「http://ホスト:ポート」または「unix://ソケットのパス」）
+            pool_size: 使い回す接続数の上限
+            timeout: リクエストのタイムアウト（秒）
+        """
+        self.url = url
+        self.timeout = timeout
+        self._parsed = urlsplit(url)
+        # 使い終わった接続（直近に使ったものから再利用する）
+        self._pool = queue.LifoQueue(max(1, pool_size))
+
+    def status(self):
+        """
+        インデックスの作成状況を取得
+
+        Returns:
+            作成状況の辞書（index_server.get_statusと同じ項目）
+        """
+        return self._request("GET", "/status")
+
+    def search(self, queries, k=ct.RETRIEVER_DOCUMENT_COUNT):
+        """
+        複数のクエリをまとめて検索
+
+        Args:
+            queries: クエリのリスト
+            k: クエリごとに取得するドキュメント数
+
+        Returns:
+            (クエリごとの(ドキュメント, 関連度)のタプルのリスト, 簡易検索かどうか)のタプル
+        """
+        response = self._request("POST", "/search", {"queries": list(queries), "k": k})
+        results = [
+            [(LangchainDoc(page_content=item["page_content"], metadata=item["metadata"]), item["score"]) for item in items]
+            for items in response["results"]
+        ]
+        return results, response["degraded"]
+
+    def close(self):
+        """
+        使い回している接続を全て閉じる
+        """
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def _request(self, method, path, payload=None):
+        body = None if payload is None else json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+
+        connection, reused = self._acquire()
+        try:
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # 使い回した接続がサーバー側で閉じられていた場合のみ、新しい接続でやり直す
+                if not reused:
+                    raise
+                connection.close()
+                connection = self._connect()
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+            data = json.loads(response.read() or b"{}")
+        except Exception:
+            connection.close()
+            raise
+
+        self._release(connection, response)
+        if response.status != 200:
+            raise RuntimeError(f"インデックスサーバーのエラー（{response.status}）: {data.get('error', '')}")
+        return data
+
+    def _acquire(self):
+        try:
+            return self._pool.get_nowait(), True
+        except queue.Empty:
+            return self._connect(), False
+
+    def _release(self, connection, response):
+        # サーバーが接続を閉じる応答だった場合は使い回さない
+        if response.will_close:
+            connection.close()
+            return
+        try:
+            self._pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def _connect(self):
+        if self._parsed.scheme == "unix":
+            return UnixHTTPConnection(self._parsed.path, timeout=self.timeout)
+        return http.client.HTTPConnection(self._parsed.hostname, self._parsed.port or 80, timeout=self.timeout)
+
+
+class RemoteRetriever(BaseRetriever):
+    """
+    インデックスサーバーに検索を依頼し、関連度による足切りを行うRetriever（adaptive_retriever.AdaptiveRetrieverと同じ選び方）
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    client: IndexClient
+    # 関連度による足切りを行うかどうか（行わない場合は上位max_k件を使う）
+    score_cutoff: bool = ct.RETRIEVER_SCORE_CUTOFF_ENABLED
+    min_k: int = ct.RETRIEVER_MIN_DOCUMENT_COUNT
+    max_k: int = ct.RETRIEVER_DOCUMENT_COUNT
+    min_score: float = ct.RETRIEVER_MIN_RELEVANCE_SCORE
+    max_gap: float = ct.RETRIEVER_MAX_RELATIVE_GAP
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        logger = logging.getLogger(ct.LOGGER_NAME)
+
+        results, degraded = self.client.search([query], k=self.max_k)
+        docs_and_scores = results[0]
+        # 簡易検索の結果には関連度が無いため、そのまま使う
+        if degraded or not self.score_cutoff:
+            return [doc for doc, _ in docs_and_scores]
+
+        documents = select_by_score(docs_and_scores, self.min_k, self.min_score, self.max_gap)
+        logger.info(
+            f"検索結果の関連度: {', '.join(f'{score:.3f}' for _, score in docs_and_scores)}"
+            f"（{len(docs_and_scores)}件中{len(documents)}件を使用）"
+        )
+        return documents
+
+
+class RemoteIndexState:
+    """
+    インデックスサーバーの作成状況を、index_manager.IndexStateと同じ形で参照するクラス
+    （アプリのプロセスではインデックスを作成せず、検索はRemoteRetrieverでサーバーに依頼する）
+    """
+
+    def __init__(self, url, status_ttl=ct.INDEX_CLIENT_STATUS_TTL):
+        """
+        Args:
+            url: インデックスサーバーの接続先
+            status_ttl: 作成状況を問い合わせ直すまでの秒数
+        """
+        self.client = IndexClient(url)
+        self.retriever = RemoteRetriever(client=self.client)
+        self.status_ttl = status_ttl
+        self._lock = threading.Lock()
+        self._status = None
+        self._status_at = 0.0
+
+    @property
+    def is_ready(self):
+        from index_manager import STATUS_READY
+        return self.get_progress()["status"] == STATUS_READY
+
+    @property
+    def update_count(self):
+        return self._get_status().get("update_count", 0)
+
+    def start(self):
+        """
+        インデックスの作成はサーバーで行うため、何もしない
+        """
+
+    def wait(self, timeout=None):
+        """
+        サーバーでのインデックスの作成完了（または失敗）まで待機
+
+        Returns:
+            作成が完了した場合True
+        """
+        from index_manager import STATUS_READY, STATUS_FAILED
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            status = self._get_status(refresh=True)["status"]
+            if status in (STATUS_READY, STATUS_FAILED) or (deadline is not None and time.monotonic() >= deadline):
+                return status == STATUS_READY
+            time.sleep(self.status_ttl)
+
+    def get_retriever(self, timeout=None):
+        """
+        検索に使うRetrieverを取得
+        サーバーがファイルの読み込み中でまだ検索できない場合は、簡易検索ができるようになるまで待機する
+        検索のたびにサーバーへ問い合わせないよう、作成状況はstatus_ttl秒以内に取得したものを使う
+
+        Args:
+            timeout: 検索できるようになるまで待機する最大秒数
+
+        Returns:
+            (Retriever, 簡易検索かどうか)のタプル。どちらも使えない場合は(None, False)
+        """
+        from index_manager import STATUS_READY, STATUS_EMBEDDING, STATUS_FAILED
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        refresh = False
+        while True:
+            status = self._get_status(refresh=refresh)["status"]
+            if status == STATUS_READY:
+                return self.retriever, False
+            if status == STATUS_EMBEDDING:
+                return self.retriever, True
+            if status == STATUS_FAILED and not refresh:
+                # 前回の問い合わせで失敗していた場合は、サーバーの再起動などに備えて最新の作成状況で判定し直す
+                refresh = True
+                continue
+            if status == STATUS_FAILED or (deadline is not None and time.monotonic() >= deadline):
+                return None, False
+            # 検索できるようになるまで待機する間は、最新の作成状況を問い合わせる
+            refresh = True
+            time.sleep(min(self.status_ttl, 0.5))
+
+    def get_progress(self):
+        """
+        画面表示用の進捗情報を取得
+
+        Returns:
+            進捗情報の辞書
+        """
+        status = self._get_status()
+        return {key: status.get(key) for key in ("status", "error", "files_total", "files_loaded", "chunks_total", "chunks_embedded")}
+
+    def _get_status(self, refresh=False):
+        from index_manager import STATUS_FAILED
+
+        logger = logging.getLogger(ct.LOGGER_NAME)
+
+        with self._lock:
+            if not refresh and self._status is not None and time.monotonic() - self._status_at < self.status_ttl:
+                return self._status
+        try:
+            status = self.client.status()
+        except Exception as e:
+            logger.warning(f"{ct.INDEX_SERVER_UNAVAILABLE_MESSAGE} {self.client.url} - {e}")
+            status = {
+                "status": STATUS_FAILED, "error": ct.INDEX_SERVER_UNAVAILABLE_MESSAGE,
+                "files_total": 0, "files_loaded": 0, "chunks_total": 0, "chunks_embedded": 0, "update_count": 0
+            }
+        with self._lock:
+            self._status = status
+            self._status_at = time.monotonic()
+        return status
@@ -0,0 +1,257 @@
+"""
+このファイルは、全セッションで共有するインデックス（Retriever）をバックグラウンドで作成・管理するファイルです。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import time
+import queue
+import logging
+import threading
+from metrics import observe_index_build
+import constants as ct
+
+
+############################################################
+# 変数の定義
+############################################################
+# インデックスの作成状況
+STATUS_PENDING = "pending"
+STATUS_LOADING = "loading"
+STATUS_EMBEDDING = "embedding"
+STATUS_READY = "ready"
+STATUS_FAILED = "failed"
+
+
+############################################################
+# クラス定義
+############################################################
+
+class BuildProgress:
+    """
+    インデックス作成の進捗の通知先（何もしない既定の実装）
+    """
+
+    def files_found(self, count):
+        """読み込み対象のファイル数が分かった時に呼ばれる"""
+
+    def file_loaded(self, path):
+        """ファイルを1件読み込んだ時に呼ばれる"""
+
+    def chunks_split(self, chunks):
+        """ページなどの単位でチャンク分割が進んだ時に呼ばれる"""
+
+    def chunks_embedded(self, count):
+        """チャンクの埋め込み・ベクターストアへの追加が進んだ時に呼ばれる"""
+
+
+class IndexState(BuildProgress):
+    """
+    全セッションで共有するインデックスの作成状況と、作成済みのRetrieverを保持するクラス
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        # 検索できる状態（簡易検索を含む）になった、または作成に失敗したことを通知するイベント
+        self._searchable = threading.Event()
+        self.status = STATUS_PENDING
+        self.error = None
+        self.files_total = 0
+        self.files_loaded = 0
+        self.chunks_total = 0
+        self.chunks_embedded_count = 0
+        # ベクターストアを検索するRetriever（作成完了後に設定）
+        self.retriever = None
+        # ベクターストアの作成中に使う、文字列一致ベースの簡易検索用Retriever
+        self.lexical_retriever = None
+        # 参照先フォルダの変更の監視と、変更されたパスをベクターストアに反映するためのキュー
+        self._watcher = None
+        self._ingest_queue = queue.Queue()
+        self._ingest_thread = None
+        # 変更を反映した回数と最終時刻（画面でのお知らせ用）
+        self.update_count = 0
+        self.updated_at = None
+
+    @property
+    def is_ready(self):
+        return self.status == STATUS_READY
+
+    def start(self):
+        """
+        バックグラウンドでのインデックス作成を開始（作成中・作成済みの場合は何もしない）
+        失敗していた場合は作成し直す
+        """
+        with self._lock:
+            if self.status not in (STATUS_PENDING, STATUS_FAILED):
+                return
+            self.status = STATUS_LOADING
+            self.error = None
+            if self.lexical_retriever is None:
+                self._searchable.clear()
+            self.files_total = 0
+            self.files_loaded = 0
+            self.chunks_total = 0
+            self.chunks_embedded_count = 0
+            self._thread = threading.Thread(target=self._build, name="index-builder", daemon=True)
+            self._thread.start()
+
+    def wait(self, timeout=None):
+        """
+        インデックスの作成完了（または失敗）まで待機
+
+        Returns:
+            作成が完了した場合True
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.is_ready
+
+    def get_retriever(self, timeout=None):
+        """
+        検索に使うRetrieverを取得
+        ファイルの読み込み中でまだ検索できない場合は、簡易検索ができるようになるまで待機する
+
+        Args:
+            timeout: 検索できるようになるまで待機する最大秒数
+
+        Returns:
+            (Retriever, 簡易検索かどうか)のタプル。どちらも使えない場合は(None, False)
+        """
+        self._searchable.wait(timeout)
+        if self.retriever is not None:
+            return self.retriever, False
+        if self.lexical_retriever is not None:
+            return self.lexical_retriever, True
+        return None, False
+
+    def get_progress(self):
+        """
+        画面表示用の進捗情報を取得
+
+        Returns:
+            進捗情報の辞書
+        """
+        with self._lock:
+            return {
+                "status": self.status,
+                "error": self.error,
+                "files_total": self.files_total,
+                "files_loaded": self.files_loaded,
+                "chunks_total": self.chunks_total,
+                "chunks_embedded": self.chunks_embedded_count
+            }
+
+    def enqueue_changes(self, paths):
+        """
+        変更されたパスを、ベクターストアへの反映待ちのキューに追加
+        （ファイルの監視用スレッドから呼ばれ、反映は別のスレッドで行うため待たされない）
+
+        Args:
+            paths: 変更されたファイル・フォルダのパス
+        """
+        logger = logging.getLogger(ct.LOGGER_NAME)
+        logger.info(f"ファイルの変更を検知: {', '.join(sorted(paths))}")
+        self._ingest_queue.put(set(paths))
+
+    def files_found(self, count):
+        with self._lock:
+            self.files_total = count
+
+    def file_loaded(self, path):
+        with self._lock:
+            self.files_loaded += 1
+
+    def chunks_split(self, chunks):
+        # 埋め込みが終わるまでの間、分割済みのチャンクを対象に文字列一致ベースの簡易検索で回答できるようにする
+        from lexical_index import LexicalIndex, LexicalRetriever
+        with self._lock:
+            if self.status == STATUS_LOADING:
+                self.lexical_retriever = LexicalRetriever(index=LexicalIndex(), k=ct.RETRIEVER_DOCUMENT_COUNT)
+                self.status = STATUS_EMBEDDING
+            lexical_retriever = self.lexical_retriever
+        lexical_retriever.index.add_documents(chunks)
+        with self._lock:
+            self.chunks_total += len(chunks)
+        self._searchable.set()
+
+    def chunks_embedded(self, count):
+        with self._lock:
+            self.chunks_embedded_count += count
+
+    def _build(self):
+        """
+        インデックスの作成（バックグラウンドのスレッドで実行）
+        """
+        from initialize import build_retriever
+
+        logger = logging.getLogger(ct.LOGGER_NAME)
+        # 作成中に変更されたファイルも後から反映できるよう、読み込みを始める前から監視する
+        self._start_watcher()
+        started_at = time.perf_counter()
+        try:
+            retriever = build_retriever(progress=self)
+            with self._lock:
+                self.retriever = retriever
+                self.status = STATUS_READY
+                # ベクターストアで検索できるようになったため、簡易検索用に保持していたチャンクを解放
+                self.lexical_retriever = None
+            # 作成開始（スナップショットがある場合は読み込み開始）から、ベクターストアで検索できるまでの時間
+            observe_index_build("ready", time.perf_counter() - started_at)
+        except Exception as e:
+            logger.error(f"{ct.INITIALIZE_ERROR_MESSAGE}\n{e}")
+            with self._lock:
+                self.error = str(e)
+                self.status = STATUS_FAILED
+        finally:
+            self._searchable.set()
+
+        if self.is_ready and self._watcher is not None and self._ingest_thread is None:
+            self._ingest_thread = threading.Thread(target=self._ingest, name="index-ingester", daemon=True)
+            self._ingest_thread.start()
+
+    def _start_watcher(self):
+        """
+        参照先フォルダの変更の監視を開始（2回目以降の作成時は何もしない）
+        """
+        from file_watcher import FileWatcher
+        from initialize import is_prebuilt_only
+
+        # 作成済みのインデックスのみを使う設定の場合、参照先フォルダの変更はbuild_index.pyでの作成し直しで反映する
+        if not ct.FILE_WATCH_ENABLED or is_prebuilt_only() or self._watcher is not None:
+            return
+        logger = logging.getLogger(ct.LOGGER_NAME)
+        try:
+            self._watcher = FileWatcher(ct.RAG_TOP_FOLDER_PATH, self.enqueue_changes)
+            self._watcher.start()
+        except Exception as e:
+            # 監視できなくても、起動時点のデータでの検索は行える
+            logger.warning(f"ファイルの変更の監視を開始できません: {e}")
+
+    def _ingest(self):
+        """
+        キューに追加された変更を、共有のベクターストアに順に反映（バックグラウンドのスレッドで実行）
+        """
+        from initialize import get_data_fingerprint, update_vector_store, export_index_snapshot
+
+        logger = logging.getLogger(ct.LOGGER_NAME)
+        while True:
+            paths = self._ingest_queue.get()
+            # 反映待ちの変更が続けて届いている場合は、まとめて反映する
+            while not self._ingest_queue.empty():
+                paths |= self._ingest_queue.get()
+
+            try:
+                # 反映中に変更されたファイルがあっても、次回起動時に作り直されるよう反映前の指紋を使う
+                started_at = time.perf_counter()
+                fingerprint = get_data_fingerprint()
+                db = self.retriever.vectorstore
+                update_vector_store(db, sorted(paths))
+                export_index_snapshot(db, fingerprint)
+                with self._lock:
+                    self.update_count += 1
+                    self.updated_at = time.time()
+                observe_index_build("update", time.perf_counter() - started_at)
+            except Exception as e:
+                logger.error(f"ファイルの変更の反映エラー: {', '.join(sorted(paths))} - {e}")
@@ -0,0 +1,320 @@
+"""
+このファイルは、複数のアプリのプロセスで共有するインデックスサーバーのファイルです。
+インデックス（ベクターストア・作成中の簡易検索）の作成・ファイルの変更の反映をこのプロセスだけで行い、
+アプリのプロセスはindex_client.pyを通じて検索だけを依頼するため、プロセスを増やしてもメモリ使用量・埋め込みの費用が増えません。
+
+使い方:
+    python index_server.py                                  http://127.0.0.1:8765 で待ち受け
+    python index_server.py --unix-socket /tmp/index.sock    Unixドメインソケットで待ち受け
+    INDEX_SERVER_URL=http://127.0.0.1:8765 streamlit run main.py
+
+API:
+    GET  /status    インデックスの作成状況（index_manager.IndexState.get_progressと同じ項目）
+    GET  /metrics   インデックスの作成時間などのメトリクス（Prometheusのテキスト形式、metrics.py）
+    POST /search    {"queries": [クエリ, ...], "k": 件数} → {"results": [[{"page_content", "metadata", "score"}, ...], ...], "degraded": 簡易検索かどうか}
+同時に届いた検索のクエリは、まとめて1回の埋め込みのAPI呼び出しで埋め込みます。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from concurrent.futures import Future
+from socketserver import ThreadingMixIn, UnixStreamServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from initialize import initialize_logger
+from metrics import CONTENT_TYPE, get_registry
+import constants as ct
+
+
+############################################################
+# 変数の定義
+############################################################
+# ログに出力するセッションID（画面のセッションと区別するため）
+INDEX_SERVER_SESSION_ID = "index-server"
+
+
+############################################################
+# クラス定義
+############################################################
+
+class QueryEmbeddingBatcher:
+    """
+    複数のスレッドから同時に届いたクエリを、まとめて1回の呼び出しで埋め込むクラス
+    """
+
+    def __init__(self, embeddings, batch_wait=ct.INDEX_SERVER_BATCH_WAIT, batch_size=ct.INDEX_SERVER_BATCH_SIZE):
+        """
+        Args:
+            embeddings: クエリの埋め込みに使うモデル
+            batch_wait: 後から届くクエリをまとめるために待つ秒数
+            batch_size: まとめて埋め込むクエリ数の上限
+        """
+        self.embeddings = embeddings
+        self.batch_wait = batch_wait
+        self.batch_size = max(1, batch_size)
+        self._pending = []
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="index-server-embedder", daemon=True)
+        self._thread.start()
+
+    def embed(self, queries):
+        """
+        クエリを埋め込む（他のスレッドのクエリとまとめて埋め込まれるまで待機）
+
+        Args:
+            queries: クエリのリスト
+
+        Returns:
+            埋め込みベクトルのリスト
+        """
+        future = Future()
+        with self._condition:
+            self._pending.append((queries, future))
+            self._condition.notify()
+        return future.result()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+            # 少しだけ待ち、同時に届いた他のクエリもまとめる
+            time.sleep(self.batch_wait)
+            with self._condition:
+                batch = []
+                count = 0
+                while self._pending and (not batch or count + len(self._pending[0][0]) <= self.batch_size):
+                    queries, future = self._pending.pop(0)
+                    batch.append((queries, future))
+                    count += len(queries)
+
+            try:
+                # インデックスの再読み込みで埋め込みモデルが差し替えられても、まとめた分は同じモデルで埋め込む
+                embeddings = self.embeddings
+                vectors = embeddings.embed_documents([query for queries, _ in batch for query in queries])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            position = 0
+            for queries, future in batch:
+                future.set_result(vectors[position:position + len(queries)])
+                position += len(queries)
+
+
+class IndexRequestHandler(BaseHTTPRequestHandler):
+    """
+    インデックスの作成状況の問い合わせと、検索のリクエストを処理するハンドラー
+    """
+    # 接続を使い回せるよう、Keep-Aliveに対応する
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/status":
+            self._send_json(200, get_status(self.server.index_state))
+        elif self.path.rstrip("/") == "/metrics":
+            self._send_text(200, get_registry().render(), CONTENT_TYPE)
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        logger = logging.getLogger(ct.LOGGER_NAME)
+
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.rstrip("/") != "/search":
+            self._send_json(404, {"error": "not found"})
+            return
+        try:
+            request = json.loads(body or b"{}")
+            queries = [str(query) for query in request["queries"]]
+            k = int(request.get("k", ct.RETRIEVER_DOCUMENT_COUNT))
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {"error": f"invalid request: {e}"})
+            return
+
+        try:
+            self._send_json(200, self.server.search(queries, k))
+        except Exception as e:
+            logger.error(f"インデックスサーバーの検索エラー: {e}")
+            self._send_json(503, {"error": str(e)})
+
+    def address_string(self):
+        # Unixドメインソケットでは接続元のアドレスが無い
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def log_message(self, format, *args):
+        # アクセスログはコンソールに出力しない（検索の内容はアプリ側のログに出力される）
+        pass
+
+    def _send_json(self, status, payload):
+        self._send_text(status, json.dumps(payload, ensure_ascii=False), "application/json")
+
+    def _send_text(self, status, text, content_type):
+        data = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class IndexServerMixin:
+    """
+    インデックスの作成状況を保持し、検索を行うサーバーの共通処理
+    """
+
+    def setup_index(self, index_state):
+        """
+        Args:
+            index_state: インデックスの作成状況（index_manager.IndexState）
+        """
+        self.index_state = index_state
+        self.daemon_threads = True
+        self._batcher = None
+        self._batcher_lock = threading.Lock()
+
+    def search(self, queries, k):
+        """
+        クエリごとに関連度の高い順にドキュメントを検索
+
+        Args:
+            queries: クエリのリスト
+            k: クエリごとに取得するドキュメント数
+
+        Returns:
+            クエリごとの検索結果と、簡易検索かどうかの辞書
+        """
+        retriever, degraded = self.index_state.get_retriever(timeout=ct.INDEX_WAIT_TIMEOUT)
+        if retriever is None:
+            raise RuntimeError(self.index_state.error or ct.RETRIEVER_NOT_INITIALIZED_ERROR)
+
+        if degraded:
+            # ベクターストアの作成中は、文字列一致ベースの簡易検索の結果を返す（関連度は無し）
+            results = [[(doc, None) for doc in retriever.invoke(query)[:k]] for query in queries]
+        else:
+            db = retriever.vectorstore
+            vectors = self._get_batcher(db.embeddings).embed(queries)
+            results = [search_by_vector(db, vector, k) for vector in vectors]
+
+        return {
+            "results": [
+                [{"page_content": doc.page_content, "metadata": doc.metadata, "score": score} for doc, score in docs_and_scores]
+                for docs_and_scores in results
+            ],
+            "degraded": degraded
+        }
+
+    def _get_batcher(self, embeddings):
+        # インデックスの再読み込みで埋め込みモデルが変わった場合も、スレッドを増やさないよう同じBatcherで差し替える
+        with self._batcher_lock:
+            if self._batcher is None:
+                self._batcher = QueryEmbeddingBatcher(embeddings)
+            elif self._batcher.embeddings is not embeddings:
+                self._batcher.embeddings = embeddings
+            return self._batcher
+
+
+class IndexHTTPServer(IndexServerMixin, ThreadingHTTPServer):
+    """
+    localhostのHTTPで待ち受けるインデックスサーバー
+    """
+
+
+class IndexUnixServer(IndexServerMixin, ThreadingMixIn, UnixStreamServer):
+    """
+    Unixドメインソケットで待ち受けるインデックスサーバー
+    """
+
+
+############################################################
+# 関数定義
+############################################################
+
+def search_by_vector(db, vector, k):
+    """
+    埋め込み済みのクエリで、ベクターストアから関連度付きで検索
+
+    Args:
+        db: ベクターストア
+        vector: クエリの埋め込みベクトル
+        k: 取得するドキュメント数
+
+    Returns:
+        (ドキュメント, 関連度)のタプルのリスト（関連度の高い順。尺度はsimilarity_search_with_relevance_scoresと同じ）
+    """
+    relevance = db._select_relevance_score_fn()
+    # numpyベクターストアはコサイン類似度、ChromaはL2距離を返すため、どちらも関連度に変換する
+    if hasattr(db, "similarity_search_with_score_by_vector"):
+        docs_and_scores = db.similarity_search_with_score_by_vector(vector, k=k)
+    else:
+        docs_and_scores = db.similarity_search_by_vector_with_relevance_scores(vector, k=k)
+    return [(doc, relevance(score)) for doc, score in docs_and_scores]
+
+
+def get_status(index_state):
+    """
+    インデックスの作成状況を取得
+
+    Args:
+        index_state: インデックスの作成状況（index_manager.IndexState）
+
+    Returns:
+        作成状況と、変更を反映した回数の辞書
+    """
+    return dict(index_state.get_progress(), update_count=index_state.update_count)
+
+
+def main(argv=None):
+    """
+    コマンドラインからの実行
+    """
+    from index_manager import IndexState
+
+    parser = argparse.ArgumentParser(description="複数のアプリのプロセスで共有するインデックスサーバーを起動します。")
+    parser.add_argument("--host", default=ct.INDEX_SERVER_HOST, help="待ち受けるホスト")
+    parser.add_argument("--port", type=int, default=ct.INDEX_SERVER_PORT, help="待ち受けるポート番号")
+    parser.add_argument("--unix-socket", help="HTTPの代わりに待ち受けるUnixドメインソケットのパス")
+    args = parser.parse_args(argv)
+
+    initialize_logger(session_id=INDEX_SERVER_SESSION_ID)
+    logger = logging.getLogger(ct.LOGGER_NAME)
+
+    if args.unix_socket:
+        # 前回の起動で残ったソケットファイルは作り直す
+        if os.path.exists(args.unix_socket):
+            os.remove(args.unix_socket)
+        server = IndexUnixServer(args.unix_socket, IndexRequestHandler)
+        url = f"unix://{os.path.abspath(args.unix_socket)}"
+    else:
+        server = IndexHTTPServer((args.host, args.port), IndexRequestHandler)
+        url = f"http://{args.host}:{args.port}"
+
+    # インデックスの作成はバックグラウンドで行い、作成中も簡易検索・作成状況の問い合わせに応答する
+    index_state = IndexState()
+    server.setup_index(index_state)
+    index_state.start()
+
+    logger.info(f"インデックスサーバーの起動: {url}")
+    print(f"{url} で待ち受けています（Ctrl+Cで終了）")
+    print(f"アプリの起動: INDEX_SERVER_URL={url} streamlit run main.py")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.unix_socket and os.path.exists(args.unix_socket):
+            os.remove(args.unix_socket)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
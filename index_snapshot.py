@@ -0,0 +1,206 @@
+"""
+このファイルは、チャンクと埋め込みベクトルを1つのファイル（スナップショット）に書き出し、読み取り専用のmmapで読み込むファイルです。
+mmapで読み込むため、同じホスト上の複数のStreamlitプロセスが同じ物理メモリを共有でき、起動時の読み込みもほぼ一瞬で終わります。
+
+ファイルの構成:
+    マジックナンバー（8バイト）| ヘッダーの長さ（8バイト）| ヘッダー（JSON）| 各セクション（64バイト境界に配置）
+
+セクション:
+    strings: 重複を除いた文字列（チャンクのテキスト・メタデータのJSON・ID）をUTF-8で連結したもの
+    string_offsets: strings内の各文字列の開始位置（uint64、文字列数+1個）
+    chunk_refs: チャンクごとの(テキスト, メタデータ, ID)の文字列番号（uint32、チャンク数x3）
+    matrix: 埋め込みベクトルの行列（チャンク数x次元数）
+    scales: int8の場合の行ごとのスケール（float32、チャンク数）
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import json
+import mmap
+import struct
+import numpy as np
+
+
+############################################################
+# 変数の定義
+############################################################
+SNAPSHOT_MAGIC = b"RAGSNAP1"
+SNAPSHOT_VERSION = 1
+# 各セクションの配置境界（バイト）
+SECTION_ALIGNMENT = 64
+
+
+############################################################
+# クラス定義
+############################################################
+
+class IndexSnapshot:
+    """
+    スナップショットファイルを読み取り専用のmmapで開き、チャンクと埋め込みベクトルを参照するクラス
+    行列はファイルのページをそのまま参照するため、読み込み時にコピーは発生しない
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path: スナップショットファイルのパス
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mmap[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError(f"スナップショットファイルではありません: {path}")
+        (header_length,) = struct.unpack_from("<Q", self._mmap, len(SNAPSHOT_MAGIC))
+        header_start = len(SNAPSHOT_MAGIC) + 8
+        self.header = json.loads(self._mmap[header_start:header_start + header_length].decode("utf-8"))
+        if self.header["version"] != SNAPSHOT_VERSION:
+            raise ValueError(f"未対応のスナップショットのバージョンです: {self.header['version']}")
+
+        self.dtype = self.header["dtype"]
+        self.info = self.header.get("info", {})
+        self._string_offsets = self._section("string_offsets")
+        self._chunk_refs = self._section("chunk_refs")
+        self._strings_start = self.header["sections"]["strings"]["offset"]
+        self.matrix = self._section("matrix")
+        self.scales = self._section("scales") if "scales" in self.header["sections"] else None
+
+        self.texts = _StringColumn(self, 0)
+        self.metadatas = _StringColumn(self, 1, decode=json.loads)
+        self.ids = _StringColumn(self, 2)
+
+    def __len__(self):
+        return self.header["count"]
+
+    def get_string(self, string_index):
+        """
+        文字列テーブルから文字列を取り出す
+
+        Args:
+            string_index: 文字列番号
+
+        Returns:
+            文字列
+        """
+        start = self._strings_start + int(self._string_offsets[string_index])
+        end = self._strings_start + int(self._string_offsets[string_index + 1])
+        return self._mmap[start:end].decode("utf-8")
+
+    def _section(self, name):
+        section = self.header["sections"][name]
+        count = int(np.prod(section["shape"]))
+        array = np.frombuffer(self._mmap, dtype=section["dtype"], count=count, offset=section["offset"])
+        return array.reshape(section["shape"])
+
+
+class _StringColumn:
+    """
+    チャンクごとのテキスト・メタデータ・IDを、参照された時にだけ文字列テーブルから取り出すシーケンス
+    """
+
+    def __init__(self, snapshot, column, decode=None):
+        self._snapshot = snapshot
+        self._column = column
+        self._decode = decode
+
+    def __len__(self):
+        return len(self._snapshot)
+
+    def __getitem__(self, i):
+        value = self._snapshot.get_string(int(self._snapshot._chunk_refs[i, self._column]))
+        return self._decode(value) if self._decode else value
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+############################################################
+# 関数定義
+############################################################
+
+def write_snapshot(path, texts, metadatas, ids, matrix, scales=None, dtype="float32", info=None):
+    """
+    チャンクと埋め込みベクトルをスナップショットファイルに書き出す
+    書き出し中のファイルを読み込まれないよう、一時ファイルに書き出してから置き換える
+
+    Args:
+        path: スナップショットファイルのパス
+        texts: チャンクのテキストのリスト
+        metadatas: チャンクのメタデータのリスト
+        ids: チャンクのIDのリスト
+        matrix: 埋め込みベクトルの行列（保存形式に変換済み）
+        scales: int8の場合の行ごとのスケール
+        dtype: 埋め込みベクトルの保存形式
+        info: 任意の付加情報（作成元データの指紋など）
+    """
+    # 重複する文字列（同じメタデータなど）は1回だけ格納する
+    string_ids = {}
+    strings = []
+    chunk_refs = np.empty((len(texts), 3), dtype=np.uint32)
+    for i, values in enumerate(zip(texts, metadatas, ids)):
+        text, metadata, doc_id = values
+        for column, value in enumerate((text, json.dumps(metadata, ensure_ascii=False, sort_keys=True), str(doc_id))):
+            if value not in string_ids:
+                string_ids[value] = len(strings)
+                strings.append(value.encode("utf-8"))
+            chunk_refs[i, column] = string_ids[value]
+
+    string_offsets = np.zeros(len(strings) + 1, dtype=np.uint64)
+    np.cumsum([len(s) for s in strings], out=string_offsets[1:])
+
+    sections = [
+        ("string_offsets", string_offsets),
+        ("chunk_refs", chunk_refs),
+        ("matrix", np.ascontiguousarray(matrix)),
+    ]
+    if scales is not None:
+        sections.append(("scales", np.ascontiguousarray(scales, dtype=np.float32)))
+
+    # ヘッダーの長さで各セクションの位置が変わるため、位置を決めてからヘッダーを作る
+    header = {
+        "version": SNAPSHOT_VERSION,
+        "count": len(texts),
+        "dtype": dtype,
+        "info": info or {},
+        "sections": {}
+    }
+    placeholder = {name: {"offset": 0, "dtype": array.dtype.str, "shape": list(array.shape)} for name, array in sections}
+    placeholder["strings"] = {"offset": 0, "size": int(string_offsets[-1])}
+    header["sections"] = placeholder
+    # オフセットの桁数が増えてもはみ出さないよう、ヘッダー領域に余裕を持たせる
+    header_capacity = _align(len(json.dumps(header).encode("utf-8")) + 32 * (len(sections) + 1))
+
+    position = len(SNAPSHOT_MAGIC) + 8 + header_capacity
+    layout = []
+    for name, array in sections:
+        position = _align(position)
+        header["sections"][name]["offset"] = position
+        layout.append((position, array.tobytes()))
+        position += array.nbytes
+    position = _align(position)
+    header["sections"]["strings"]["offset"] = position
+    layout.append((position, b"".join(strings)))
+
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    if len(header_bytes) > header_capacity:
+        raise ValueError("スナップショットのヘッダーが想定より大きくなりました")
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for offset, data in layout:
+            f.write(b"\0" * (offset - f.tell()))
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    # 置き換え前のファイルをmmapしているプロセスは、古い内容のまま読み続けられる
+    os.replace(tmp_path, path)
+
+
+def _align(position):
+    return (position + SECTION_ALIGNMENT - 1) // SECTION_ALIGNMENT * SECTION_ALIGNMENT
@@ -0,0 +1,196 @@
+"""
+このファイルは、取り込み処理（ingest_pipeline.IngestPipeline）で埋め込みの前に不要なテキストを取り除く処理のファイルです。
+・ページに分かれたファイルで、ほとんどのページの先頭・末尾に現れる行（ヘッダー・フッター・ページ番号）を取り除く
+・同じファイル内で、正規化したテキストが同じチャンクを1件だけ残す
+取り除いた分は埋め込みのAPIに送らずに済むため、節約できたチャンク数・トークン数を集計します。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import re
+import math
+import hashlib
+import unicodedata
+from collections import Counter
+import utils
+import constants as ct
+
+
+############################################################
+# 変数の定義
+############################################################
+# ページ番号のみの行（「3」「- 3 -」「3 / 10」「p.3」「3ページ」など）
+PAGE_NUMBER_PATTERN = re.compile(r"[-‐－―—\s]*(?:p\.?|page|ページ)?\s*\d+\s*(?:/\s*\d+|ページ)?[-‐－―—\s]*", re.IGNORECASE)
+# ページ番号の行を、番号に関わらず同じ行として数えるための置き換え先
+PAGE_NUMBER_KEY = "<page-number>"
+
+
+############################################################
+# クラス定義
+############################################################
+
+class BoilerplateStripper:
+    """
+    ページに分かれたファイルのヘッダー・フッター・ページ番号を取り除くクラス
+    （ファイル先頭の数ページだけを先に読み込んで判定し、残りのページは読み込んだ順に処理する）
+    """
+
+    def __init__(self, sample_pages=ct.BOILERPLATE_SAMPLE_PAGES, min_pages=ct.BOILERPLATE_MIN_PAGES,
+                 min_page_ratio=ct.BOILERPLATE_MIN_PAGE_RATIO, edge_lines=ct.BOILERPLATE_EDGE_LINES):
+        """
+        Args:
+            sample_pages: 判定に使うファイル先頭からのページ数
+            min_pages: 判定を行うファイルの最小ページ数
+            min_page_ratio: ヘッダー・フッターとみなす、行が現れるページの割合
+            edge_lines: ページの先頭・末尾から、ヘッダー・フッターの候補にする行数
+        """
+        self.sample_pages = max(1, sample_pages)
+        self.min_pages = max(2, min_pages)
+        self.min_page_ratio = min_page_ratio
+        self.edge_lines = edge_lines
+        # 取り除いた行数と、その分のトークン数
+        self.removed_lines = 0
+        self.saved_tokens = 0
+
+    def strip(self, docs):
+        """
+        1ファイル分のドキュメントから、ヘッダー・フッター・ページ番号の行を取り除く
+
+        Args:
+            docs: 1ファイル分のドキュメントの反復可能オブジェクト（PDFのページなど）
+
+        Returns:
+            行を取り除いたドキュメントのジェネレーター
+        """
+        docs = iter(docs)
+        samples = []
+        for doc in docs:
+            samples.append(doc)
+            if len(samples) >= self.sample_pages:
+                break
+
+        boilerplate = self.find_boilerplate(samples)
+        for doc in samples:
+            yield self._strip_doc(doc, boilerplate)
+        for doc in docs:
+            yield self._strip_doc(doc, boilerplate)
+
+    def find_boilerplate(self, pages):
+        """
+        ページの先頭・末尾に繰り返し現れる行を見つける
+
+        Args:
+            pages: 同じファイルのページのドキュメントのリスト
+
+        Returns:
+            ヘッダー・フッターとみなす行（line_keyで変換したもの）の集合
+        """
+        # CSVの行などページ以外の単位で分かれたドキュメントは、同じ項目名の行が並ぶため対象にしない
+        if len(pages) < self.min_pages or any("page" not in page.metadata for page in pages):
+            return set()
+
+        counts = Counter()
+        for page in pages:
+            lines = [line for line in page.page_content.splitlines() if line.strip()]
+            counts.update({line_key(line) for line in self._edge(lines)})
+
+        min_count = max(2, math.ceil(len(pages) * self.min_page_ratio))
+        return {key for key, count in counts.items() if count >= min_count}
+
+    def _edge(self, lines):
+        # ページの先頭・末尾の行（短いページでは同じ行を重複して数えない）
+        if len(lines) <= self.edge_lines * 2:
+            return lines
+        return lines[:self.edge_lines] + lines[-self.edge_lines:]
+
+    def _strip_doc(self, doc, boilerplate):
+        if not boilerplate:
+            return doc
+
+        lines = doc.page_content.splitlines()
+        # ページの途中の行は、ヘッダー・フッターと同じ内容でも本文の一部として残す
+        positions = [i for i, line in enumerate(lines) if line.strip()]
+        edge_positions = set(self._edge(positions))
+        kept = []
+        for i, line in enumerate(lines):
+            if i in edge_positions and line_key(line) in boilerplate:
+                self.removed_lines += 1
+                self.saved_tokens += utils.count_tokens(line)
+            else:
+                kept.append(line)
+        doc.page_content = "\n".join(kept)
+        return doc
+
+
+class ChunkDeduplicator:
+    """
+    同じファイル内で、正規化したテキストが同じチャンクを1件だけ残すクラス
+    （ファイルの変更の反映ではファイル単位でチャンクを入れ替えるため、重複の判定もファイル単位で行う）
+    """
+
+    def __init__(self):
+        self._source = None
+        self._seen = set()
+        # 取り除いたチャンク数と、その分のトークン数
+        self.duplicates = 0
+        self.saved_tokens = 0
+
+    def filter(self, chunks):
+        """
+        既に残したチャンクと重複するチャンクを取り除く
+
+        Args:
+            chunks: チャンクのリスト（同じファイルのチャンクは続けて渡す）
+
+        Returns:
+            重複を取り除いたチャンクのリスト
+        """
+        kept = []
+        for chunk in chunks:
+            source = chunk.metadata.get("source")
+            if source != self._source:
+                self._source = source
+                self._seen = set()
+
+            digest = hashlib.blake2b(normalize_text(chunk.page_content).encode("utf-8"), digest_size=16).digest()
+            if digest in self._seen:
+                self.duplicates += 1
+                self.saved_tokens += utils.count_tokens(chunk.page_content)
+                continue
+            self._seen.add(digest)
+            kept.append(chunk)
+        return kept
+
+
+############################################################
+# 関数定義
+############################################################
+
+def normalize_text(text):
+    """
+    重複の判定用にテキストを正規化（全角・半角の統一、空白の違いを無視）
+
+    Args:
+        text: 正規化するテキスト
+
+    Returns:
+        正規化したテキスト
+    """
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def line_key(line):
+    """
+    ヘッダー・フッターの判定用に行を変換（ページ番号のみの行は、番号に関わらず同じ行とみなす）
+
+    Args:
+        line: ページ内の1行
+
+    Returns:
+        判定用の文字列
+    """
+    line = normalize_text(line)
+    if PAGE_NUMBER_PATTERN.fullmatch(line):
+        return PAGE_NUMBER_KEY
+    return line
@@ -0,0 +1,349 @@
+"""
+このファイルは、データソースの読み込み → チャンク分割 → 埋め込み → ベクターストアへの追加を、
+段階ごとのスレッドで並行して流す取り込み処理（パイプライン）のファイルです。
+段階の間は上限付きのキューでつなぎ、後段が詰まっている間は前段が待つため、全件をメモリに溜め込みません。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import sys
+import time
+import queue
+import logging
+import threading
+from uuid import uuid4
+import constants as ct
+
+try:
+    # Windowsには無いモジュールのため、無い場合は最大メモリ使用量をログに出さない
+    import resource
+except ImportError:
+    resource = None
+
+
+############################################################
+# 変数の定義
+############################################################
+# 段階の終わりを後段に伝える目印
+_DONE = object()
+# キューの待機中に、他の段階のエラーによる中断を確認する間隔（秒）
+_POLL_INTERVAL = 0.1
+
+
+############################################################
+# クラス定義
+############################################################
+
+class _Cancelled(Exception):
+    """
+    他の段階のエラーで、パイプライン全体が中断されたことを表す例外
+    """
+
+
+class IngestPipeline:
+    """
+    データソースを1件ずつ読み込み、チャンク分割・埋め込み・ベクターストアへの追加までを段階ごとに並行して行うクラス
+    """
+
+    def __init__(self, db, embeddings, progress=None, batch_size=ct.EMBEDDING_BATCH_SIZE, embed_workers=ct.INGEST_EMBED_WORKERS, splitters=None):
+        """
+        Args:
+            db: チャンクを追加するベクターストア
+            embeddings: チャンクの埋め込みに使うモデル
+            progress: 取り込みの進捗の通知先（index_manager.BuildProgress）
+            batch_size: まとめて埋め込むチャンク数
+            embed_workers: 同時に埋め込みを行うスレッド数
+            splitters: チャンク分割用のオブジェクト（未指定の場合は設定に従って作成）
+        """
+        from index_manager import BuildProgress
+        from ingest_filters import BoilerplateStripper, ChunkDeduplicator
+
+        self.db = db
+        self.embeddings = embeddings
+        self.progress = progress or BuildProgress()
+        self.batch_size = batch_size
+        self.embed_workers = max(1, embed_workers)
+        self.splitters = splitters
+        # 埋め込みの前に、ヘッダー・フッターの行と、同じファイル内で重複するチャンクを取り除く
+        self.stripper = BoilerplateStripper() if ct.BOILERPLATE_STRIP_ENABLED else None
+        self.deduplicator = ChunkDeduplicator() if ct.INGEST_DEDUP_ENABLED else None
+        self._stop = threading.Event()
+        self._errors = []
+        self._lock = threading.Lock()
+        # 取り込み状況の集計（「*_time」は各段階が処理に使った秒数の合計、「saved_tokens」は取り除いて埋め込まずに済んだトークン数）
+        self.stats = {
+            "files": 0, "empty_files": 0, "documents": 0, "chunks": 0, "batches": 0,
+            "boilerplate_lines": 0, "duplicate_chunks": 0, "saved_tokens": 0, "embedded_tokens": 0,
+            "load_time": 0.0, "split_time": 0.0, "embed_time": 0.0, "insert_time": 0.0
+        }
+
+    def run(self, sources):
+        """
+        データソースを取り込む（全段階が終わるまで待機）
+
+        Args:
+            sources: 読み込むファイルパス・URLの反復可能オブジェクト（ジェネレーターでもよい）
+
+        Returns:
+            取り込み状況の集計の辞書
+        """
+        logger = logging.getLogger(ct.LOGGER_NAME)
+
+        documents_queue = queue.Queue(ct.INGEST_QUEUE_SIZE)
+        batch_queue = queue.Queue(ct.INGEST_QUEUE_SIZE)
+        embedded_queue = queue.Queue(ct.INGEST_QUEUE_SIZE)
+
+        threads = [
+            threading.Thread(target=self._run_stage, args=(self._load, sources, documents_queue), name="ingest-load", daemon=True),
+            threading.Thread(target=self._run_stage, args=(self._split, documents_queue, batch_queue), name="ingest-split", daemon=True)
+        ]
+        threads += [
+            threading.Thread(target=self._run_stage, args=(self._embed, batch_queue, embedded_queue), name=f"ingest-embed-{i}", daemon=True)
+            for i in range(self.embed_workers)
+        ]
+
+        started_at = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        # ベクターストアへの追加は、呼び出し元のスレッドで順に行う
+        self._run_stage(self._insert, embedded_queue, started_at)
+        for thread in threads:
+            thread.join()
+
+        if self._errors:
+            raise self._errors[0]
+
+        if self.stripper is not None:
+            self.stats["boilerplate_lines"] = self.stripper.removed_lines
+            self.stats["saved_tokens"] += self.stripper.saved_tokens
+        if self.deduplicator is not None:
+            self.stats["duplicate_chunks"] = self.deduplicator.duplicates
+            self.stats["saved_tokens"] += self.deduplicator.saved_tokens
+        self.stats["elapsed"] = time.perf_counter() - started_at
+        self.stats["peak_memory_mb"] = peak_memory_mb()
+        logger.info(f"取り込み完了: {format_stats(self.stats)}")
+        return self.stats
+
+    def _run_stage(self, stage, *args):
+        """
+        段階の処理を実行し、エラーの場合は他の段階も中断させる
+        """
+        try:
+            stage(*args)
+        except _Cancelled:
+            pass
+        except Exception as e:
+            self._errors.append(e)
+            self._stop.set()
+
+    def _load(self, sources, output):
+        """
+        データソースを1件ずつ読み込んで後段に渡す
+        """
+        from initialize import load_source
+
+        for source in sources:
+            # PDFなどはページを読み込んだ順に後段に渡し、1ファイル分を溜め込まない
+            docs = load_source(source)
+            if self.stripper is not None:
+                docs = self.stripper.strip(docs)
+            count = 0
+            while True:
+                started_at = time.perf_counter()
+                doc = next(docs, None)
+                self._add_stats(load_time=time.perf_counter() - started_at)
+                if doc is None:
+                    break
+                count += 1
+                self._add_stats(documents=1)
+                self._put(output, [doc])
+            # 読み込みエラーなどで内容を1件も取り出せなかったファイルも数えておく
+            self._add_stats(files=1, empty_files=0 if count else 1)
+            self.progress.file_loaded(source)
+        self._put(output, _DONE)
+
+    def _split(self, documents_queue, output):
+        """
+        ページなどの単位でチャンク分割し、一定件数ずつまとめて後段に渡す
+        """
+        from initialize import create_splitters, split_chunks
+
+        splitters = self.splitters or create_splitters()
+        pending = []
+        while True:
+            docs = self._get(documents_queue)
+            if docs is _DONE:
+                break
+            started_at = time.perf_counter()
+            chunks = split_chunks(docs, splitters)
+            if self.deduplicator is not None:
+                chunks = self.deduplicator.filter(chunks)
+            self._add_stats(chunks=len(chunks), split_time=time.perf_counter() - started_at)
+            self.progress.chunks_split(chunks)
+
+            pending.extend(chunks)
+            while len(pending) >= self.batch_size:
+                self._put(output, pending[:self.batch_size])
+                pending = pending[self.batch_size:]
+
+        if pending:
+            self._put(output, pending)
+        # 埋め込みのスレッドごとに終わりを伝える
+        for _ in range(self.embed_workers):
+            self._put(output, _DONE)
+
+    def _embed(self, batch_queue, output):
+        """
+        チャンクをまとめて埋め込み、埋め込みベクトルとともに後段に渡す
+        """
+        import utils
+
+        while True:
+            batch = self._get(batch_queue)
+            if batch is _DONE:
+                break
+            texts = [chunk.page_content for chunk in batch]
+            started_at = time.perf_counter()
+            vectors = self.embeddings.embed_documents(texts)
+            self._add_stats(embed_time=time.perf_counter() - started_at, embedded_tokens=sum(utils.count_tokens(text) for text in texts))
+            self._put(output, (batch, vectors))
+        self._put(output, _DONE)
+
+    def _insert(self, embedded_queue, started_at):
+        """
+        埋め込み済みのチャンクをベクターストアに追加し、一定間隔で取り込み状況をログ出力
+        """
+        logger = logging.getLogger(ct.LOGGER_NAME)
+
+        remaining_workers = self.embed_workers
+        logged_at = time.perf_counter()
+        while remaining_workers:
+            item = self._get(embedded_queue)
+            if item is _DONE:
+                remaining_workers -= 1
+                continue
+            batch, vectors = item
+            insert_started_at = time.perf_counter()
+            add_embedded_chunks(self.db, batch, vectors)
+            now = time.perf_counter()
+            self._add_stats(batches=1, insert_time=now - insert_started_at)
+            self.progress.chunks_embedded(len(batch))
+
+            if now - logged_at >= ct.INGEST_LOG_INTERVAL:
+                logged_at = now
+                stats = dict(self.stats, elapsed=now - started_at, peak_memory_mb=peak_memory_mb())
+                logger.info(f"取り込み中: {format_stats(stats)}")
+
+    def _put(self, output, item):
+        # 後段が詰まっている間は待機する（他の段階がエラーで中断した場合は待機をやめる）
+        while True:
+            if self._stop.is_set():
+                raise _Cancelled()
+            try:
+                output.put(item, timeout=_POLL_INTERVAL)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, input_queue):
+        while True:
+            if self._stop.is_set():
+                raise _Cancelled()
+            try:
+                return input_queue.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+
+    def _add_stats(self, **values):
+        with self._lock:
+            for key, value in values.items():
+                self.stats[key] += value
+
+
+############################################################
+# 関数定義
+############################################################
+
+def add_embedded_chunks(db, chunks, vectors):
+    """
+    埋め込み済みのチャンクをベクターストアに追加（埋め込みをやり直さない）
+
+    Args:
+        db: 追加先のベクターストア
+        chunks: チャンクのリスト
+        vectors: チャンクの埋め込みベクトルのリスト
+    """
+    texts = [chunk.page_content for chunk in chunks]
+    metadatas = [chunk.metadata for chunk in chunks]
+
+    # numpyベクターストアの場合
+    if hasattr(db, "add_embeddings"):
+        db.add_embeddings(texts, vectors, metadatas=metadatas)
+    # Chromaの場合、LangChainのラッパーは埋め込みと追加を分けられないため、コレクションに直接追加する
+    elif hasattr(db, "_collection"):
+        db._collection.upsert(
+            ids=[str(uuid4()) for _ in chunks],
+            embeddings=[list(map(float, vector)) for vector in vectors],
+            documents=texts,
+            metadatas=metadatas
+        )
+    else:
+        db.add_documents(chunks)
+
+
+def peak_memory_mb():
+    """
+    プロセスの最大メモリ使用量（MB）を取得
+
+    Returns:
+        最大メモリ使用量（取得できない環境ではNone）
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOSはバイト単位、Linuxはキロバイト単位
+    if sys.platform == "darwin":
+        return peak / 1024 / 1024
+    return peak / 1024
+
+
+def format_stats(stats):
+    """
+    取り込み状況の集計を、ログ出力用の文字列に変換
+
+    Args:
+        stats: 取り込み状況の集計の辞書
+
+    Returns:
+        ログ出力用の文字列
+    """
+    elapsed = max(stats["elapsed"], 1e-9)
+    peak_memory = "不明" if stats["peak_memory_mb"] is None else f"{stats['peak_memory_mb']:.0f}MB"
+    return (
+        f"ファイル{stats['files']}件（内容なし{stats['empty_files']}件）, ドキュメント{stats['documents']}件, チャンク{stats['chunks']}件"
+        f"（追加済み{stats['batches']}バッチ）, {elapsed:.1f}秒"
+        f"（{stats['files'] / elapsed:.1f}ファイル/秒, {stats['chunks'] / elapsed:.1f}チャンク/秒）, "
+        f"最大メモリ使用量{peak_memory}, "
+        f"{format_savings(stats)}, "
+        f"各段階の処理時間: 読み込み{stats['load_time']:.1f}秒, 分割{stats['split_time']:.1f}秒, "
+        f"埋め込み{stats['embed_time']:.1f}秒, 追加{stats['insert_time']:.1f}秒"
+    )
+
+
+def format_savings(stats):
+    """
+    取り込み時に取り除いたテキストの集計を、ログ出力用の文字列に変換
+
+    Args:
+        stats: 取り込み状況の集計の辞書
+
+    Returns:
+        ログ出力用の文字列
+    """
+    total_tokens = stats["embedded_tokens"] + stats["saved_tokens"]
+    ratio = stats["saved_tokens"] / total_tokens if total_tokens else 0.0
+    return (
+        f"除去: 重複チャンク{stats['duplicate_chunks']}件, ヘッダー・フッター{stats['boilerplate_lines']}行"
+        f"（埋め込みトークン{stats['saved_tokens']}件を節約, {ratio:.1%}）"
+    )
@@ -6,19 +6,17 @@
 # ライブラリの読み込み
 ############################################################
 import os
+import time
 import logging
+import itertools
 from logging.handlers import TimedRotatingFileHandler
 from uuid import uuid4
 import sys
 import unicodedata
 from dotenv import load_dotenv
 import streamlit as st
-from docx import Document
-from langchain_community.document_loaders import WebBaseLoader
-from langchain_text_splitters import CharacterTextSplitter, RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import Chroma
-from langchain_core.documents import Document as LangchainDoc
+import loaders
+from conversation_store import get_conversation
 import constants as ct
 
 
@@ -37,19 +35,24 @@ def initialize():
     """
     画面読み込み時に実行する初期化処理
     """
+    # ログ出力・会話ログの保持用にセッションIDを生成
+    initialize_session_id()
     # 初期化データの用意
     initialize_session_state()
-    # ログ出力用にセッションIDを生成
-    initialize_session_id()
     # ログ出力の設定
     initialize_logger()
-    # RAGのRetrieverを作成
-    initialize_retriever()
+    # RAGのRetriever（全セッション共有）の作成をバックグラウンドで開始
+    initialize_index()
+    # 処理件数・処理時間などのメトリクスの公開を開始（プロセス内で初回のみ）
+    initialize_metrics()
 
 
-def initialize_logger():
+def initialize_logger(session_id=None):
     """
     ログ出力の設定
+
+    Args:
+        session_id: ログに出力するセッションID（未指定の場合は画面のセッションIDを使用）
     """
     try:
         # 指定のログフォルダが存在すれば読み込み、存在しなければ新規作成
@@ -76,8 +79,10 @@ def initialize_logger():
         # - 「funcName」: ログが出力された関数名
         # - 「session_id」: セッションID（誰のアプリ操作か分かるように）
         # - 「message」: ログメッセージ
+        if session_id is None:
+            session_id = st.session_state.session_id
         formatter = logging.Formatter(
-            f"[%(levelname)s] %(asctime)s line %(lineno)s, in %(funcName)s, session_id={st.session_state.session_id}: %(message)s"
+            f"[%(levelname)s] %(asctime)s line %(lineno)s, in %(funcName)s, session_id={session_id}: %(message)s"
         )
 
         # 定義したフォーマッターの適用
@@ -102,202 +107,547 @@ def initialize_session_id():
         st.session_state.session_id = uuid4().hex
 
 
-def initialize_retriever():
+@st.cache_resource
+def get_index_state():
+    """
+    全セッションで共有するインデックスの作成状況を取得（プロセス内で1つだけ作成される）
+
+    Returns:
+        インデックスの作成状況を保持するオブジェクト
+    """
+    # インデックスサーバーを使う場合、このプロセスではインデックスを作成せず、検索をサーバーに依頼する
+    index_server_url = os.getenv("INDEX_SERVER_URL", ct.INDEX_SERVER_URL)
+    if index_server_url:
+        from index_client import RemoteIndexState
+        return RemoteIndexState(index_server_url)
+
+    from index_manager import IndexState
+    return IndexState()
+
+
+def initialize_metrics():
+    """
+    メトリクスのHTTPでの公開と、ファイルへの定期的な書き出しを開始（プロセス内で初回のみ）
+    """
+    from metrics import start_exporter
+
+    start_exporter("app")
+
+
+def initialize_index():
+    """
+    画面読み込み時に、RAGのRetriever（ベクターストアから検索するオブジェクト）の作成をバックグラウンドで開始
+    作成が終わるのを待たずに画面を表示できるよう、作成状況のオブジェクトをセッションに保持するだけで処理を戻す
     """
-    画面読み込み時にRAGのRetriever（ベクターストアから検索するオブジェクト）を作成
+    index_state = get_index_state()
+    # 未作成、または前回の作成に失敗していた場合のみ作成を開始
+    index_state.start()
+    st.session_state.index_state = index_state
+
+
+def build_retriever(progress=None):
     """
+    RAGのRetriever（ベクターストアから検索するオブジェクト）を作成
+    画面（セッション）に依存しないため、バッチ処理などからも利用できる
+
+    Args:
+        progress: 作成の進捗の通知先（index_manager.BuildProgress）
+
+    Returns:
+        作成したRetriever
+    """
+    # 重いモジュールのため、初回のRetriever作成時に読み込む
+    from langchain_openai import OpenAIEmbeddings
+    from index_manager import BuildProgress
+
     # ロガーを読み込むことで、後続の処理中に発生したエラーなどがログファイルに記録される
     logger = logging.getLogger(ct.LOGGER_NAME)
 
-    # すでにRetrieverが作成済みの場合、後続の処理を中断
-    if "retriever" in st.session_state:
-        return
-    
+    if progress is None:
+        progress = BuildProgress()
+
     try:
-        # RAGの参照先となるデータソースの読み込み
-        logger.info("データソースの読み込みを開始")
-        docs_all = load_data_sources()
-        logger.info(f"{len(docs_all)}件のドキュメントを読み込みました")
-
-        # OSがWindowsの場合、Unicode正規化と、cp932（Windows用の文字コード）で表現できない文字を除去
-        for doc in docs_all:
-            doc.page_content = adjust_string(doc.page_content)
-            for key in doc.metadata:
-                doc.metadata[key] = adjust_string(doc.metadata[key])
-        
         # 埋め込みモデルの用意
         logger.info("埋め込みモデルの初期化")
         embeddings = OpenAIEmbeddings()
-        
-        # チャンク分割用のオブジェクトを作成（通常のテキスト用）
-        text_splitter = CharacterTextSplitter(
-            chunk_size=ct.CHUNK_SIZE,
-            chunk_overlap=ct.CHUNK_OVERLAP,
-            separator="\n"
-        )
-        
-        # CSV専用のチャンク分割用オブジェクトを作成（RecursiveCharacterTextSplitter使用）
-        csv_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=ct.CSV_CHUNK_SIZE,
-            chunk_overlap=ct.CSV_CHUNK_OVERLAP,
-            separators=[",", "\n", " "]  # CSVファイル向けの区切り文字
-        )
-        
-        # ドキュメントをCSVとそれ以外に分類
-        csv_docs = []
-        non_csv_docs = []
-        
-        for doc in docs_all:
-            if doc.metadata and doc.metadata.get("source", "").lower().endswith(".csv"):
-                csv_docs.append(doc)
-            else:
-                non_csv_docs.append(doc)
-        
-        # チャンク分割を実施（CSVとそれ以外で異なる処理）
-        logger.info("チャンク分割を実行")
-        splitted_docs = []
-        
-        if non_csv_docs:
-            non_csv_splitted = text_splitter.split_documents(non_csv_docs)
-            splitted_docs.extend(non_csv_splitted)
-            logger.info(f"CSVではないドキュメント: {len(non_csv_splitted)}件のチャンクに分割されました")
-            
-        if csv_docs:
-            csv_splitted = csv_splitter.split_documents(csv_docs)
-            splitted_docs.extend(csv_splitted)
-            logger.info(f"CSVドキュメント: {len(csv_splitted)}件のチャンクに分割されました")
-        
-        logger.info(f"合計: {len(splitted_docs)}件のチャンクに分割されました")
-        
-        # ベクターストアの作成
-        logger.info("ベクターストアの作成")
-        db = Chroma.from_documents(splitted_docs, embedding=embeddings)
+
+        # 作成元のデータから変わっていないスナップショットがあれば、それを読み込んで作成を省略
+        fingerprint = get_data_fingerprint()
+        db = load_index_snapshot(embeddings, fingerprint)
+
+        if db is None:
+            # 作成済みのインデックスのみを使う設定の場合、アプリでは作成しない（build_index.pyで作成する）
+            if is_prebuilt_only():
+                raise RuntimeError(ct.INDEX_NOT_BUILT_MESSAGE)
+
+            logger.info("ベクターストアの作成")
+            db, stats = build_vector_store(embeddings, progress)
+
+            # 次回以降（他のプロセスを含む）の起動を速くするため、スナップショットを書き出す
+            export_index_snapshot(db, fingerprint, stats)
         
         # ベクターストアを検索するRetrieverの作成
-        logger.info(f"Retrieverの作成 (k={ct.RETRIEVER_DOCUMENT_COUNT})")
-        st.session_state.retriever = db.as_retriever(search_kwargs={"k": ct.RETRIEVER_DOCUMENT_COUNT})
+        retriever = create_retriever(db)
         logger.info("Retrieverの初期化完了")
+        return retriever
     except Exception as e:
         logger.error(f"Retriever初期化エラー: {e}")
         raise
 
 
+def create_retriever(db):
+    """
+    ベクターストアを検索するRetrieverを作成
+
+    Args:
+        db: 検索対象のベクターストア
+
+    Returns:
+        作成したRetriever
+    """
+    logger = logging.getLogger(ct.LOGGER_NAME)
+
+    if ct.RETRIEVER_SCORE_CUTOFF_ENABLED:
+        # 関連度の低いドキュメントは除外し、関連するものが無い場合は空の検索結果を返す
+        from adaptive_retriever import AdaptiveRetriever
+        logger.info(
+            f"Retrieverの作成 (k={ct.RETRIEVER_MIN_DOCUMENT_COUNT}〜{ct.RETRIEVER_DOCUMENT_COUNT}, "
+            f"関連度の最低値={ct.RETRIEVER_MIN_RELEVANCE_SCORE}, 関連度の差の上限={ct.RETRIEVER_MAX_RELATIVE_GAP})"
+        )
+        return AdaptiveRetriever(vectorstore=db)
+
+    logger.info(f"Retrieverの作成 (k={ct.RETRIEVER_DOCUMENT_COUNT})")
+    return db.as_retriever(search_kwargs={"k": ct.RETRIEVER_DOCUMENT_COUNT})
+
+
+def get_data_fingerprint():
+    """
+    RAGの参照先データとチャンク分割の設定から、変更検知用の指紋を作成
+    （ファイルの中身は読まず、パス・サイズ・更新日時のみを使う）
+
+    Returns:
+        指紋の文字列
+    """
+    import hashlib
+
+    digest = hashlib.sha1()
+    digest.update(repr((ct.CHUNK_SIZE, ct.CHUNK_OVERLAP, ct.CSV_CHUNK_SIZE, ct.CSV_CHUNK_OVERLAP, ct.STRUCTURED_SPLIT_ENABLED, ct.STRUCTURED_CHUNK_MAX_SIZE, ct.STRUCTURED_MIN_HEADINGS, ct.STRUCTURED_HEADING_MAX_LENGTH, ct.PDF_MAX_PAGES, ct.PDF_MAX_FILE_SIZE, ct.PDF_NORMALIZE_TEXT, ct.PDF_WRAP_MIN_WIDTH_RATIO, ct.SUPPORTED_EXTENSIONS, ct.INGEST_DEDUP_ENABLED, ct.BOILERPLATE_STRIP_ENABLED, ct.BOILERPLATE_SAMPLE_PAGES, ct.BOILERPLATE_MIN_PAGES, ct.BOILERPLATE_MIN_PAGE_RATIO, ct.BOILERPLATE_EDGE_LINES, ct.WEB_URL_LOAD_TARGETS)).encode("utf-8"))
+    for root, dirs, files in os.walk(ct.RAG_TOP_FOLDER_PATH):
+        dirs.sort()
+        for file in sorted(files):
+            if not loaders.is_supported(file):
+                continue
+            path = os.path.join(root, file)
+            stat = os.stat(path)
+            digest.update(f"{path}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode("utf-8"))
+
+    return digest.hexdigest()
+
+
+def is_prebuilt_only():
+    """
+    作成済みのインデックス（build_index.pyで作成したもの）のみを使い、アプリでは作成しない設定かどうか
+    環境変数「INDEX_PREBUILT_ONLY」（「1」で有効）で上書きできる
+
+    Returns:
+        作成済みのインデックスのみを使う場合True
+    """
+    return os.getenv("INDEX_PREBUILT_ONLY", "1" if ct.INDEX_PREBUILT_ONLY else "0") == "1"
+
+
+def load_index_snapshot(embeddings, fingerprint):
+    """
+    CURRENTの世代のスナップショットファイルを読み取り専用のmmapで読み込み、それを参照するベクターストアを作成
+
+    Args:
+        embeddings: クエリの埋め込みに使うモデル
+        fingerprint: 現在の参照先データの指紋
+
+    Returns:
+        作成したベクターストア（スナップショットが無い・古い・壊れている場合はNone）
+    """
+    logger = logging.getLogger(ct.LOGGER_NAME)
+
+    if not ct.INDEX_SNAPSHOT_ENABLED:
+        return None
+
+    from index_artifacts import get_current, get_snapshot_path
+    from index_snapshot import IndexSnapshot
+    from vector_store import NumpyVectorStore
+
+    version = get_current()
+    if version is None:
+        return None
+    snapshot_path = get_snapshot_path(version)
+
+    try:
+        snapshot = IndexSnapshot(snapshot_path)
+    except Exception as e:
+        logger.warning(f"スナップショットの読み込みエラー: {snapshot_path} - {e}")
+        return None
+
+    if snapshot.info.get("fingerprint") != fingerprint:
+        # 作成済みのインデックスのみを使う設定の場合、参照先データと食い違っていてもそのまま使う
+        if not is_prebuilt_only():
+            logger.info("参照先データが更新されているため、スナップショットを使わずに作成し直します")
+            return None
+        logger.warning(f"参照先データが作成時から更新されています。build_index.pyで作成し直してください: {version}")
+
+    logger.info(f"スナップショットを読み込みました: {snapshot_path}（{len(snapshot)}件のチャンク）")
+    return NumpyVectorStore.from_snapshot(snapshot, embeddings)
+
+
+def export_index_snapshot(db, fingerprint, stats=None):
+    """
+    ベクターストアの内容を新しい世代のスナップショットとして書き出し、CURRENTを切り替える
+    書き出しに失敗してもRetrieverは使えるため、エラーはログ出力のみ行う
+
+    Args:
+        db: 書き出すベクターストア
+        fingerprint: 作成元の参照先データの指紋
+        stats: 作成時の取り込み状況の集計
+    """
+    logger = logging.getLogger(ct.LOGGER_NAME)
+
+    if not ct.INDEX_SNAPSHOT_ENABLED:
+        return
+
+    from index_artifacts import write_artifact, set_current, prune_versions
+
+    try:
+        version = write_artifact(to_numpy_store(db), {"fingerprint": fingerprint, "stats": stats or {}})
+        set_current(version)
+        prune_versions()
+        logger.info(f"スナップショットを書き出しました: {version}")
+    except Exception as e:
+        logger.warning(f"スナップショットの書き出しエラー: {e}")
+
+
+def to_numpy_store(db):
+    """
+    スナップショットに書き出せるよう、ベクターストアをnumpyベクターストアに変換
+
+    Args:
+        db: 変換するベクターストア
+
+    Returns:
+        numpyベクターストア（既にそうである場合はそのまま）
+    """
+    from vector_store import NumpyVectorStore
+
+    if isinstance(db, NumpyVectorStore):
+        return db
+
+    # Chromaの場合、格納済みのベクトルを取り出してnumpyベクターストアの形式に変換
+    data = db.get(include=["embeddings", "documents", "metadatas"])
+    store = NumpyVectorStore(db.embeddings, dtype=ct.NUMPY_STORE_DTYPE)
+    store.add_embeddings(data["documents"], data["embeddings"], metadatas=data["metadatas"], ids=data["ids"])
+    return store
+
+
+def build_vector_store(embeddings, progress=None, backend=None):
+    """
+    RAGの参照先となる全データソースから、ベクターストアを作成
+    データソースを1件ずつ読み込み、チャンク分割・埋め込み・ベクターストアへの追加を並行して行う
+    （全件を読み込み終わるのを待たずに埋め込みを始め、全件分のドキュメントを同時にメモリに持たない）
+
+    Args:
+        embeddings: 埋め込みモデル
+        progress: 作成の進捗の通知先（index_manager.BuildProgress）
+        backend: ベクターストアの種類（未指定の場合は設定に従う）
+
+    Returns:
+        (作成したベクターストア, 取り込み状況の集計)のタプル
+    """
+    from ingest_pipeline import IngestPipeline
+
+    from metrics import observe_index_build
+
+    started_at = time.perf_counter()
+    db = create_vector_store(embeddings, backend)
+    if progress is not None:
+        progress.files_found(count_target_files(ct.RAG_TOP_FOLDER_PATH) + len(ct.WEB_URL_LOAD_TARGETS))
+    sources = itertools.chain(iter_target_files(ct.RAG_TOP_FOLDER_PATH), ct.WEB_URL_LOAD_TARGETS)
+    stats = IngestPipeline(db, embeddings, progress).run(sources)
+
+    # 取り込み全体と、各段階（複数のスレッドで行う段階は合計）の処理時間を記録
+    observe_index_build("ingest", time.perf_counter() - started_at)
+    for phase in ("load", "split", "embed", "insert"):
+        observe_index_build(phase, stats[f"{phase}_time"])
+
+    return db, stats
+
+
+def create_splitters(chunk_size=ct.CHUNK_SIZE, chunk_overlap=ct.CHUNK_OVERLAP, structured=ct.STRUCTURED_SPLIT_ENABLED):
+    """
+    チャンク分割用のオブジェクトを作成
+
+    Args:
+        chunk_size: 通常のテキストのチャンク分割サイズ（eval_retrieval.pyで値を変えて比較する）
+        chunk_overlap: 通常のテキストのチャンク分割時のオーバーラップサイズ
+        structured: 見出しのある文書を見出し単位で分割するかどうか
+
+    Returns:
+        (通常のテキスト用, CSV用)のチャンク分割用のオブジェクトのタプル
+    """
+    from langchain_text_splitters import CharacterTextSplitter, RecursiveCharacterTextSplitter
+
+    # チャンク分割用のオブジェクトを作成（通常のテキスト用）
+    # 文脈の詰め込み時に隣接・重複するチャンクを結合できるよう、元の文書内の位置（start_index）も記録する
+    text_splitter = CharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separator="\n",
+        add_start_index=True
+    )
+    # 見出しのある文書（議事録・サービス資料など）は、見出し・議題の単位で分割する
+    if structured:
+        from structured_splitter import StructuredTextSplitter
+        text_splitter = StructuredTextSplitter(text_splitter)
+    
+    # CSV専用のチャンク分割用オブジェクトを作成（RecursiveCharacterTextSplitter使用）
+    csv_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=ct.CSV_CHUNK_SIZE,
+        chunk_overlap=ct.CSV_CHUNK_OVERLAP,
+        separators=[",", "\n", " "]  # CSVファイル向けの区切り文字
+    )
+
+    return text_splitter, csv_splitter
+
+
+def split_chunks(docs, splitters):
+    """
+    ドキュメントのチャンク分割（CSVとそれ以外で異なる分割方法を使う）
+
+    Args:
+        docs: 読み込んだドキュメントのリスト（1ファイル分など）
+        splitters: create_splittersで作成したチャンク分割用のオブジェクト
+
+    Returns:
+        チャンク分割済みのドキュメントのリスト
+    """
+    text_splitter, csv_splitter = splitters
+
+    # ドキュメントをCSVとそれ以外に分類
+    csv_docs = []
+    non_csv_docs = []
+    
+    for doc in docs:
+        if doc.metadata and doc.metadata.get("source", "").lower().endswith(".csv"):
+            csv_docs.append(doc)
+        else:
+            non_csv_docs.append(doc)
+    
+    # チャンク分割を実施（CSVとそれ以外で異なる処理）
+    splitted_docs = []
+    if non_csv_docs:
+        splitted_docs.extend(text_splitter.split_documents(non_csv_docs))
+    if csv_docs:
+        splitted_docs.extend(csv_splitter.split_documents(csv_docs))
+
+    return splitted_docs
+
+
+def create_vector_store(embeddings, backend=None):
+    """
+    設定に応じた種類の空のベクターストアを作成
+
+    Args:
+        embeddings: 埋め込みモデル
+        backend: ベクターストアの種類（未指定の場合は設定に従う）
+
+    Returns:
+        作成したベクターストア
+    """
+    logger = logging.getLogger(ct.LOGGER_NAME)
+
+    backend = backend or os.getenv("VECTOR_STORE_BACKEND", ct.VECTOR_STORE_BACKEND)
+    logger.info(f"ベクターストアの種類: {backend}")
+
+    # 使わない側のベクターストアのモジュールは読み込まないよう、選択された種類のものだけ読み込む
+    if backend == "numpy":
+        from vector_store import NumpyVectorStore
+        db = NumpyVectorStore(embeddings, dtype=ct.NUMPY_STORE_DTYPE)
+    elif backend == "chroma":
+        from langchain_community.vectorstores import Chroma
+        # 作り直した場合に前回の途中までのデータと混ざらないよう、作成ごとに別のコレクションを使う
+        db = Chroma(collection_name=f"langchain-{uuid4().hex}", embedding_function=embeddings)
+    else:
+        raise ValueError(f"未対応のベクターストアです: {backend}")
+
+    return db
+
+
+def update_vector_store(db, paths):
+    """
+    変更されたファイル・フォルダのチャンクを、ベクターストア上で差し替える
+    新しいチャンクを追加してから古いチャンクを削除するため、更新中も検索結果からファイルが消えることはない
+
+    Args:
+        db: 更新するベクターストア
+        paths: 変更（追加・更新・削除）されたファイル・フォルダのパス
+
+    Returns:
+        (追加したチャンク数, 削除したチャンク数)のタプル
+    """
+    logger = logging.getLogger(ct.LOGGER_NAME)
+
+    # フォルダとその配下のファイルが両方含まれる場合、同じファイルを2回読み込まないようフォルダだけ残す
+    paths = [os.path.normpath(path) for path in paths]
+    paths = [path for path in paths if not any(is_under(path, other) for other in paths if other != path)]
+
+    # 変更されたパス、またはそのフォルダ配下のファイルから作成されたチャンクが差し替え対象
+    targets = [adjust_string(path) for path in paths]
+    def is_target(source):
+        return any(is_under(os.path.normpath(source), target) for target in targets)
+
+    stored = db.get(include=["metadatas"])
+    old_ids = [
+        doc_id for doc_id, metadata in zip(stored["ids"], stored["metadatas"])
+        if metadata and is_target(metadata.get("source", ""))
+    ]
+
+    # 削除されたファイルは読み込めないため、存在するものだけ読み込み直す
+    from ingest_pipeline import IngestPipeline
+    sources = itertools.chain.from_iterable(iter_target_files(path) for path in paths if os.path.exists(path))
+    stats = IngestPipeline(db, db.embeddings).run(sources)
+    if old_ids:
+        db.delete(old_ids)
+
+    logger.info(f"ベクターストアを更新: {stats['chunks']}件のチャンクを追加, {len(old_ids)}件のチャンクを削除")
+
+    return stats["chunks"], len(old_ids)
+
+
+def is_under(path, folder):
+    """
+    パスが指定のフォルダ配下（またはフォルダ自身）かどうかを判定
+
+    Args:
+        path: 判定するパス
+        folder: フォルダのパス
+
+    Returns:
+        フォルダ配下の場合True
+    """
+    return path == folder or path.startswith(folder.rstrip(os.sep) + os.sep)
+
+
 def initialize_session_state():
     """
     初期化データの用意
     """
-    if "messages" not in st.session_state:
-        # 「表示用」の会話ログを順次格納するリストを用意
-        st.session_state.messages = []
-        # 「LLMとのやりとり用」の会話ログを順次格納するリストを用意
-        st.session_state.chat_history = []
-    
+    # 会話ログは、画面表示とLLMへの会話履歴で共有し、セッションIDをキーにconversation_storeで保持する
+    # （セッションの状態には会話ログのコピーを持たない）
+    get_conversation(st.session_state.session_id)
+
     # 開発者モードのフラグ
     if "debug_mode" not in st.session_state:
         st.session_state.debug_mode = False
 
 
-def load_data_sources():
+def iter_target_files(path):
     """
-    RAGの参照先となるデータソースの読み込み
+    フォルダ内の読み込み対象（対応している拡張子）のファイルパスを順に取得
+    （全件の一覧を作らず、見つけた順に返す）
+
+    Args:
+        path: 読み込み対象のファイル/フォルダのパス
 
     Returns:
-        読み込んだ通常データソース
+        ファイルパスのジェネレーター
     """
     logger = logging.getLogger(ct.LOGGER_NAME)
-    
-    # データソースを格納する用のリスト
-    docs_all = []
-    
-    try:
-        # ファイル読み込みの実行（渡した各リストにデータが格納される）
-        recursive_file_check(ct.RAG_TOP_FOLDER_PATH, docs_all)
-        logger.info(f"ファイルから{len(docs_all)}件のドキュメントを読み込みました")
-        
-        web_docs_all = []
-        # ファイルとは別に、指定のWebページ内のデータも読み込み
-        # 読み込み対象のWebページ一覧に対して処理
-        for web_url in ct.WEB_URL_LOAD_TARGETS:
-            try:
-                # 指定のWebページを読み込み
-                logger.info(f"Webページの読み込み: {web_url}")
-                loader = WebBaseLoader(web_url)
-                web_docs = loader.load()
-                # for文の外のリストに読み込んだデータソースを追加
-                web_docs_all.extend(web_docs)
-            except Exception as e:
-                logger.warning(f"Webページの読み込みエラー: {web_url} - {e}")
-                
-        # 通常読み込みのデータソースにWebページのデータを追加
-        logger.info(f"Webから{len(web_docs_all)}件のドキュメントを読み込みました")
-        docs_all.extend(web_docs_all)
-    
-    except Exception as e:
-        logger.error(f"データソース読み込みエラー: {e}")
-        raise
 
-    return docs_all
+    if not os.path.isdir(path):
+        if loaders.is_supported(path):
+            yield path
+        return
+
+    def on_error(e):
+        logger.warning(f"フォルダの読み込みエラー: {e.filename} - {e}")
 
+    for root, dirs, files in os.walk(path, onerror=on_error):
+        dirs.sort()
+        for file in sorted(files):
+            if loaders.is_supported(file):
+                yield os.path.join(root, file)
 
-def recursive_file_check(path, docs_all):
+
+def count_target_files(path):
     """
-    RAGの参照先となるデータソースの読み込み
+    フォルダ内の読み込み対象（対応している拡張子）のファイル数を取得
 
     Args:
-        path: 読み込み対象のファイル/フォルダのパス
-        docs_all: データソースを格納する用のリスト
+        path: 読み込み対象のフォルダのパス
+
+    Returns:
+        読み込み対象のファイル数
+    """
+    count = 0
+    for _, _, files in os.walk(path):
+        count += sum(1 for file in files if loaders.is_supported(file))
+    return count
+
+
+def load_source(source):
+    """
+    データソース1件（ファイルまたはWebページ）の読み込み
+    PDFのようにページに分かれたファイルは、ページを読み込んだ順に返す
+
+    Args:
+        source: ファイルパスまたはURL
+
+    Returns:
+        読み込んだドキュメントのジェネレーター（読み込めなかった場合は何も返さない）
     """
     logger = logging.getLogger(ct.LOGGER_NAME)
-    
-    try:
-        # パスがフォルダかどうかを確認
-        if os.path.isdir(path):
-            # フォルダの場合、フォルダ内のファイル/フォルダ名の一覧を取得
-            files = os.listdir(path)
-            # 各ファイル/フォルダに対して処理
-            for file in files:
-                # ファイル/フォルダ名だけでなく、フルパスを取得
-                full_path = os.path.join(path, file)
-                # フルパスを渡し、再帰的にファイル読み込みの関数を実行
-                recursive_file_check(full_path, docs_all)
-        else:
-            # パスがファイルの場合、ファイル読み込み
-            file_load(path, docs_all)
-    except PermissionError:
-        logger.warning(f"アクセス権限がありません: {path}")
-    except Exception as e:
-        logger.error(f"ファイル読み込みエラー: {path} - {e}")
+
+    if source.startswith(("http://", "https://")):
+        docs = []
+        try:
+            # 指定のWebページを読み込み
+            logger.info(f"Webページの読み込み: {source}")
+            from langchain_community.document_loaders import WebBaseLoader
+            docs = WebBaseLoader(source).load()
+        except Exception as e:
+            logger.warning(f"Webページの読み込みエラー: {source} - {e}")
+    else:
+        docs = file_load(source)
+
+    # OSがWindowsの場合、Unicode正規化と、cp932（Windows用の文字コード）で表現できない文字を除去
+    for doc in docs:
+        doc.page_content = adjust_string(doc.page_content)
+        for key in doc.metadata:
+            doc.metadata[key] = adjust_string(doc.metadata[key])
+        yield doc
 
 
-def file_load(path, docs_all):
+def file_load(path):
     """
     ファイル内のデータ読み込み
 
     Args:
         path: ファイルパス
-        docs_all: データソースを格納する用のリスト
+
+    Returns:
+        読み込んだドキュメントのジェネレーター
     """
     logger = logging.getLogger(ct.LOGGER_NAME)
     
     try:
-        # ファイルの拡張子を取得
-        file_extension = os.path.splitext(path)[1].lower()
-        # ファイル名（拡張子を含む）を取得
-        file_name = os.path.basename(path)
-
         # 想定していたファイル形式の場合のみ読み込む
-        if file_extension in ct.SUPPORTED_EXTENSIONS:
+        if loaders.is_supported(path):
             logger.info(f"ファイル読み込み: {path}")
             # ファイルの拡張子に合ったdata loaderを使ってデータ読み込み
-            loader = ct.SUPPORTED_EXTENSIONS[file_extension](path)
-            docs = loader.load()
-            docs_all.extend(docs)
-        elif file_extension == ".docx":
-            # .docxファイルの場合、専用の処理
-            text = extract_docx_text(path)
-            doc = LangchainDoc(page_content=text, metadata={"source": path})
-            docs_all.append(doc)
-            logger.info(f"DOCXファイル読み込み: {path}")
+            # ページ単位などで順に読み込めるdata loaderは、全体を一度にメモリに展開しないよう順に受け取る
+            loader = loaders.create_loader(path)
+            if hasattr(loader, "lazy_load"):
+                yield from loader.lazy_load()
+            else:
+                yield from loader.load()
+    except PermissionError:
+        logger.warning(f"アクセス権限がありません: {path}")
     except Exception as e:
         logger.warning(f"ファイル読み込みスキップ: {path} - {e}")
 
@@ -324,41 +674,3 @@ def adjust_string(s):
     
     # OSがWindows以外の場合はそのまま返す
     return s
-
-
-def extract_docx_text(path):
-    """
-    Word文書（.docx）から段落・見出しを抽出して結合したテキストを返す
-
-    Args:
-        path: 読み込むdocxファイルのパス
-
-    Returns:
-        str: 結合されたテキスト
-    """
-    logger = logging.getLogger(ct.LOGGER_NAME)
-    
-    try:
-        doc = Document(path)
-        paragraphs = []
-        
-        # 段落の抽出
-        for para in doc.paragraphs:
-            text = para.text.strip()
-            if text:
-                paragraphs.append(text)
-        
-        # 表の内容抽出
-        for table in doc.tables:
-            for row in table.rows:
-                row_texts = []
-                for cell in row.cells:
-                    if cell.text.strip():
-                        row_texts.append(cell.text.strip())
-                if row_texts:
-                    paragraphs.append(" | ".join(row_texts))
-        
-        return "\n".join(paragraphs)
-    except Exception as e:
-        logger.error(f"DOCX抽出エラー: {path} - {e}")
-        return ""
\ No newline at end of file
@@ -0,0 +1,139 @@
+"""
+このファイルは、埋め込みを使わない文字列一致ベース（BM25）の簡易検索のファイルです。
+ベクターストアの作成が終わるまでの間の代替検索として使います。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import re
+import math
+import heapq
+import unicodedata
+from collections import Counter
+from pydantic import ConfigDict
+from langchain_core.retrievers import BaseRetriever
+import constants as ct
+
+
+############################################################
+# 変数の定義
+############################################################
+# 英数字の単語
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+# BM25のパラメータ
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+############################################################
+# クラス定義
+############################################################
+
+class LexicalIndex:
+    """
+    文字bigram（日本語向け）と英数字の単語を索引語とするBM25の転置インデックス
+    """
+
+    def __init__(self, documents=()):
+        """
+        Args:
+            documents: 索引を作成するドキュメントのリスト
+        """
+        self.documents = []
+        # 索引語 → [(ドキュメントの番号, 出現回数)]
+        self._postings = {}
+        self._lengths = []
+        self._total_length = 0
+        self.add_documents(documents)
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add_documents(self, documents):
+        """
+        ドキュメントを索引に追加
+
+        Args:
+            documents: 追加するドキュメントのリスト
+        """
+        for document in documents:
+            doc_index = len(self.documents)
+            terms = Counter(tokenize(document.page_content))
+            length = sum(terms.values())
+            # 追加中に検索されても、索引語から参照される番号のドキュメントが必ず存在するよう、ドキュメントを先に追加する
+            self.documents.append(document)
+            self._lengths.append(length)
+            self._total_length += length
+            for term, count in terms.items():
+                self._postings.setdefault(term, []).append((doc_index, count))
+
+    def search(self, query, k=ct.RETRIEVER_DOCUMENT_COUNT):
+        """
+        クエリとの関連度（BM25スコア）が高い順にドキュメントを検索
+
+        Args:
+            query: 検索クエリ
+            k: 取得するドキュメント数
+
+        Returns:
+            (ドキュメント, BM25スコア)のタプルのリスト
+        """
+        if not self.documents:
+            return []
+
+        doc_count = len(self.documents)
+        average_length = self._total_length / doc_count
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_index, count in postings:
+                length_norm = 1 - BM25_B + BM25_B * self._lengths[doc_index] / average_length
+                scores[doc_index] = scores.get(doc_index, 0.0) + idf * count * (BM25_K1 + 1) / (count + BM25_K1 * length_norm)
+
+        top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self.documents[doc_index], score) for doc_index, score in top]
+
+
+class LexicalRetriever(BaseRetriever):
+    """
+    LexicalIndexを検索するRetriever
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    index: LexicalIndex
+    k: int = ct.RETRIEVER_DOCUMENT_COUNT
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        return [document for document, _ in self.index.search(query, k=self.k)]
+
+
+############################################################
+# 関数定義
+############################################################
+
+def tokenize(text):
+    """
+    テキストを索引語（文字bigramと英数字の単語）に分割
+
+    Args:
+        text: 分割するテキスト
+
+    Returns:
+        索引語のリスト
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    terms = WORD_PATTERN.findall(text)
+
+    # 空白・記号で区切った各部分から、英数字以外の文字bigramを作成
+    for part in re.split(r"[\s\W_]+", text):
+        part = WORD_PATTERN.sub(" ", part)
+        for piece in part.split():
+            if len(piece) == 1:
+                terms.append(piece)
+            terms.extend(piece[i:i + 2] for i in range(len(piece) - 1))
+
+    return terms
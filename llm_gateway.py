@@ -0,0 +1,426 @@
+"""
+このファイルは、プロセス内の全セッションで共有するLLM呼び出しの窓口（ゲートウェイ）のファイルです。
+同時実行数の上限、トークンバケットによる呼び出し頻度の制限、ジッター付き指数バックオフでの再試行、
+実行中の同一プロンプトの呼び出しの集約（single-flight）を行います。
+非同期（ainvoke）で呼び出された場合は、待機中・実行中にタスクがキャンセルされるとその時点で呼び出しを中断します。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import json
+import time
+import asyncio
+import random
+import hashlib
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any
+from pydantic import ConfigDict
+from langchain_core.language_models.chat_models import BaseChatModel
+import constants as ct
+
+
+############################################################
+# 変数の定義
+############################################################
+# 再試行するHTTPステータスコード（レート制限・サーバー側の一時的なエラー）
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+# 再試行するOpenAIクライアントの例外クラス名（ステータスコードを持たない接続エラーなど）
+RETRYABLE_ERROR_NAMES = {"RateLimitError", "APITimeoutError", "APIConnectionError", "InternalServerError"}
+
+# プロセス内で共有するゲートウェイ
+_gateway = None
+_gateway_lock = threading.Lock()
+# 非同期の呼び出しで、同時実行数の枠が空くのを確認する間隔（秒）
+_SLOT_POLL_INTERVAL = 0.05
+
+
+############################################################
+# クラス定義
+############################################################
+
+class _LeaderCancelled(Exception):
+    """
+    集約先の呼び出し（同じプロンプトを先に呼び出したもの）がキャンセルされたことを、集約された側に伝える例外
+    """
+
+
+class TokenBucket:
+    """
+    一定の速度でトークンが補充され、呼び出しごとに1つ消費するトークンバケット
+    """
+
+    def __init__(self, rate_per_minute, capacity):
+        """
+        Args:
+            rate_per_minute: 1分あたりに補充されるトークン数
+            capacity: 貯められるトークン数の上限（瞬間的に許容する呼び出し数）
+        """
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """
+        トークンを1つ消費（足りない場合は補充されるまで待機）
+
+        Args:
+            timeout: 待機する最大秒数
+
+        Returns:
+            トークンを消費できた場合True
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self._try_acquire()
+            if wait == 0:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    async def acquire_async(self, timeout=None):
+        """
+        トークンを1つ消費（acquireの非同期版。待機中もイベントループを止めない）
+
+        Args:
+            timeout: 待機する最大秒数
+
+        Returns:
+            トークンを消費できた場合True
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self._try_acquire()
+            if wait == 0:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            await asyncio.sleep(wait)
+
+    def _try_acquire(self):
+        # トークンを消費できた場合は0、足りない場合は補充されるまでの秒数を返す
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+
+class LLMGateway:
+    """
+    LLMの呼び出しを、同時実行数・呼び出し頻度の制限、再試行、同一プロンプトの集約を行ったうえで実行するクラス
+    """
+
+    def __init__(
+        self,
+        max_concurrency=ct.LLM_MAX_CONCURRENCY,
+        rate_per_minute=ct.LLM_RATE_LIMIT_PER_MINUTE,
+        burst=ct.LLM_RATE_LIMIT_BURST,
+        max_retries=ct.LLM_MAX_RETRIES
+    ):
+        """
+        Args:
+            max_concurrency: 同時に実行するLLM呼び出しの上限
+            rate_per_minute: 1分あたりのLLM呼び出し数の上限（再試行を含む）
+            burst: 瞬間的に許容するLLM呼び出し数
+            max_retries: 一時的なエラーの場合に再試行する最大回数
+        """
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._bucket = TokenBucket(rate_per_minute, burst)
+        self._lock = threading.Lock()
+        # 実行中の呼び出しのキー → 結果を受け取るFuture
+        self._in_flight = {}
+        # 呼び出し状況の集計
+        self.stats = {"calls": 0, "coalesced": 0, "retries": 0, "failures": 0, "active": 0}
+
+    def call(self, key, func):
+        """
+        LLMの呼び出しを実行
+        同じキーの呼び出しが実行中の場合は、新たに呼び出さずにその結果を共有する
+
+        Args:
+            key: 呼び出し内容を識別するキー（プロンプトとモデルの設定から作成）
+            func: LLMを呼び出す関数（引数なし）
+
+        Returns:
+            funcの戻り値
+        """
+        while True:
+            future, leader = self._join(key)
+            if not leader:
+                try:
+                    return _mark_coalesced(future.result())
+                except _LeaderCancelled:
+                    # 集約先がキャンセルされた場合は、自身で呼び出し直す
+                    continue
+
+            try:
+                result = self._call_with_retry(func)
+                future.set_result(result)
+                return result
+            except BaseException as e:
+                future.set_exception(e)
+                raise
+            finally:
+                self._leave(key)
+
+    async def acall(self, key, afunc):
+        """
+        LLMの呼び出しを実行（callの非同期版）
+        待機中・実行中にタスクがキャンセルされた場合は、その時点で呼び出しを中断する
+
+        Args:
+            key: 呼び出し内容を識別するキー（プロンプトとモデルの設定から作成）
+            afunc: LLMを呼び出すコルーチン関数（引数なし）
+
+        Returns:
+            afuncの戻り値
+        """
+        while True:
+            future, leader = self._join(key)
+            if not leader:
+                try:
+                    # 自身がキャンセルされても、集約先の呼び出しはキャンセルしない
+                    return _mark_coalesced(await asyncio.shield(asyncio.wrap_future(future)))
+                except _LeaderCancelled:
+                    continue
+
+            try:
+                result = await self._acall_with_retry(afunc)
+                future.set_result(result)
+                return result
+            except asyncio.CancelledError:
+                # 集約された他の呼び出しは、キャンセルせずに呼び出し直させる
+                future.set_exception(_LeaderCancelled())
+                raise
+            except BaseException as e:
+                future.set_exception(e)
+                raise
+            finally:
+                self._leave(key)
+
+    def _join(self, key):
+        """
+        同じキーの実行中の呼び出しに集約する（無い場合は自身が呼び出す側になる）
+
+        Returns:
+            (結果を受け取るFuture, 自身が呼び出す側かどうか)のタプル
+        """
+        logger = logging.getLogger(ct.LOGGER_NAME)
+
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is None:
+                future = Future()
+                self._in_flight[key] = future
+                return future, True
+            self.stats["coalesced"] += 1
+        logger.info("実行中の同一プロンプトのLLM呼び出しに集約しました")
+        return future, False
+
+    def _leave(self, key):
+        with self._lock:
+            self._in_flight.pop(key, None)
+
+    def _call_with_retry(self, func):
+        """
+        同時実行数・呼び出し頻度の制限のもとでfuncを実行し、一時的なエラーの場合は待機して再試行
+        """
+        logger = logging.getLogger(ct.LOGGER_NAME)
+
+        for attempt in range(self.max_retries + 1):
+            if not self._slots.acquire(timeout=ct.LLM_QUEUE_TIMEOUT):
+                raise TimeoutError(ct.LLM_QUEUE_TIMEOUT_MESSAGE)
+            try:
+                if not self._bucket.acquire(timeout=ct.LLM_QUEUE_TIMEOUT):
+                    raise TimeoutError(ct.LLM_QUEUE_TIMEOUT_MESSAGE)
+                with self._lock:
+                    self.stats["calls"] += 1
+                    self.stats["active"] += 1
+                try:
+                    return func()
+                finally:
+                    with self._lock:
+                        self.stats["active"] -= 1
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    with self._lock:
+                        self.stats["failures"] += 1
+                    raise
+                error = e
+            finally:
+                self._slots.release()
+
+            # 待機中は同時実行数の枠を空け、他の呼び出しを先に進める
+            delay = retry_delay(attempt, error)
+            with self._lock:
+                self.stats["retries"] += 1
+            logger.warning(f"LLM呼び出しを{delay:.1f}秒後に再試行します（{attempt + 1}/{self.max_retries}回目）: {type(error).__name__}")
+            time.sleep(delay)
+
+    async def _acall_with_retry(self, afunc):
+        """
+        _call_with_retryの非同期版（待機中もイベントループを止めない）
+        """
+        logger = logging.getLogger(ct.LOGGER_NAME)
+
+        for attempt in range(self.max_retries + 1):
+            await self._acquire_slot()
+            try:
+                if not await self._bucket.acquire_async(timeout=ct.LLM_QUEUE_TIMEOUT):
+                    raise TimeoutError(ct.LLM_QUEUE_TIMEOUT_MESSAGE)
+                with self._lock:
+                    self.stats["calls"] += 1
+                    self.stats["active"] += 1
+                try:
+                    return await afunc()
+                finally:
+                    with self._lock:
+                        self.stats["active"] -= 1
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    with self._lock:
+                        self.stats["failures"] += 1
+                    raise
+                error = e
+            finally:
+                self._slots.release()
+
+            delay = retry_delay(attempt, error)
+            with self._lock:
+                self.stats["retries"] += 1
+            logger.warning(f"LLM呼び出しを{delay:.1f}秒後に再試行します（{attempt + 1}/{self.max_retries}回目）: {type(error).__name__}")
+            await asyncio.sleep(delay)
+
+    async def _acquire_slot(self):
+        # 同期の呼び出しと同じ枠を使うため、スレッド用のセマフォを待機せずに取得できるまで確認する
+        deadline = time.monotonic() + ct.LLM_QUEUE_TIMEOUT
+        while not self._slots.acquire(blocking=False):
+            if time.monotonic() >= deadline:
+                raise TimeoutError(ct.LLM_QUEUE_TIMEOUT_MESSAGE)
+            await asyncio.sleep(_SLOT_POLL_INTERVAL)
+
+
+class GatewayChatModel(BaseChatModel):
+    """
+    LLMの呼び出しをゲートウェイ経由で行うチャットモデル（他のチャットモデルを包んで使う）
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    llm: BaseChatModel
+    gateway: Any = None
+
+    @property
+    def _llm_type(self):
+        return f"gateway-{self.llm._llm_type}"
+
+    @property
+    def _identifying_params(self):
+        return self.llm._identifying_params
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        gateway = self.gateway or get_gateway()
+        key = _request_key(self.llm, messages, stop, kwargs)
+        return gateway.call(key, lambda: self.llm._generate(messages, stop=stop, **kwargs))
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        gateway = self.gateway or get_gateway()
+        key = _request_key(self.llm, messages, stop, kwargs)
+        return await gateway.acall(key, lambda: self.llm._agenerate(messages, stop=stop, **kwargs))
+
+
+############################################################
+# 関数定義
+############################################################
+
+def get_gateway():
+    """
+    プロセス内で共有するゲートウェイを取得（初回のみ作成）
+    同時実行数・呼び出し頻度の上限は、環境変数「LLM_MAX_CONCURRENCY」「LLM_RATE_LIMIT_PER_MINUTE」で上書きできる
+
+    Returns:
+        LLMGateway
+    """
+    global _gateway
+
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = LLMGateway(
+                max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", ct.LLM_MAX_CONCURRENCY)),
+                rate_per_minute=float(os.getenv("LLM_RATE_LIMIT_PER_MINUTE", ct.LLM_RATE_LIMIT_PER_MINUTE))
+            )
+        return _gateway
+
+
+def is_retryable(error):
+    """
+    再試行で解消する可能性のある一時的なエラーかどうかを判定
+
+    Args:
+        error: 発生した例外
+
+    Returns:
+        再試行する場合True
+    """
+    if getattr(error, "status_code", None) in RETRYABLE_STATUS_CODES:
+        return True
+    return type(error).__name__ in RETRYABLE_ERROR_NAMES
+
+
+def retry_delay(attempt, error=None):
+    """
+    再試行までの待機秒数を、ジッター付きの指数バックオフで計算
+    サーバーから「Retry-After」で待機秒数が指定された場合は、それ以上待機する
+
+    Args:
+        attempt: 何回目の試行で失敗したか（0始まり）
+        error: 発生した例外
+
+    Returns:
+        待機秒数
+    """
+    # 複数の呼び出しが同時に再試行して再びレート制限にかからないよう、0〜上限の範囲でばらつかせる（Full Jitter）
+    delay = random.uniform(0, min(ct.LLM_RETRY_MAX_DELAY, ct.LLM_RETRY_BASE_DELAY * 2 ** attempt))
+
+    response = getattr(error, "response", None)
+    retry_after = getattr(response, "headers", {}).get("retry-after") if response is not None else None
+    try:
+        delay = max(delay, min(ct.LLM_RETRY_MAX_DELAY, float(retry_after)))
+    except (TypeError, ValueError):
+        pass
+
+    return delay
+
+
+def _request_key(llm, messages, stop, kwargs):
+    """
+    モデルの設定・プロンプトから、同一の呼び出しかどうかを判定するキーを作成
+    """
+    payload = {
+        "llm": llm._identifying_params,
+        "messages": [message.model_dump() for message in messages],
+        "stop": stop,
+        "kwargs": kwargs
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _mark_coalesced(result):
+    """
+    集約した呼び出しに返す結果に、APIを呼び出していない印（llm_output["coalesced"]）を付けた複製を作成
+    トークン数の集計（llm_usage.py）で、集約先の呼び出しと二重に数えないようにする
+    """
+    if not hasattr(result, "llm_output"):
+        return result
+    return result.model_copy(update={"llm_output": dict(result.llm_output or {}, coalesced=True)})
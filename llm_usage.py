@@ -0,0 +1,210 @@
+"""
+このファイルは、LLMの応答に含まれるトークン数（入力・出力・プロンプトキャッシュに一致した入力）を集計してログに出力するファイルです。
+LLM呼び出し・検索にかかった時間も、メトリクス（metrics.py）に記録します。
+プロンプトの先頭部分（システムプロンプト・会話履歴）が前回の呼び出しと一致すると、その分はOpenAI側のキャッシュが使われるため、
+キャッシュに一致したトークン数の割合で、プロンプトの並び順による節約の効果を確認できます。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import time
+import logging
+import threading
+from langchain_core.callbacks import BaseCallbackHandler
+from metrics import count_llm_tokens, observe_stage
+import constants as ct
+
+
+############################################################
+# 変数の定義
+############################################################
+# プロセス内で共有するトークン数の集計（初回利用時に作成）
+_usage_tracker = None
+_usage_tracker_lock = threading.Lock()
+
+
+############################################################
+# クラス定義
+############################################################
+
+class UsageTracker:
+    """
+    全セッションのLLM呼び出しのトークン数を累計するクラス
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.input_tokens = 0
+        self.cached_tokens = 0
+        self.output_tokens = 0
+
+    def add(self, usage):
+        """
+        1回分のLLM呼び出しのトークン数を累計に加える
+
+        Args:
+            usage: extract_usageで取得したトークン数の辞書
+        """
+        with self._lock:
+            self.calls += 1
+            self.input_tokens += usage["input_tokens"]
+            self.cached_tokens += usage["cached_tokens"]
+            self.output_tokens += usage["output_tokens"]
+
+    def stats(self):
+        """
+        累計のトークン数を取得
+
+        Returns:
+            呼び出し回数・入力・キャッシュに一致した入力・出力のトークン数と、キャッシュに一致した割合の辞書
+        """
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "input_tokens": self.input_tokens,
+                "cached_tokens": self.cached_tokens,
+                "output_tokens": self.output_tokens,
+                "cache_ratio": self.cached_tokens / self.input_tokens if self.input_tokens else 0.0
+            }
+
+
+class UsageLoggingCallback(BaseCallbackHandler):
+    """
+    LLMの応答ごとにトークン数をログに出力し、プロセス内の累計に加えるコールバック
+    """
+
+    def __init__(self, name="", tracker=None, call=None):
+        """
+        Args:
+            name: ログに出力する呼び出しの種類（「質問の言い換え」など）
+            tracker: 累計先（未指定の場合はプロセス内で共有のもの）
+            call: メトリクスに記録する呼び出しの種類（「rewrite」など。未指定の場合は記録しない）
+        """
+        self.name = name
+        self.tracker = tracker
+        self.call = call
+
+    def on_llm_end(self, response, **kwargs):
+        logger = logging.getLogger(ct.LOGGER_NAME)
+
+        usage = extract_usage(response)
+        if usage is None:
+            return
+        tracker = self.tracker or get_usage_tracker()
+        tracker.add(usage)
+        if self.call:
+            count_llm_tokens(self.call, usage["input_tokens"], usage["cached_tokens"], usage["output_tokens"])
+        total = tracker.stats()
+        ratio = usage["cached_tokens"] / usage["input_tokens"] if usage["input_tokens"] else 0.0
+        logger.info(
+            f"LLMのトークン数{f'（{self.name}）' if self.name else ''}: "
+            f"入力{usage['input_tokens']}（キャッシュ{usage['cached_tokens']}, {ratio:.0%}）, 出力{usage['output_tokens']} / "
+            f"累計{total['calls']}回: 入力{total['input_tokens']}（キャッシュ{total['cached_tokens']}, {total['cache_ratio']:.0%}）, "
+            f"出力{total['output_tokens']}"
+        )
+
+
+class StageTimingCallback(BaseCallbackHandler):
+    """
+    LLM呼び出し・検索の開始から終了までの時間を、処理段階の処理時間として記録するコールバック
+    （エラー・キャンセルで終了しなかったものは記録しない）
+    """
+    # 開始時刻を正確に記録するため、呼び出し元のスレッドでそのまま実行する
+    run_inline = True
+
+    def __init__(self, stage):
+        """
+        Args:
+            stage: 記録する処理段階（rewrite / retrieval / generation）
+        """
+        self.stage = stage
+        self._lock = threading.Lock()
+        # 実行中のrun_id → 開始時刻
+        self._started_at = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, observe=False)
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, observe=False)
+
+    def _start(self, run_id):
+        with self._lock:
+            self._started_at[run_id] = time.perf_counter()
+
+    def _end(self, run_id, observe=True):
+        with self._lock:
+            started_at = self._started_at.pop(run_id, None)
+        if started_at is not None and observe:
+            observe_stage(self.stage, time.perf_counter() - started_at)
+
+
+############################################################
+# 関数定義
+############################################################
+
+def get_usage_tracker():
+    """
+    プロセス内で共有するトークン数の集計を取得
+
+    Returns:
+        UsageTracker
+    """
+    global _usage_tracker
+
+    with _usage_tracker_lock:
+        if _usage_tracker is None:
+            _usage_tracker = UsageTracker()
+        return _usage_tracker
+
+
+def extract_usage(response):
+    """
+    LLMの応答（LLMResult）からトークン数を取り出す
+
+    Args:
+        response: LLMの応答
+
+    Returns:
+        入力（input_tokens）・キャッシュに一致した入力（cached_tokens）・出力（output_tokens）のトークン数の辞書
+        （応答にトークン数が含まれない場合と、ゲートウェイで他の呼び出しに集約されAPIを呼び出していない場合はNone）
+    """
+    if (response.llm_output or {}).get("coalesced"):
+        return None
+
+    # OpenAIの応答の「usage」（キャッシュに一致したトークン数は「prompt_tokens_details.cached_tokens」）
+    token_usage = (response.llm_output or {}).get("token_usage") or {}
+    if token_usage:
+        details = token_usage.get("prompt_tokens_details") or {}
+        return {
+            "input_tokens": token_usage.get("prompt_tokens") or 0,
+            "cached_tokens": details.get("cached_tokens") or 0,
+            "output_tokens": token_usage.get("completion_tokens") or 0
+        }
+
+    # 「usage」を返さないモデルの場合は、メッセージに付いている集計を使う
+    for generations in response.generations:
+        for generation in generations:
+            usage_metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage_metadata:
+                details = usage_metadata.get("input_token_details") or {}
+                return {
+                    "input_tokens": usage_metadata.get("input_tokens") or 0,
+                    "cached_tokens": details.get("cache_read") or 0,
+                    "output_tokens": usage_metadata.get("output_tokens") or 0
+                }
+    return None
@@ -0,0 +1,78 @@
+"""
+このファイルは、拡張子ごとのdata loaderを管理するファイルです。
+data loaderのモジュールは重いため、アプリ起動時ではなく、その拡張子のファイルを初めて読み込む時に読み込みます。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import importlib
+import constants as ct
+
+
+############################################################
+# 変数の定義
+############################################################
+# 拡張子ごとのdata loaderの作成方法（モジュール名, クラス名, 引数）または、パスを受け取ってloaderを返す関数
+_loader_registry = dict(ct.SUPPORTED_EXTENSIONS)
+# 読み込み済みのdata loaderのクラス
+_resolved_loaders = {}
+
+
+############################################################
+# 関数定義
+############################################################
+
+def register_loader(extension, loader):
+    """
+    拡張子に対応するdata loaderを登録（同じ拡張子が登録済みの場合は上書き）
+
+    Args:
+        extension: 拡張子（例: 「.pdf」）
+        loader: (モジュール名, クラス名, 引数)のタプル、またはパスを受け取ってloaderを返す関数
+    """
+    extension = extension.lower()
+    _loader_registry[extension] = loader
+    _resolved_loaders.pop(extension, None)
+
+
+def is_supported(path):
+    """
+    data loaderが登録済みの拡張子のファイルかどうかを判定
+
+    Args:
+        path: ファイルパス
+
+    Returns:
+        登録済みの拡張子の場合True
+    """
+    return os.path.splitext(path)[1].lower() in _loader_registry
+
+
+def create_loader(path):
+    """
+    ファイルの拡張子に合ったdata loaderを作成
+
+    Args:
+        path: ファイルパス
+
+    Returns:
+        作成したdata loader（未対応の拡張子の場合はNone）
+    """
+    extension = os.path.splitext(path)[1].lower()
+    loader = _loader_registry.get(extension)
+    if loader is None:
+        return None
+
+    # 関数が登録されている場合は、そのまま呼び出す
+    if callable(loader):
+        return loader(path)
+
+    # 初回のみモジュールを読み込み、以降は読み込み済みのクラスを使う
+    module_name, class_name, kwargs = loader
+    if extension not in _resolved_loaders:
+        module = importlib.import_module(module_name)
+        _resolved_loaders[extension] = getattr(module, class_name)
+
+    return _resolved_loaders[extension](path, **kwargs)
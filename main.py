@@ -6,6 +6,7 @@
 # 1. ライブラリの読み込み
 ############################################################
 import os
+import time
 import logging
 from datetime import datetime
 # 「.env」ファイルから環境変数を読み込むための関数
@@ -14,11 +15,14 @@ from dotenv import load_dotenv
 import streamlit as st
 # （自作）画面表示以外の様々な関数が定義されているモジュール
 import utils
-from utils import check_files_for_updates, build_error_message
+from utils import build_error_message
 # （自作）アプリ起動時に実行される初期化処理が記述された関数
 from initialize import initialize
 # （自作）画面表示系の関数が定義されているモジュール
 import components as cn
+from conversation_store import Turn, KIND_ERROR, get_conversation
+# （自作）処理時間などのメトリクスを記録する関数
+from metrics import observe_stage
 # （自作）変数（定数）がまとめて定義・管理されているモジュール
 import constants as ct
 
@@ -39,6 +43,9 @@ logger = logging.getLogger(ct.LOGGER_NAME)
 ############################################################
 # 3. 初期化処理
 ############################################################
+# 初期化処理（Retrieverの作成）には時間がかかるため、先にタイトルだけ表示しておく
+cn.display_app_title()
+
 try:
     # 初期化処理（「initialize.py」の「initialize」関数を実行）
     initialize()
@@ -50,6 +57,10 @@ except Exception as e:
     # 後続の処理を中断
     st.stop()
 
+# インデックスの作成が終わっていない場合は進捗を表示（作成中もチャット入力は受け付ける）
+if not st.session_state.index_state.is_ready:
+    cn.display_index_progress()
+
 # アプリ起動時のログファイルへの出力
 if "initialized" not in st.session_state:
     st.session_state.initialized = True
@@ -59,9 +70,6 @@ if "initialized" not in st.session_state:
 ############################################################
 # 4. 初期表示
 ############################################################
-# タイトル表示
-cn.display_app_title()
-
 # サイドバー表示
 cn.display_sidebar()
 
@@ -99,21 +107,13 @@ chat_message = st.chat_input(ct.CHAT_INPUT_HELPER_TEXT)
 ############################################################
 if chat_message:
     # ==========================================
-    # 7-0. ファイル更新チェック
+    # 7-0. データソースの更新のお知らせ
     # ==========================================
-    try:
-        # ファイル更新チェック
-        if "upload_time" in st.session_state and "uploaded_files" in st.session_state:
-            file_paths = [file.name for file in st.session_state.uploaded_files]
-            ref_time = st.session_state.upload_time
-            files_updated = check_files_for_updates(file_paths, ref_time)
-            
-            # 更新があった場合の処理
-            if files_updated:
-                st.info(ct.FILE_UPDATE_MESSAGE, icon=ct.FILE_UPDATE_ICON)
-                logger.info(f"ファイル更新を検知: {', '.join(files_updated)}")
-    except Exception as e:
-        logger.warning(f"ファイル更新チェックエラー: {e}")
+    # 参照先フォルダの変更はバックグラウンドで検知・反映されるため、前回の送信以降に反映された場合のみお知らせする
+    update_count = st.session_state.index_state.update_count
+    if update_count > st.session_state.get("index_update_count", update_count):
+        st.info(ct.FILE_UPDATE_MESSAGE, icon=ct.FILE_UPDATE_ICON)
+    st.session_state.index_update_count = update_count
 
     # ==========================================
     # 7-0.5. 隠しコマンドの処理
@@ -124,96 +124,150 @@ if chat_message:
         debug_status = "有効" if st.session_state.debug_mode else "無効"
         with st.chat_message("assistant"):
             st.markdown(f"デバッグモードを{debug_status}にしました。")
-        # セッションに会話を追加
-        st.session_state.messages.append({"role": "user", "content": chat_message})
-        st.session_state.messages.append({"role": "assistant", "content": {"mode": st.session_state.mode, "answer": f"デバッグモードを{debug_status}にしました。"}})
+        # セッションに会話を追加（LLMへの会話履歴には含めない）
+        conversation = get_conversation(st.session_state.session_id)
+        conversation.add(Turn(role="user", text=chat_message, mode=st.session_state.mode, in_history=False))
+        conversation.add(Turn(role="assistant", text=f"デバッグモードを{debug_status}にしました。", mode=st.session_state.mode, in_history=False))
         st.stop()  # 以降の処理を中断
 
-    # ==========================================
-    # 7-1. ユーザーメッセージの表示
-    # ==========================================
-    # ユーザーメッセージのログ出力
-    logger.info({"message": chat_message, "application_mode": st.session_state.mode})
+    # プロファイル計測の隠しコマンド（次の質問の処理を計測する）
+    if chat_message.strip() == "/profile":
+        st.session_state.profile_next = True
+        with st.chat_message("assistant"):
+            st.markdown(ct.PROFILE_ENABLED_MESSAGE)
+        # セッションに会話を追加（LLMへの会話履歴には含めない）
+        conversation = get_conversation(st.session_state.session_id)
+        conversation.add(Turn(role="user", text=chat_message, mode=st.session_state.mode, in_history=False))
+        conversation.add(Turn(role="assistant", text=ct.PROFILE_ENABLED_MESSAGE, mode=st.session_state.mode, in_history=False))
+        st.stop()  # 以降の処理を中断
 
-    # ユーザーメッセージを表示
-    with st.chat_message("user"):
-        st.markdown(chat_message)
+    # 「/profile」の次の質問の場合、回答取得から回答表示までを計測
+    profiler = None
+    if st.session_state.get("profile_next"):
+        from profiler import RequestProfiler
+        st.session_state.profile_next = False
+        profiler = RequestProfiler(st.session_state.session_id)
+        profiler.start()
 
-    # ==========================================
-    # 7-2. LLMからの回答取得
-    # ==========================================
-    # 回答生成中のメッセージを先に表示
-    answer_box = st.empty()
-    with answer_box.container():
-        with st.chat_message("assistant"):
-            st.markdown("回答生成中...")
+    # 計測中は、途中で処理が中断された場合（st.stop・st.rerunはExceptionでないため、exceptでは捕捉されない）も必ず計測を終了する
+    try:
+        # ==========================================
+        # 7-1. ユーザーメッセージの表示
+        # ==========================================
+        # ユーザーメッセージのログ出力（ログの行頭のセッションIDはプロセス内で共通のため、セッションIDも含める）
+        logger.info({"message": chat_message, "application_mode": st.session_state.mode, "session_id": st.session_state.session_id})
+
+        # ユーザーメッセージを表示
+        with st.chat_message("user"):
+            st.markdown(chat_message)
+
+        # ==========================================
+        # 7-2. LLMからの回答取得
+        # ==========================================
+        # 質問の送信から回答の表示までの処理時間（メトリクスに記録）
+        request_started_at = time.perf_counter()
+
+        # 回答生成中のメッセージを先に表示
+        answer_box = st.empty()
+        with answer_box.container():
+            with st.chat_message("assistant"):
+                st.markdown("回答生成中...")
     
-    # LLMによる回答生成（回答生成が完了するまでグルグル回す）
-    with st.spinner(ct.SPINNER_TEXT):
-        try:
-            # 画面読み込み時に作成したRetrieverを使い、Chainを実行
-            llm_response = utils.get_llm_response(chat_message)
+        # LLMによる回答生成（回答生成が完了するまでグルグル回す）
+        with st.spinner(ct.SPINNER_TEXT):
+            try:
+                # 画面読み込み時に作成したRetrieverを使い、Chainを実行（計測中は、計測するスレッドで実行する）
+                llm_response = utils.get_llm_response(chat_message, profiling=profiler is not None)
             
-            # レスポンスの検証
-            if not utils.validate_llm_response(llm_response):
-                raise ValueError("無効なLLMレスポンスを受信しました")
+                # レスポンスの検証
+                if not utils.validate_llm_response(llm_response):
+                    raise ValueError("無効なLLMレスポンスを受信しました")
                 
-        except Exception as e:
-            # エラーログの出力
-            logger.error(f"{ct.GET_LLM_RESPONSE_ERROR_MESSAGE}\n{e}")
-            # エラーメッセージの画面表示
-            st.error(build_error_message(ct.GET_LLM_RESPONSE_ERROR_MESSAGE), icon=ct.ERROR_ICON)
-            # 表示用の会話ログにユーザーメッセージを追加
-            st.session_state.messages.append({"role": "user", "content": chat_message})
-            # 後続の処理を中断
-            st.stop()
+            except Exception as e:
+                # エラーログの出力
+                logger.error(f"{ct.GET_LLM_RESPONSE_ERROR_MESSAGE}\n{e}")
+                # エラーメッセージの画面表示
+                st.error(build_error_message(ct.GET_LLM_RESPONSE_ERROR_MESSAGE), icon=ct.ERROR_ICON)
+                # 会話ログにユーザーメッセージを追加（回答を取得できていないため、LLMへの会話履歴には含めない）
+                get_conversation(st.session_state.session_id).add(
+                    Turn(role="user", text=chat_message, mode=st.session_state.mode, in_history=False)
+                )
+                # 後続の処理を中断（計測中の場合、失敗した処理の計測結果もfinallyで保存する）
+                st.stop()
 
-    # ==========================================
-    # 7-3. LLMからの回答表示
-    # ==========================================
-    content = None  # 表示用のコンテンツを格納する変数
+        # ==========================================
+        # 7-3. LLMからの回答表示
+        # ==========================================
+        turn = None  # 会話ログに追加するLLMからの回答を格納する変数
+        render_started_at = time.perf_counter()
     
-    with answer_box.container():
-        with st.chat_message("assistant"):
-            try:
-                # ==========================================
-                # モードが「社内文書検索」の場合
-                # ==========================================
-                if st.session_state.mode == ct.ANSWER_MODE_1:
-                    # 入力内容と関連性が高い社内文書のありかを表示
-                    content = cn.display_search_llm_response(llm_response)
-
-                # ==========================================
-                # モードが「社内問い合わせ」の場合
-                # ==========================================
-                elif st.session_state.mode == ct.ANSWER_MODE_2:
-                    # 入力に対しての回答と、参照した文書のありかを表示
-                    content = cn.display_contact_llm_response(llm_response)
+        with answer_box.container():
+            with st.chat_message("assistant"):
+                try:
+                    # ==========================================
+                    # モードが「社内文書検索」の場合
+                    # ==========================================
+                    if st.session_state.mode == ct.ANSWER_MODE_1:
+                        # 入力内容と関連性が高い社内文書のありかを表示
+                        turn = cn.display_search_llm_response(llm_response)
+
+                    # ==========================================
+                    # モードが「社内問い合わせ」の場合
+                    # ==========================================
+                    elif st.session_state.mode == ct.ANSWER_MODE_2:
+                        # 入力に対しての回答と、参照した文書のありかを表示
+                        turn = cn.display_contact_llm_response(llm_response)
+
+                    # 検索準備中で、簡易検索の結果をもとに回答した場合はその旨を表示
+                    if llm_response.get("degraded"):
+                        st.caption(ct.DEGRADED_SEARCH_MESSAGE)
                 
-                # AIメッセージのログ出力
-                logger.info({"message": content, "application_mode": st.session_state.mode})
+                    # AIメッセージのログ出力
+                    logger.info({"message": turn.text, "sources": len(turn.sources), "application_mode": st.session_state.mode})
+
+                except Exception as e:
+                    # エラーログの出力
+                    logger.error(f"{ct.DISP_ANSWER_ERROR_MESSAGE}\n{e}")
+                    # エラーメッセージの画面表示
+                    st.error(build_error_message(ct.DISP_ANSWER_ERROR_MESSAGE), icon=ct.ERROR_ICON)
+                    # 最低限の内容を持つ回答の作成（LLMからの回答自体は会話履歴に残す）
+                    turn = Turn(role="assistant", text=llm_response["answer"], mode=st.session_state.mode, kind=KIND_ERROR)
 
+        observe_stage("render", time.perf_counter() - render_started_at)
+        observe_stage("request", time.perf_counter() - request_started_at)
+
+        # 計測中の場合、計測を終了して結果の要約を表示
+        profile_summary = None
+        if profiler is not None:
+            from profiler import format_summary
+            try:
+                profile_summary = format_summary(profiler.stop())
+                with st.chat_message("assistant"):
+                    st.markdown(profile_summary)
             except Exception as e:
-                # エラーログの出力
-                logger.error(f"{ct.DISP_ANSWER_ERROR_MESSAGE}\n{e}")
-                # エラーメッセージの画面表示
-                st.error(build_error_message(ct.DISP_ANSWER_ERROR_MESSAGE), icon=ct.ERROR_ICON)
-                # 最低限の内容を持つコンテンツの作成
-                error_message = "回答の表示中にエラーが発生しました。もう一度お試しください。"
-                content = {
-                    "mode": st.session_state.mode,
-                    "answer": error_message
-                }
+                logger.error(f"プロファイル結果の保存エラー: {e}")
+    finally:
+        if profiler is not None and profiler.active:
+            try:
+                profiler.stop()
+            except Exception as e:
+                logger.error(f"プロファイル結果の保存エラー: {e}")
 
     # ==========================================
     # 7-4. 会話ログへの追加
     # ==========================================
-    # コンテンツが生成されている場合のみ追加処理を実行
-    if content:
-        # 表示用の会話ログにユーザーメッセージを追加
-        st.session_state.messages.append({"role": "user", "content": chat_message})
-        # 表示用の会話ログにAIメッセージを追加
-        st.session_state.messages.append({"role": "assistant", "content": content})
+    # 回答が生成されている場合のみ追加処理を実行
+    if turn:
+        # 画面表示とLLMへの会話履歴の両方で使う会話ログに、ユーザーメッセージとAIメッセージを追加
+        # LLMからの回答を取得できなかった場合は、LLMへの会話履歴には含めない
+        in_history = bool(llm_response.get("success"))
+        turn.in_history = in_history
+        conversation = get_conversation(st.session_state.session_id)
+        conversation.add(Turn(role="user", text=chat_message, mode=st.session_state.mode, in_history=in_history))
+        conversation.add(turn)
+        # 計測結果の要約も会話ログに残す
+        if profile_summary:
+            conversation.add(Turn(role="assistant", text=profile_summary, mode=st.session_state.mode, in_history=False))
     else:
         # コンテンツが生成されていない場合のエラー処理
         logger.error("コンテンツが生成されませんでした")
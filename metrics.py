@@ -0,0 +1,596 @@
+"""
+このファイルは、処理件数・処理時間などの性能の集計（メトリクス）をプロセス内で保持し、Prometheusのテキスト形式で出力するファイルです。
+ローカルのHTTP（「/metrics」）で公開するほか、一定間隔でファイル（node_exporterのtextfile collectorで読み込める形式）に書き出します。
+複数のアプリのプロセスを起動する場合は、プロセスごとに別のポート・別のファイル（「app_<プロセスの識別名>.prom」、ラベル「worker」付き）になります。
+
+主なメトリクス:
+    rag_requests_total{mode, query_type}            画面からの質問の件数（モード・特殊クエリの種類ごと）
+    rag_stage_duration_seconds{stage}               処理段階ごとの処理時間のヒストグラム
+                                                    （rewrite: 質問の言い換えのLLM呼び出し, retrieval: 検索, generation: 回答のLLM呼び出し,
+                                                      render: 回答の画面表示, request: 質問の送信から画面表示までの合計）
+    rag_llm_tokens_total{call, type}                LLM呼び出しのトークン数（type: input / cached / output）
+    rag_cache_requests_total{cache, result}         キャッシュの照合件数（result: hit / miss）。ヒット率はhit / (hit + miss)
+    rag_index_build_duration_seconds{phase}         インデックスの作成・変更の反映にかかった時間のヒストグラム
+    rag_sessions / rag_session_turns                会話ログを保持しているセッション数・会話ログの件数（削除の確認時に更新）
+    rag_session_memory_bytes                        会話ログのメモリ使用量の概算（削除の確認時に更新）
+    rag_sessions_evicted_total                      操作のないセッションとして会話ログを削除した件数
+
+p95の処理時間は、histogram_quantile(0.95, sum by (le, stage) (rate(rag_stage_duration_seconds_bucket[5m]))) で求められます。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import time
+import atexit
+import logging
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import constants as ct
+
+
+############################################################
+# 変数の定義
+############################################################
+# プロセス内で共有するメトリクスの保持先（初回利用時に作成）
+_registry = None
+_registry_lock = threading.Lock()
+
+# 起動済みのHTTPサーバー・ファイルへの書き出しのスレッド（プロセス内で1つだけ起動する）
+_exporter_started = False
+_exporter_lock = threading.Lock()
+
+# Prometheusのテキスト形式のContent-Type
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+############################################################
+# クラス定義
+############################################################
+
+class Counter:
+    """
+    ラベルの組ごとに増加のみする値を保持するメトリクス
+    """
+    type_name = "counter"
+
+    def __init__(self, name, help_text, label_names=()):
+        """
+        Args:
+            name: メトリクス名
+            help_text: メトリクスの説明
+            label_names: ラベル名のタプル
+        """
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        """
+        値を増やす
+
+        Args:
+            amount: 増やす量
+            labels: ラベルの値
+        """
+        key = label_key(self.label_names, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self, const_labels=()):
+        """
+        Prometheusのテキスト形式の行を作成
+
+        Args:
+            const_labels: 全ての行に付ける(ラベル名, 値)のタプル
+
+        Returns:
+            行のリスト
+        """
+        with self._lock:
+            values = sorted(self._values.items())
+        names, extra = split_labels(const_labels)
+        return [f"{self.name}{format_labels(names + self.label_names, extra + key)} {format_value(value)}" for key, value in values]
+
+
+class Gauge:
+    """
+    ラベルの組ごとに、増減する現在の値を保持するメトリクス
+    """
+    type_name = "gauge"
+
+    def __init__(self, name, help_text, label_names=()):
+        """
+        Args:
+            name: メトリクス名
+            help_text: メトリクスの説明
+            label_names: ラベル名のタプル
+        """
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def set(self, value, **labels):
+        """
+        値を設定
+
+        Args:
+            value: 現在の値
+            labels: ラベルの値
+        """
+        key = label_key(self.label_names, labels)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self, const_labels=()):
+        """
+        Prometheusのテキスト形式の行を作成
+
+        Args:
+            const_labels: 全ての行に付ける(ラベル名, 値)のタプル
+
+        Returns:
+            行のリスト
+        """
+        with self._lock:
+            values = sorted(self._values.items())
+        names, extra = split_labels(const_labels)
+        return [f"{self.name}{format_labels(names + self.label_names, extra + key)} {format_value(value)}" for key, value in values]
+
+
+class Histogram:
+    """
+    ラベルの組ごとに、観測値の分布（バケットごとの件数・合計・件数）を保持するメトリクス
+    """
+    type_name = "histogram"
+
+    def __init__(self, name, help_text, label_names=(), buckets=ct.METRICS_LATENCY_BUCKETS):
+        """
+        Args:
+            name: メトリクス名
+            help_text: メトリクスの説明
+            label_names: ラベル名のタプル
+            buckets: バケットの上限値のリスト（昇順）
+        """
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = sorted(buckets)
+        self._lock = threading.Lock()
+        # ラベルの組 → (バケットごとの件数のリスト（+Infを含む）, 合計, 件数)
+        self._values = {}
+
+    def observe(self, value, **labels):
+        """
+        観測値を加える
+
+        Args:
+            value: 観測値（秒など）
+            labels: ラベルの値
+        """
+        key = label_key(self.label_names, labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0, 0)
+            counts[index] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def render(self, const_labels=()):
+        """
+        Prometheusのテキスト形式の行を作成（バケットの件数は累積で出力する）
+
+        Args:
+            const_labels: 全ての行に付ける(ラベル名, 値)のタプル
+
+        Returns:
+            行のリスト
+        """
+        with self._lock:
+            values = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+
+        lines = []
+        names, extra = split_labels(const_labels)
+        label_names = names + self.label_names
+        for key, (counts, total, count) in values:
+            key = extra + key
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + [float("inf")], counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{format_labels(label_names + ('le',), key + (format_value(bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(label_names, key)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(label_names, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    プロセス内のメトリクスを名前で保持し、まとめてPrometheusのテキスト形式で出力するクラス
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def counter(self, name, help_text, label_names=()):
+        """
+        Counterを取得（初回のみ作成）
+
+        Returns:
+            Counter
+        """
+        return self._get_or_create(Counter, name, help_text, label_names)
+
+    def gauge(self, name, help_text, label_names=()):
+        """
+        Gaugeを取得（初回のみ作成）
+
+        Returns:
+            Gauge
+        """
+        return self._get_or_create(Gauge, name, help_text, label_names)
+
+    def histogram(self, name, help_text, label_names=(), buckets=ct.METRICS_LATENCY_BUCKETS):
+        """
+        Histogramを取得（初回のみ作成）
+
+        Returns:
+            Histogram
+        """
+        return self._get_or_create(Histogram, name, help_text, label_names, buckets=buckets)
+
+    def render(self, const_labels=()):
+        """
+        全メトリクスをPrometheusのテキスト形式で出力
+
+        Args:
+            const_labels: 全ての行に付ける(ラベル名, 値)のタプル（複数のプロセスのファイルを区別する「worker」など）
+
+        Returns:
+            テキスト形式の文字列
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        lines = []
+        for name, metric in metrics:
+            lines.append(f"# HELP {name} {metric.help_text}")
+            lines.append(f"# TYPE {name} {metric.type_name}")
+            lines.extend(metric.render(const_labels))
+        return "\n".join(lines) + "\n"
+
+    def _get_or_create(self, metric_class, name, help_text, label_names, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = metric_class(name, help_text, label_names, **kwargs)
+                self._metrics[name] = metric
+            elif not isinstance(metric, metric_class) or metric.label_names != tuple(label_names):
+                raise ValueError(f"同じ名前で種類・ラベルの異なるメトリクスです: {name}")
+            return metric
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """
+    「/metrics」でメトリクスを返すハンドラー
+    """
+
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        data = get_registry().render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # 定期的な取得のたびにコンソールへ出力しない
+        pass
+
+
+############################################################
+# 関数定義
+############################################################
+
+def get_registry():
+    """
+    プロセス内で共有するメトリクスの保持先を取得
+
+    Returns:
+        MetricsRegistry
+    """
+    global _registry
+
+    with _registry_lock:
+        if _registry is None:
+            _registry = MetricsRegistry()
+        return _registry
+
+
+def label_key(label_names, labels):
+    """
+    ラベルの値を、ラベル名の順のタプルに変換（指定のないラベルは空文字）
+
+    Args:
+        label_names: ラベル名のタプル
+        labels: ラベルの値の辞書
+
+    Returns:
+        ラベルの値のタプル
+    """
+    return tuple(str(labels.get(name, "")) for name in label_names)
+
+
+def split_labels(const_labels):
+    """
+    (ラベル名, 値)のタプルを、ラベル名のタプルと値のタプルに分ける
+
+    Args:
+        const_labels: (ラベル名, 値)のタプル
+
+    Returns:
+        (ラベル名のタプル, 値のタプル)のタプル
+    """
+    return tuple(name for name, _ in const_labels), tuple(str(value) for _, value in const_labels)
+
+
+def format_labels(label_names, values):
+    """
+    ラベルをPrometheusのテキスト形式に変換
+
+    Args:
+        label_names: ラベル名のタプル
+        values: ラベルの値のタプル
+
+    Returns:
+        「{name="value",...}」の文字列（ラベルが無い場合は空文字）
+    """
+    if not label_names:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for value in values)
+    return "{" + ",".join(f"{name}=\"{value}\"" for name, value in zip(label_names, escaped)) + "}"
+
+
+def format_value(value):
+    """
+    値をPrometheusのテキスト形式に変換
+
+    Args:
+        value: 数値
+
+    Returns:
+        数値の文字列
+    """
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def count_request(mode, query_type):
+    """
+    画面からの質問の件数を数える
+
+    Args:
+        mode: 回答モード（ct.ANSWER_MODE_1 / ct.ANSWER_MODE_2）
+        query_type: 特殊クエリの種類（該当しない場合は「general」）
+    """
+    get_registry().counter(
+        "rag_requests_total", "画面からの質問の件数", ("mode", "query_type")
+    ).inc(mode=get_mode_label(mode), query_type=query_type)
+
+
+def observe_stage(stage, seconds):
+    """
+    処理段階の処理時間を記録
+
+    Args:
+        stage: 処理段階（rewrite / retrieval / generation / render / request）
+        seconds: 処理時間（秒）
+    """
+    get_registry().histogram(
+        "rag_stage_duration_seconds", "処理段階ごとの処理時間（秒）", ("stage",)
+    ).observe(seconds, stage=stage)
+
+
+def count_llm_tokens(call, input_tokens, cached_tokens, output_tokens):
+    """
+    LLM呼び出しのトークン数を数える
+
+    Args:
+        call: 呼び出しの種類（rewrite / generation）
+        input_tokens: 入力のトークン数
+        cached_tokens: 入力のうち、プロンプトキャッシュに一致したトークン数
+        output_tokens: 出力のトークン数
+    """
+    counter = get_registry().counter("rag_llm_tokens_total", "LLM呼び出しのトークン数", ("call", "type"))
+    counter.inc(input_tokens, call=call, type="input")
+    counter.inc(cached_tokens, call=call, type="cached")
+    counter.inc(output_tokens, call=call, type="output")
+
+
+def count_cache(cache, hit):
+    """
+    キャッシュの照合結果を数える
+
+    Args:
+        cache: キャッシュの種類（answer / rewrite / speculative_retrieval）
+        hit: ヒットした場合True
+    """
+    get_registry().counter(
+        "rag_cache_requests_total", "キャッシュの照合件数", ("cache", "result")
+    ).inc(cache=cache, result="hit" if hit else "miss")
+
+
+def observe_index_build(phase, seconds):
+    """
+    インデックスの作成・変更の反映にかかった時間を記録
+
+    Args:
+        phase: 段階（ready: 起動から検索できるまで, ingest: 取り込み全体, load / split / embed / insert: 取り込みの各段階, update: 変更の反映）
+        seconds: 処理時間（秒）
+    """
+    get_registry().histogram(
+        "rag_index_build_duration_seconds", "インデックスの作成・変更の反映にかかった時間（秒）", ("phase",),
+        buckets=ct.METRICS_BUILD_BUCKETS
+    ).observe(seconds, phase=phase)
+
+
+def set_session_memory(stats, evicted=0):
+    """
+    会話ログを保持しているセッション数・件数・メモリ使用量を記録
+
+    Args:
+        stats: conversation_store.SessionRegistry.memory_statsの戻り値
+        evicted: 今回削除したセッション数
+    """
+    registry = get_registry()
+    registry.gauge("rag_sessions", "会話ログを保持しているセッション数").set(stats["sessions"])
+    registry.gauge("rag_session_turns", "保持している会話ログの件数").set(stats["turns"])
+    registry.gauge("rag_session_memory_bytes", "会話ログのメモリ使用量の概算（バイト）").set(stats["bytes"])
+    registry.counter("rag_sessions_evicted_total", "操作のないセッションとして会話ログを削除した件数").inc(evicted)
+
+
+def get_mode_label(mode):
+    """
+    回答モードを、メトリクスのラベル用の英字の名前に変換
+
+    Args:
+        mode: 回答モード
+
+    Returns:
+        「search」「inquiry」（不明なモードはそのまま）
+    """
+    for alias, name in ct.BATCH_MODE_ALIASES.items():
+        if name == mode:
+            return alias
+    return mode
+
+
+def write_snapshot(path, const_labels=()):
+    """
+    メトリクスをファイルに書き出す（一時ファイルに書き出してから置き換えるため、途中の状態は読まれない）
+
+    Args:
+        path: 書き出し先のパス
+        const_labels: 全ての行に付ける(ラベル名, 値)のタプル
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(get_registry().render(const_labels))
+    os.replace(tmp_path, path)
+
+
+def get_snapshot_path(name, worker_id=None):
+    """
+    メトリクスの書き出し先のパスを取得
+
+    Args:
+        name: ファイル名（拡張子なし）
+        worker_id: 複数のプロセスで同じ名前を使う場合に、ファイル名に付けるプロセスの識別名
+
+    Returns:
+        書き出し先のパス
+    """
+    if worker_id is not None:
+        name = f"{name}_{worker_id}"
+    return os.path.join(ct.METRICS_DIR_PATH, f"{name}.prom")
+
+
+def get_worker_id():
+    """
+    メトリクスを区別するプロセスの識別名を取得（環境変数「METRICS_WORKER_ID」、未設定の場合はプロセスID）
+
+    Returns:
+        識別名の文字列
+    """
+    return os.getenv("METRICS_WORKER_ID") or str(os.getpid())
+
+
+def create_exporter_server(port, worker_id):
+    """
+    メトリクスを公開するHTTPサーバーを作成
+    環境変数「METRICS_WORKER_ID」が数値の場合は「ポート番号 + ワーカー番号」で待ち受け、
+    それ以外の場合はポート番号から順に、空いているポートで待ち受ける（同じホストで複数のプロセスを起動する場合）
+
+    Args:
+        port: 基準のポート番号
+        worker_id: プロセスの識別名
+
+    Returns:
+        作成したHTTPサーバー
+    """
+    if os.getenv("METRICS_WORKER_ID", "").isdigit():
+        candidates = [port + int(worker_id)]
+    else:
+        candidates = range(port, port + max(1, ct.METRICS_PORT_RANGE))
+
+    error = None
+    for candidate in candidates:
+        try:
+            return ThreadingHTTPServer((ct.METRICS_HOST, candidate), MetricsRequestHandler)
+        except OSError as e:
+            error = e
+    raise error
+
+
+def start_exporter(name="app"):
+    """
+    メトリクスのHTTPでの公開と、ファイルへの定期的な書き出しを開始（プロセス内で初回のみ）
+    ポート番号は環境変数「METRICS_PORT」で上書きでき、0の場合はHTTPで公開しない
+    複数のプロセスで上書きし合わないよう、ポート番号・ファイル名・ファイル内のラベル（worker）はプロセスごとに分ける
+
+    Args:
+        name: 書き出すファイル名（拡張子なし。「_プロセスの識別名」を付けて書き出す）
+    """
+    global _exporter_started
+
+    logger = logging.getLogger(ct.LOGGER_NAME)
+
+    with _exporter_lock:
+        if _exporter_started or not ct.METRICS_ENABLED:
+            return
+        _exporter_started = True
+
+    worker_id = get_worker_id()
+    port = int(os.getenv("METRICS_PORT", ct.METRICS_PORT))
+    if port:
+        try:
+            server = create_exporter_server(port, worker_id)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+            logger.info(f"メトリクスの公開: http://{ct.METRICS_HOST}:{server.server_address[1]}/metrics（worker={worker_id}）")
+        except OSError as e:
+            # 空いているポートが無い場合など。ファイルへの書き出しは続ける
+            logger.warning(f"メトリクスをHTTPで公開できません（ポート{port}〜, worker={worker_id}）: {e}")
+
+    if ct.METRICS_SNAPSHOT_INTERVAL > 0:
+        path = get_snapshot_path(name, worker_id)
+        const_labels = (("worker", worker_id),)
+
+        def write_periodically():
+            while True:
+                time.sleep(ct.METRICS_SNAPSHOT_INTERVAL)
+                try:
+                    write_snapshot(path, const_labels)
+                except OSError as e:
+                    logger.warning(f"メトリクスの書き出しエラー: {path} - {e}")
+
+        def remove_snapshot():
+            # 終了したプロセスのファイルが、textfile collectorで読まれ続けないようにする
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+        atexit.register(remove_snapshot)
+        threading.Thread(target=write_periodically, name="metrics-snapshot", daemon=True).start()
@@ -0,0 +1,147 @@
+"""
+このファイルは、PDFファイルを1ページずつ読み込むdata loaderのファイルです。
+PyMuPDFLoaderは全ページ分のドキュメントを一度にリストとして作成するため、ページ数の多いPDFでもメモリ使用量が増えないよう、
+ページを読み込んだ順に後段（チャンク分割）へ渡します。ファイルサイズ・ページ数には上限を設けます。
+ページのテキストは、全角・半角の統一（NFKC）、レイアウト上の折り返しによる改行の連結、連続する空白の除去を行ってから渡します。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import re
+import logging
+import unicodedata
+from langchain_core.documents import Document as LangchainDoc
+from langchain_core.document_loaders import BaseLoader
+import constants as ct
+
+
+############################################################
+# 変数の定義
+############################################################
+# 文・段落の終わりとみなす行末の文字（この文字で終わる行は、次の行と連結しない）
+SENTENCE_END_CHARS = "。．！？!?」』）):："
+# 見出し・箇条書きで始まる行（前の行と連結しない）
+BLOCK_START_PATTERN = re.compile(r"^(?:\d+(?:\.\d+)*\.?\s|[(（]\d+[)）]|[・●○■□◆◇※\-‐*])")
+# 連続する空白（NFKCで全角の空白は半角になる）
+SPACE_PATTERN = re.compile(r"[ \t]+")
+# ゼロ幅の文字（箇条書きの記号の後などに含まれ、見出しの判定を妨げる）
+ZERO_WIDTH_PATTERN = re.compile("[\u200b\u200c\u200d\u2060\ufeff]")
+
+
+############################################################
+# クラス定義
+############################################################
+
+class PdfPageLoader(BaseLoader):
+    """
+    PDFファイルを1ページずつ読み込むdata loader（メタデータはPyMuPDFLoaderと同じ形式）
+    """
+
+    def __init__(self, file_path, max_pages=ct.PDF_MAX_PAGES, max_file_size=ct.PDF_MAX_FILE_SIZE):
+        """
+        Args:
+            file_path: PDFファイルのパス
+            max_pages: 読み込む最大ページ数（超えた分のページは読み込まない）
+            max_file_size: 読み込む最大ファイルサイズ（バイト、超えたファイルは読み込まない）
+        """
+        self.file_path = file_path
+        self.max_pages = max_pages
+        self.max_file_size = max_file_size
+
+    def lazy_load(self):
+        """
+        PDFファイルを1ページずつ読み込む
+
+        Returns:
+            ページごとのドキュメントのジェネレーター
+        """
+        import fitz
+
+        logger = logging.getLogger(ct.LOGGER_NAME)
+
+        file_size = os.path.getsize(self.file_path)
+        if file_size > self.max_file_size:
+            logger.warning(
+                f"ファイルサイズが上限を超えているため読み込みません: {self.file_path}"
+                f"（{file_size / 1024 / 1024:.1f}MB > {self.max_file_size / 1024 / 1024:.1f}MB）"
+            )
+            return
+
+        with fitz.open(self.file_path) as doc:
+            total_pages = len(doc)
+            if total_pages > self.max_pages:
+                logger.warning(f"ページ数が上限を超えているため、先頭の{self.max_pages}ページのみ読み込みます: {self.file_path}（{total_pages}ページ）")
+
+            # ファイル全体のメタデータは、全ページで共通のため最初に1回だけ作成
+            metadata = {
+                "source": self.file_path,
+                "file_path": self.file_path,
+                "total_pages": total_pages
+            }
+            metadata.update({key: value for key, value in doc.metadata.items() if type(value) in (str, int)})
+
+            for page_number in range(min(total_pages, self.max_pages)):
+                page = doc.load_page(page_number)
+                text = page.get_text()
+                if ct.PDF_NORMALIZE_TEXT:
+                    text = normalize_page_text(text)
+                # ページのテキストを取り出したら、ページのオブジェクトはすぐに解放する
+                del page
+                # 画面の「Page #」表示で使う、0始まりのページ番号
+                yield LangchainDoc(page_content=text, metadata=dict(metadata, page=page_number))
+
+
+############################################################
+# 関数定義
+############################################################
+
+def normalize_page_text(text, min_width_ratio=ct.PDF_WRAP_MIN_WIDTH_RATIO):
+    """
+    PDFの1ページ分のテキストを正規化
+    ・全角・半角の統一（Unicode NFKC）と、ゼロ幅の文字・行内の連続する空白・行末の空白の除去
+    ・ページの幅いっぱいまで続き、文の終わりで終わらない行（レイアウト上の折り返し）を次の行と連結
+    ・連続する空行を1行にまとめる
+
+    Args:
+        text: ページのテキスト
+        min_width_ratio: 折り返しとみなす行の幅（ページ内で最も長い行に対する割合）の下限
+
+    Returns:
+        正規化したテキスト
+    """
+    from ingest_filters import PAGE_NUMBER_PATTERN
+
+    text = ZERO_WIDTH_PATTERN.sub("", unicodedata.normalize("NFKC", text))
+    lines = [SPACE_PATTERN.sub(" ", line).strip() for line in text.splitlines()]
+    max_width = max((_display_width(line) for line in lines), default=0)
+    min_width = max_width * min_width_ratio
+
+    merged = []
+    wrapped = False
+    for line in lines:
+        if not line:
+            # 段落の区切りの空行は1行のみ残す
+            if merged and merged[-1]:
+                merged.append("")
+            wrapped = False
+            continue
+        if wrapped and not BLOCK_START_PATTERN.match(line) and not PAGE_NUMBER_PATTERN.fullmatch(line):
+            previous = merged[-1]
+            # 英数字どうしの場合のみ、単語の区切りとして空白を入れる
+            separator = " " if previous[-1].isascii() and previous[-1].isalnum() and line[0].isascii() and line[0].isalnum() else ""
+            merged[-1] = previous + separator + line
+        else:
+            merged.append(line)
+        # ページの幅いっぱいまで続き、文の終わりで終わらない行は、次の行に続くとみなす
+        wrapped = _display_width(line) >= min_width and line[-1] not in SENTENCE_END_CHARS
+
+    while merged and not merged[-1]:
+        merged.pop()
+    return "\n".join(merged)
+
+
+def _display_width(line):
+    # 全角の文字は半角2文字分の幅として数える
+    return sum(2 if unicodedata.east_asian_width(char) in ("W", "F") else 1 for char in line)
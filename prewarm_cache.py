@@ -0,0 +1,272 @@
+"""
+このファイルは、よく聞かれる質問の回答を事前に作成し、回答キャッシュに読み込めるようにするコマンドのファイルです。
+アプリのログ（画面から送信された質問とモード）とサイドバーの入力例から出現回数の多い質問を選び、
+インデックスの世代に対して検索・回答を行った結果を、世代のフォルダに書き出します（アプリは起動時に読み込む）。
+build_index.pyでインデックスを作成した後にも、CURRENTを切り替える前に自動で実行されます。
+
+使い方:
+    python prewarm_cache.py                    CURRENTの世代の回答を作成
+    python prewarm_cache.py --top 100          出現回数の多い順に100件まで作成
+    python prewarm_cache.py --version 世代名    指定の世代の回答を作成
+
+会話履歴のある質問の回答は会話によって変わるため、ログからはセッションの最初の質問のみを数えます。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import re
+import ast
+import sys
+import time
+import argparse
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from initialize import initialize_logger
+from answer_cache import get_cache_key, to_entry, write_prewarmed_answers
+import index_artifacts
+import constants as ct
+
+
+############################################################
+# 変数の定義
+############################################################
+# ログの1行（initialize.initialize_loggerのフォーマット）から、メッセージを取り出す
+# 行頭の「session_id=」は、ログの設定を行った最初のセッションのIDがプロセス内の全ての行に出力されるため使わない
+LOG_LINE_PATTERN = re.compile(r"^\[INFO\] .*?, session_id=\S+: (\{.*\})$")
+
+
+############################################################
+# 関数定義
+############################################################
+
+def mine_query_log(log_dir=ct.LOG_DIR_PATH):
+    """
+    アプリのログから、画面で送信された質問をモードごとに数える（ローテーションされた過去のログを含む）
+
+    Args:
+        log_dir: ログフォルダのパス
+
+    Returns:
+        (モード, 正規化した質問)をキーとし、(最後に送信された質問の原文, 出現回数)を値とする辞書
+    """
+    logger = logging.getLogger(ct.LOGGER_NAME)
+
+    if not os.path.isdir(log_dir):
+        return {}
+
+    counts = Counter()
+    questions = {}
+    # セッションの最初の質問のみを数えるため、質問を数えたセッションを記録する
+    seen_sessions = set()
+    # 過去のログ（「application.log.2025-01-01」など）から順に読む
+    paths = sorted(
+        (os.path.join(log_dir, name) for name in os.listdir(log_dir) if name.startswith(ct.LOG_FILE)),
+        key=lambda path: (os.path.basename(path) == ct.LOG_FILE, path)
+    )
+    for path in paths:
+        try:
+            with open(path, encoding="utf8", errors="replace") as f:
+                for line in f:
+                    match = LOG_LINE_PATTERN.match(line.rstrip("\n"))
+                    if match is None:
+                        continue
+                    try:
+                        record = ast.literal_eval(match.group(1))
+                    except (ValueError, SyntaxError):
+                        continue
+                    # AIメッセージのログ（「sources」を含む）は除く
+                    if not isinstance(record, dict) or "sources" in record or not {"message", "application_mode"} <= record.keys():
+                        continue
+                    # セッションIDはメッセージに含まれるもの（main.pyで出力）を使う。含まれない古いログは全ての質問を数える
+                    session_id = record.get("session_id")
+                    if session_id is not None:
+                        if session_id in seen_sessions:
+                            continue
+                        seen_sessions.add(session_id)
+
+                    question = str(record["message"]).strip()
+                    if not question or question.startswith("/"):
+                        continue
+                    key = get_cache_key(record["application_mode"], question)
+                    counts[key] += 1
+                    questions[key] = question
+        except OSError as e:
+            logger.warning(f"ログファイルの読み込みエラー: {path} - {e}")
+
+    return {key: (questions[key], count) for key, count in counts.items()}
+
+
+def get_example_questions():
+    """
+    サイドバーに表示している入力例の質問を取得
+
+    Returns:
+        (モード, 質問)のタプルのリスト
+    """
+    return [
+        (ct.ANSWER_MODE_1, ct.SIDEBAR_SEARCH_EXAMPLE),
+        (ct.ANSWER_MODE_2, ct.SIDEBAR_INQUIRY_EXAMPLE),
+        (ct.ANSWER_MODE_2, ct.SIDEBAR_EMPLOYEE_EXAMPLE)
+    ]
+
+
+def select_questions(logged, top_n=ct.ANSWER_PREWARM_TOP_N, min_count=ct.ANSWER_PREWARM_MIN_COUNT):
+    """
+    回答を事前に作成する質問を選ぶ（サイドバーの入力例と、ログでの出現回数が多い質問）
+
+    Args:
+        logged: mine_query_logの戻り値
+        top_n: 選ぶ質問数の上限
+        min_count: ログから選ぶ質問の最低の出現回数
+
+    Returns:
+        {"question", "mode", "count"}の辞書のリスト（入力例、出現回数の多い順）
+    """
+    selected = {}
+    for mode, question in get_example_questions():
+        key = get_cache_key(mode, question)
+        selected[key] = {"question": question, "mode": mode, "count": logged.get(key, (question, 0))[1]}
+
+    ranked = sorted(logged.items(), key=lambda item: (-item[1][1], item[0]))
+    for key, (question, count) in ranked:
+        if len(selected) >= top_n or count < min_count:
+            break
+        if key not in selected and key[0] in (ct.ANSWER_MODE_1, ct.ANSWER_MODE_2):
+            selected[key] = {"question": question, "mode": key[0], "count": count}
+
+    return list(selected.values())[:top_n]
+
+
+def load_retriever(version):
+    """
+    世代のスナップショットを読み込み、検索に使うRetrieverを作成
+
+    Args:
+        version: 世代名
+
+    Returns:
+        作成したRetriever
+    """
+    from langchain_openai import OpenAIEmbeddings
+    from index_snapshot import IndexSnapshot
+    from vector_store import NumpyVectorStore
+    from initialize import create_retriever
+
+    snapshot = IndexSnapshot(index_artifacts.get_snapshot_path(version))
+    return create_retriever(NumpyVectorStore.from_snapshot(snapshot, OpenAIEmbeddings()))
+
+
+def run_prewarm(version, top_n=ct.ANSWER_PREWARM_TOP_N, min_count=ct.ANSWER_PREWARM_MIN_COUNT,
+                workers=ct.ANSWER_PREWARM_WORKERS, log_dir=ct.LOG_DIR_PATH):
+    """
+    選んだ質問の回答を世代のインデックスで作成し、世代のフォルダに書き出す
+
+    Args:
+        version: 回答の作成に使うインデックスの世代名
+        top_n: 回答を作成する質問数の上限
+        min_count: ログから選ぶ質問の最低の出現回数
+        workers: 同時に回答を作成する数
+        log_dir: 質問を数えるログフォルダのパス
+
+    Returns:
+        作成結果の集計の辞書
+    """
+    import utils
+
+    logger = logging.getLogger(ct.LOGGER_NAME)
+
+    manifest = index_artifacts.read_manifest(version)
+    if manifest is None:
+        raise FileNotFoundError(f"世代の付加情報を読み込めません: {version}")
+
+    logged = mine_query_log(log_dir)
+    questions = select_questions(logged, top_n, min_count)
+    logger.info(f"回答の事前作成開始: {version}（ログの質問{len(logged)}種類から{len(questions)}件）")
+
+    retriever = load_retriever(version)
+
+    def answer(question):
+        # セッションの最初の質問と同じく、会話履歴なしで回答する
+        return question, utils.generate_answer(question["question"], retriever, question["mode"], [])
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        results = list(executor.map(answer, questions))
+    elapsed = time.perf_counter() - started_at
+
+    # LLMの回答が得られたもののみ保持する（エラーの回答はキャッシュしない）
+    entries = [to_entry(question["question"], question["mode"], response) for question, response in results if response.get("success")]
+    path = write_prewarmed_answers(version, manifest.get("fingerprint"), entries)
+
+    stats = {
+        "logged_queries": len(logged),
+        "selected": len(questions),
+        "answered": len(entries),
+        "failed": len(questions) - len(entries),
+        "covered_requests": sum(question["count"] for question, response in results if response.get("success")),
+        "total_requests": sum(count for _, count in logged.values()),
+        "elapsed": elapsed,
+        "path": path
+    }
+    logger.info(
+        f"回答の事前作成完了: {stats['answered']}件（失敗{stats['failed']}件, {elapsed:.1f}秒）, "
+        f"ログの最初の質問{stats['total_requests']}件中{stats['covered_requests']}件に該当"
+    )
+    return stats
+
+
+def format_prewarm_stats(stats):
+    """
+    作成結果を、コンソール出力用の文字列に変換
+
+    Args:
+        stats: run_prewarmの戻り値
+
+    Returns:
+        コンソール出力用の文字列
+    """
+    total = stats["total_requests"]
+    coverage = f"{stats['covered_requests'] / total:.0%}" if total else "-"
+    return (
+        f"回答を事前に作成しました: {stats['answered']}/{stats['selected']}件（失敗{stats['failed']}件, {stats['elapsed']:.1f}秒）\n"
+        f"  ログの最初の質問{total}件（{stats['logged_queries']}種類）のうち、作成した質問に該当: {stats['covered_requests']}件（{coverage}）\n"
+        f"  出力先: {stats['path']}"
+    )
+
+
+def main(argv=None):
+    """
+    コマンドラインからの実行
+    """
+    parser = argparse.ArgumentParser(description="よく聞かれる質問の回答を事前に作成し、アプリの回答キャッシュに読み込めるようにします。")
+    parser.add_argument("--version", help="回答の作成に使うインデックスの世代名（省略時はCURRENT）")
+    parser.add_argument("--top", type=int, default=ct.ANSWER_PREWARM_TOP_N, help="回答を作成する質問数の上限")
+    parser.add_argument("--min-count", type=int, default=ct.ANSWER_PREWARM_MIN_COUNT, help="ログから選ぶ質問の最低の出現回数")
+    parser.add_argument("-w", "--workers", type=int, default=ct.ANSWER_PREWARM_WORKERS, help="同時に回答を作成する数")
+    parser.add_argument("--log-dir", default=ct.LOG_DIR_PATH, help="質問を数えるログフォルダのパス")
+    args = parser.parse_args(argv)
+
+    initialize_logger(session_id=ct.ANSWER_PREWARM_SESSION_ID)
+    logger = logging.getLogger(ct.LOGGER_NAME)
+
+    version = args.version or index_artifacts.get_current()
+    if version is None:
+        print(ct.INDEX_NOT_BUILT_MESSAGE, file=sys.stderr)
+        return 1
+
+    try:
+        stats = run_prewarm(version, args.top, args.min_count, args.workers, args.log_dir)
+    except Exception as e:
+        logger.error(f"回答の事前作成に失敗しました: {e}")
+        print(f"回答の事前作成に失敗しました: {e}", file=sys.stderr)
+        return 1
+
+    print(format_prewarm_stats(stats))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
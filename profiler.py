@@ -0,0 +1,170 @@
+"""
+このファイルは、隠しコマンド「/profile」で、1回分の質問の処理をcProfileとtracemallocで計測するファイルです。
+計測結果は、cProfileの結果ファイル（.prof）とメモリ確保の上位の一覧（.txt）としてログフォルダに保存します。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import io
+import time
+import pstats
+import cProfile
+import logging
+import sysconfig
+import tracemalloc
+from datetime import datetime
+import constants as ct
+
+
+############################################################
+# クラス定義
+############################################################
+
+class RequestProfiler:
+    """
+    1回分の処理の実行時間（関数ごと）とメモリ確保（行ごと）を計測するクラス
+    """
+
+    def __init__(self, name):
+        """
+        Args:
+            name: 保存するファイル名に含める識別名（セッションIDなど）
+        """
+        self.name = name
+        self._profile = cProfile.Profile()
+        self._started_tracemalloc = False
+        self._start_snapshot = None
+        self._started_at = None
+        self.active = False
+
+    def start(self):
+        """
+        計測を開始
+        """
+        # 既にtracemallocが動いている場合（起動オプションでの指定など）は、それを使い停止もしない
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(ct.PROFILE_TRACEMALLOC_FRAMES)
+            self._started_tracemalloc = True
+        tracemalloc.reset_peak()
+        self._start_snapshot = tracemalloc.take_snapshot()
+        self._started_at = time.perf_counter()
+        self._profile.enable()
+        self.active = True
+
+    def stop(self):
+        """
+        計測を終了し、結果をログフォルダに保存
+
+        Returns:
+            計測結果の要約の辞書
+        """
+        self._profile.disable()
+        self.active = False
+        elapsed = time.perf_counter() - self._started_at
+        # 結果の取得に失敗しても、プロセス全体に影響するtracemallocは必ず停止する
+        try:
+            _, peak = tracemalloc.get_traced_memory()
+            end_snapshot = tracemalloc.take_snapshot()
+        finally:
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+                self._started_tracemalloc = False
+
+        # 計測処理自体のメモリ確保は除き、計測中に増えた分を行ごとに集計
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        allocation_stats = end_snapshot.filter_traces(filters).compare_to(
+            self._start_snapshot.filter_traces(filters), "lineno"
+        )
+        allocation_stats = [stat for stat in allocation_stats if stat.size_diff > 0][:ct.PROFILE_TOP_N]
+
+        os.makedirs(ct.PROFILE_DIR_PATH, exist_ok=True)
+        base_path = os.path.join(ct.PROFILE_DIR_PATH, f"{datetime.now():%Y%m%d_%H%M%S}_{self.name}")
+        profile_path = f"{base_path}.prof"
+        allocation_path = f"{base_path}_memory.txt"
+
+        self._profile.dump_stats(profile_path)
+        with open(allocation_path, "w", encoding="utf-8") as f:
+            f.write(f"処理時間: {elapsed:.3f}秒, メモリ使用量のピーク: {peak / 1024 / 1024:.1f}MB\n\n")
+            for stat in allocation_stats:
+                f.write(f"{stat}\n")
+
+        stats = pstats.Stats(self._profile, stream=io.StringIO())
+        functions = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+        top_functions = [
+            {"function": _format_function(function), "calls": values[1], "cumulative": values[3]}
+            for function, values in functions[:ct.PROFILE_TOP_N]
+        ]
+        top_allocations = [
+            {"location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}", "size": stat.size_diff, "count": stat.count_diff}
+            for stat in allocation_stats
+        ]
+
+        logger = logging.getLogger(ct.LOGGER_NAME)
+        logger.info(f"プロファイル結果を保存しました: {profile_path}, {allocation_path}（処理時間{elapsed:.3f}秒）")
+
+        return {
+            "elapsed": elapsed,
+            "peak_memory": peak,
+            "top_functions": top_functions,
+            "top_allocations": top_allocations,
+            "profile_path": profile_path,
+            "allocation_path": allocation_path
+        }
+
+
+############################################################
+# 関数定義
+############################################################
+
+def format_summary(summary):
+    """
+    計測結果の要約を、チャット欄に表示するMarkdownに変換
+
+    Args:
+        summary: RequestProfiler.stopの戻り値
+
+    Returns:
+        Markdownの文字列
+    """
+    lines = [
+        f"プロファイル結果（処理時間: {summary['elapsed']:.3f}秒, メモリ使用量のピーク: {summary['peak_memory'] / 1024 / 1024:.1f}MB）",
+        "",
+        "| 関数 | 呼び出し回数 | 累積時間[秒] |",
+        "|---|---:|---:|"
+    ]
+    for item in summary["top_functions"]:
+        lines.append(f"| `{item['function']}` | {item['calls']} | {item['cumulative']:.3f} |")
+    lines += [
+        "",
+        "| メモリ確保の多い箇所 | 増加量[KB] | 回数 |",
+        "|---|---:|---:|"
+    ]
+    for item in summary["top_allocations"]:
+        lines.append(f"| `{_short_path(item['location'])}` | {item['size'] / 1024:.1f} | {item['count']} |")
+    lines += [
+        "",
+        f"保存先: `{summary['profile_path']}`, `{summary['allocation_path']}`"
+    ]
+    return "\n".join(lines)
+
+
+def _format_function(function):
+    filename, lineno, name = function
+    if filename == "~":
+        # 組み込み関数の場合
+        return name
+    return f"{_short_path(filename)}:{lineno}({name})"
+
+
+def _short_path(path):
+    # ライブラリ・標準ライブラリ・アプリのファイルは、それぞれの基準フォルダからの相対パスにする
+    if "site-packages" + os.sep in path:
+        return path.split("site-packages" + os.sep, 1)[1]
+    stdlib_path = sysconfig.get_paths()["stdlib"]
+    if path.startswith(stdlib_path + os.sep):
+        return os.path.relpath(path, stdlib_path)
+    if path.startswith(os.getcwd() + os.sep):
+        return os.path.relpath(path)
+    return path
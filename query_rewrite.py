@@ -0,0 +1,217 @@
+"""
+このファイルは、会話履歴をもとに最新の入力を「会話履歴なしでも理解できる独立した質問」に言い換える処理のファイルです。
+同じ会話履歴・入力・モデルでの言い換え結果はLRUキャッシュに保持し、再送信時にLLMを呼び出さずに済むようにします。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from metrics import count_cache
+import constants as ct
+
+
+############################################################
+# 変数の定義
+############################################################
+# プロセス内で共有する言い換え結果のキャッシュ（初回利用時に作成）
+_rewrite_cache = None
+_rewrite_cache_lock = threading.Lock()
+
+
+############################################################
+# クラス定義
+############################################################
+
+class RewriteCache:
+    """
+    言い換え結果を保持するLRUキャッシュ（上限を超えた場合は最も長く使われていないものから削除）
+    """
+
+    def __init__(self, max_size=ct.REWRITE_CACHE_SIZE):
+        """
+        Args:
+            max_size: 保持する言い換え結果の上限数
+        """
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        # ヒット・ミスの件数には数えず、LRUの順序も変えない
+        with self._lock:
+            return key in self._items
+
+    def get(self, key):
+        """
+        言い換え結果を取得
+
+        Args:
+            key: キャッシュのキー
+
+        Returns:
+            言い換え結果（キャッシュにない場合はNone）
+        """
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self._items.move_to_end(key)
+                self.hits += 1
+        count_cache("rewrite", value is not None)
+        return value
+
+    def put(self, key, value):
+        """
+        言い換え結果を保持
+
+        Args:
+            key: キャッシュのキー
+            value: 言い換え結果
+        """
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+
+############################################################
+# 関数定義
+############################################################
+
+def get_rewrite_cache():
+    """
+    プロセス内で共有する言い換え結果のキャッシュを取得（初回のみ作成）
+
+    Returns:
+        RewriteCache
+    """
+    global _rewrite_cache
+
+    with _rewrite_cache_lock:
+        if _rewrite_cache is None:
+            _rewrite_cache = RewriteCache()
+        return _rewrite_cache
+
+
+def trim_history(chat_history):
+    """
+    言い換えに使う直近の会話履歴を取り出す
+
+    Args:
+        chat_history: LLMとのやりとり用の会話ログ
+
+    Returns:
+        直近の会話ログ
+    """
+    if ct.REWRITE_HISTORY_MAX_MESSAGES <= 0:
+        return []
+    return list(chat_history[-ct.REWRITE_HISTORY_MAX_MESSAGES:])
+
+
+def make_cache_key(chat_history, query, model=ct.MODEL):
+    """
+    会話履歴・入力・モデルから、言い換え結果のキャッシュのキーを作成
+
+    Args:
+        chat_history: 言い換えに使う会話ログ
+        query: 最新の入力
+        model: 言い換えに使うモデル名
+
+    Returns:
+        キャッシュのキー
+    """
+    payload = {
+        "history": [(message.type, message.content) for message in chat_history],
+        "input": query.strip(),
+        "model": model
+    }
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+
+def needs_llm_rewrite(inputs, cache=None):
+    """
+    言い換えにLLMの呼び出しが必要かどうかを判定（会話履歴があり、言い換え結果がキャッシュにない場合）
+
+    Args:
+        inputs: {"input", "chat_history"}の辞書
+        cache: 言い換え結果のキャッシュ（未指定の場合はプロセス内で共有のもの）
+
+    Returns:
+        LLMの呼び出しが必要な場合True
+    """
+    chat_history = trim_history(inputs.get("chat_history") or [])
+    if not chat_history:
+        return False
+    rewrite_cache = cache if cache is not None else get_rewrite_cache()
+    return make_cache_key(chat_history, inputs["input"]) not in rewrite_cache
+
+
+def create_rewrite_step(llm, prompt, cache=None):
+    """
+    会話履歴と最新の入力（{"input", "chat_history"}）から、検索に使う独立した質問を作成する処理を作成
+    会話履歴がない場合は、LLMを呼び出さずに入力をそのまま使う
+
+    Args:
+        llm: 言い換えに使うLLM
+        prompt: 言い換え用のプロンプトテンプレート
+        cache: 言い換え結果のキャッシュ（未指定の場合はプロセス内で共有のもの）
+
+    Returns:
+        Runnable（入力: {"input", "chat_history"}の辞書, 出力: 検索に使う質問の文字列）
+    """
+    from langchain_core.output_parsers import StrOutputParser
+    from langchain_core.runnables import RunnableLambda
+
+    rewrite_chain = prompt | llm | StrOutputParser()
+
+    def lookup(inputs):
+        # 言い換えが不要な場合・キャッシュにある場合は(質問, None)、LLMの呼び出しが必要な場合は(None, キャッシュのキー)を返す
+        logger = logging.getLogger(ct.LOGGER_NAME)
+
+        chat_history = trim_history(inputs.get("chat_history") or [])
+        if not chat_history:
+            return inputs["input"], None
+
+        rewrite_cache = cache if cache is not None else get_rewrite_cache()
+        key = make_cache_key(chat_history, inputs["input"])
+        question = rewrite_cache.get(key)
+        if question is not None:
+            logger.info(f"質問の言い換え: キャッシュにヒット（ヒット{rewrite_cache.hits}件, ミス{rewrite_cache.misses}件）")
+        return question, key
+
+    def store(key, question):
+        logger = logging.getLogger(ct.LOGGER_NAME)
+
+        rewrite_cache = cache if cache is not None else get_rewrite_cache()
+        rewrite_cache.put(key, question)
+        logger.info(f"質問の言い換え: キャッシュにミス（ヒット{rewrite_cache.hits}件, ミス{rewrite_cache.misses}件）: {question}")
+        return question
+
+    def rewrite(inputs):
+        question, key = lookup(inputs)
+        if question is not None:
+            return question
+        chat_history = trim_history(inputs["chat_history"])
+        return store(key, rewrite_chain.invoke({"input": inputs["input"], "chat_history": chat_history}))
+
+    async def arewrite(inputs):
+        # 非同期で実行した場合は、LLMの呼び出し中にキャンセルされるとその時点で中断される
+        question, key = lookup(inputs)
+        if question is not None:
+            return question
+        chat_history = trim_history(inputs["chat_history"])
+        return store(key, await rewrite_chain.ainvoke({"input": inputs["input"], "chat_history": chat_history}))
+
+    return RunnableLambda(rewrite, afunc=arewrite).with_config(run_name="rewrite_question")
@@ -0,0 +1,212 @@
+"""
+このファイルは、回答生成（LLM呼び出しを含むChain）を、プロセス内で共有するイベントループで非同期に実行するファイルです。
+セッションごとに実行中のタスクを1つだけ保持し、同じセッションから新しいメッセージが送信された場合や、
+画面の再実行・ブラウザを閉じたことで結果を表示できなくなった場合は、実行中のタスクをキャンセルしてLLM呼び出しを中断します。
+キャンセルしたLLM呼び出しの回数と、送信済みだった入力トークン数を集計します。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import asyncio
+import logging
+import threading
+import concurrent.futures
+from langchain_core.callbacks import BaseCallbackHandler
+import constants as ct
+
+
+############################################################
+# 変数の定義
+############################################################
+# プロセス内で共有する実行環境（初回利用時に作成）
+_request_runner = None
+_request_runner_lock = threading.Lock()
+
+
+############################################################
+# クラス定義
+############################################################
+
+class RequestRunner:
+    """
+    専用のスレッドでイベントループを動かし、セッションごとの回答生成のタスクを実行・キャンセルするクラス
+    """
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="request-runner", daemon=True)
+        self._thread.start()
+        self._lock = threading.Lock()
+        # セッションID → 実行中のタスクのFuture
+        self._tasks = {}
+        # 実行状況の集計
+        self.stats = {"requests": 0, "cancelled_requests": 0, "cancelled_calls": 0, "cancelled_tokens": 0}
+
+    def submit(self, session_id, coroutine_function):
+        """
+        回答生成のタスクを開始（同じセッションで実行中のタスクがあればキャンセル）
+
+        Args:
+            session_id: セッションID
+            coroutine_function: 回答生成のコルーチン関数（引数としてLLM呼び出しのキャンセルを集計するコールバックを受け取る）
+
+        Returns:
+            結果を受け取るFuture（concurrent.futures.Future）
+        """
+        self.cancel(session_id, reason="新しいメッセージの送信")
+
+        callback = CancellationCallback(self)
+        future = asyncio.run_coroutine_threadsafe(coroutine_function(callback), self._loop)
+        with self._lock:
+            self._tasks[session_id] = future
+            self.stats["requests"] += 1
+        future.add_done_callback(lambda done: self._finish(session_id, done, callback))
+        return future
+
+    def wait(self, session_id, future, is_abandoned=None, poll_interval=ct.REQUEST_POLL_INTERVAL):
+        """
+        回答生成のタスクの完了を待機
+        待機中に結果を表示できなくなった場合（is_abandonedがTrueを返した場合）は、タスクをキャンセルする
+
+        Args:
+            session_id: セッションID
+            future: submitの戻り値
+            is_abandoned: 結果が不要になったかどうかを判定する関数（引数なし）
+            poll_interval: is_abandonedで確認する間隔（秒）
+
+        Returns:
+            回答生成の結果（キャンセルされた場合はconcurrent.futures.CancelledErrorを送出）
+        """
+        while True:
+            try:
+                return future.result(timeout=poll_interval)
+            except concurrent.futures.TimeoutError:
+                if is_abandoned is not None and is_abandoned():
+                    self.cancel(session_id, reason="画面の再実行・終了")
+
+    def cancel(self, session_id, reason=""):
+        """
+        セッションで実行中のタスクをキャンセル
+
+        Args:
+            session_id: セッションID
+            reason: ログに出力するキャンセルの理由
+
+        Returns:
+            キャンセルした場合True
+        """
+        logger = logging.getLogger(ct.LOGGER_NAME)
+
+        with self._lock:
+            future = self._tasks.pop(session_id, None)
+            if future is None or future.done():
+                return False
+            self.stats["cancelled_requests"] += 1
+        logger.info(f"実行中の回答生成をキャンセルしました（{reason}）: session_id={session_id}")
+        future.cancel()
+        return True
+
+    def get_stats(self):
+        """
+        実行状況の集計を取得
+
+        Returns:
+            回答生成の件数・キャンセルした件数・キャンセルしたLLM呼び出しの回数と入力トークン数の辞書
+        """
+        with self._lock:
+            return dict(self.stats, active=len(self._tasks))
+
+    def add_cancelled_call(self, tokens):
+        """
+        キャンセルしたLLM呼び出しを集計に加える
+
+        Args:
+            tokens: キャンセルした呼び出しで送信済みだった入力トークン数
+        """
+        logger = logging.getLogger(ct.LOGGER_NAME)
+
+        with self._lock:
+            self.stats["cancelled_calls"] += 1
+            self.stats["cancelled_tokens"] += tokens
+            stats = dict(self.stats)
+        logger.info(
+            f"LLM呼び出しをキャンセルしました（入力{tokens}トークン） / "
+            f"累計: 回答生成{stats['requests']}件中{stats['cancelled_requests']}件をキャンセル, "
+            f"LLM呼び出し{stats['cancelled_calls']}回, 入力{stats['cancelled_tokens']}トークン"
+        )
+
+    def _finish(self, session_id, future, callback):
+        with self._lock:
+            if self._tasks.get(session_id) is future:
+                del self._tasks[session_id]
+        # キャンセルした時点で応答を待っていたLLM呼び出しを集計する
+        if future.cancelled():
+            for tokens in callback.pop_running():
+                self.add_cancelled_call(tokens)
+
+
+class CancellationCallback(BaseCallbackHandler):
+    """
+    実行中のLLM呼び出しの入力トークン数を保持するコールバック
+    （タスクのキャンセル時は、LLM呼び出しの終了・エラーのコールバックが呼ばれないため、残っているものをキャンセルした呼び出しとみなす）
+    """
+    # イベントループのスレッドでそのまま実行する（スレッドプールに回さない）
+    run_inline = True
+
+    def __init__(self, runner):
+        """
+        Args:
+            runner: 集計先のRequestRunner
+        """
+        self.runner = runner
+        self._lock = threading.Lock()
+        # 実行中のLLM呼び出しのrun_id → 入力トークン数
+        self._running = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        import utils
+
+        tokens = sum(utils.count_tokens(str(message.content)) for batch in messages for message in batch)
+        with self._lock:
+            self._running[run_id] = tokens
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self._lock:
+            self._running.pop(run_id, None)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            self._running.pop(run_id, None)
+
+    def pop_running(self):
+        """
+        実行中のLLM呼び出しの入力トークン数を取り出す
+
+        Returns:
+            入力トークン数のリスト
+        """
+        with self._lock:
+            tokens = list(self._running.values())
+            self._running.clear()
+        return tokens
+
+
+############################################################
+# 関数定義
+############################################################
+
+def get_request_runner():
+    """
+    プロセス内で共有する実行環境を取得（初回のみ作成）
+
+    Returns:
+        RequestRunner
+    """
+    global _request_runner
+
+    with _request_runner_lock:
+        if _request_runner is None:
+            _request_runner = RequestRunner()
+        return _request_runner
+
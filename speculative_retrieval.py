@@ -0,0 +1,148 @@
+"""
+このファイルは、質問の言い換え（LLMの呼び出し）と並行して、ユーザー入力のままで先に検索を始めておく処理（投機的な検索）のファイルです。
+言い換え後の質問が元の入力とほぼ同じであれば先に検索した結果をそのまま使い、言い換え → 検索と順に待つ時間を省きます。
+言い換えで内容が変わった場合（「それ」などを会話履歴の語に置き換えた場合など）は、言い換え後の質問で検索し直します。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import math
+import asyncio
+import logging
+import threading
+import contextvars
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from metrics import count_cache
+import constants as ct
+
+
+############################################################
+# 変数の定義
+############################################################
+# プロセス内で共有する、投機的な検索用のスレッドプール（初回利用時に作成）
+_executor = None
+_executor_lock = threading.Lock()
+
+# 投機的な検索の結果を使った回数・検索し直した回数
+_stats = {"reused": 0, "retried": 0}
+_stats_lock = threading.Lock()
+
+
+############################################################
+# 関数定義
+############################################################
+
+def get_executor():
+    """
+    プロセス内で共有する、投機的な検索用のスレッドプールを取得
+
+    Returns:
+        ThreadPoolExecutor
+    """
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=ct.SPECULATIVE_RETRIEVAL_WORKERS, thread_name_prefix="speculative-retrieval")
+        return _executor
+
+
+def query_similarity(query, other):
+    """
+    2つの質問の類似度（索引語の出現回数のコサイン類似度）を算出
+    埋め込みで比べると言い換え後の質問の埋め込みに検索1回分の時間がかかるため、手元で計算できる文字bigramで比べる
+
+    Args:
+        query: 質問
+        other: 比べる質問
+
+    Returns:
+        0〜1の類似度
+    """
+    from lexical_index import tokenize
+
+    counts = Counter(tokenize(query))
+    other_counts = Counter(tokenize(other))
+    dot = sum(count * other_counts[term] for term, count in counts.items())
+    norm = math.sqrt(sum(count * count for count in counts.values())) * math.sqrt(sum(count * count for count in other_counts.values()))
+    return dot / norm if norm else 0.0
+
+
+def create_speculative_retrieval(rewrite_step, retriever, min_similarity=ct.SPECULATIVE_MIN_SIMILARITY):
+    """
+    言い換えと並行してユーザー入力のままで検索し、言い換え後の質問が近ければその結果を使う処理を作成
+    言い換えにLLMを呼び出さない場合（会話履歴がない・キャッシュにある場合）は、並行させずに順に処理する
+
+    Args:
+        rewrite_step: 言い換えの処理（query_rewrite.create_rewrite_stepで作成したもの）
+        retriever: 検索に使うRetriever
+        min_similarity: 先に検索した結果を使う、元の入力と言い換え後の質問の類似度の下限
+
+    Returns:
+        Runnable（入力: {"input", "chat_history"}の辞書, 出力: 検索結果のドキュメントのリスト）
+    """
+    from langchain_core.runnables import RunnableLambda
+    from query_rewrite import needs_llm_rewrite
+
+    def retrieve(inputs, config):
+        if not needs_llm_rewrite(inputs):
+            return retriever.invoke(rewrite_step.invoke(inputs, config), config)
+
+        # ログ出力などのコールバックが引き継がれるよう、呼び出し元のコンテキストで検索を実行する
+        context = contextvars.copy_context()
+        future = get_executor().submit(context.run, retriever.invoke, inputs["input"], config)
+        question = rewrite_step.invoke(inputs, config)
+
+        similarity = query_similarity(inputs["input"], question)
+        if similarity >= min_similarity:
+            documents = future.result()
+        else:
+            # 検索中であれば結果を待たずに破棄し、言い換え後の質問で検索し直す
+            future.cancel()
+            documents = retriever.invoke(question, config)
+        log_speculation(similarity >= min_similarity, similarity)
+        return documents
+
+    async def aretrieve(inputs, config):
+        if not needs_llm_rewrite(inputs):
+            return await retriever.ainvoke(await rewrite_step.ainvoke(inputs, config), config)
+
+        task = asyncio.ensure_future(retriever.ainvoke(inputs["input"], config))
+        try:
+            question = await rewrite_step.ainvoke(inputs, config)
+            similarity = query_similarity(inputs["input"], question)
+            if similarity >= min_similarity:
+                documents = await task
+            else:
+                task.cancel()
+                documents = await retriever.ainvoke(question, config)
+        finally:
+            # 言い換え中にキャンセルされた場合も、先に始めた検索を残さない
+            if not task.done():
+                task.cancel()
+        log_speculation(similarity >= min_similarity, similarity)
+        return documents
+
+    return RunnableLambda(retrieve, afunc=aretrieve).with_config(run_name="speculative_retrieval")
+
+
+def log_speculation(reused, similarity):
+    """
+    投機的な検索の結果を使ったかどうかを集計し、ログに出力
+
+    Args:
+        reused: 先に検索した結果を使った場合True
+        similarity: ユーザー入力と言い換え後の質問の類似度
+    """
+    logger = logging.getLogger(ct.LOGGER_NAME)
+
+    with _stats_lock:
+        _stats["reused" if reused else "retried"] += 1
+        stats = dict(_stats)
+    count_cache("speculative_retrieval", reused)
+    logger.info(
+        f"投機的な検索: {'先に検索した結果を使用' if reused else '言い換え後の質問で検索し直し'}"
+        f"（類似度{similarity:.2f}, 使用{stats['reused']}件, 検索し直し{stats['retried']}件）"
+    )
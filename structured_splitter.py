@@ -0,0 +1,232 @@
+"""
+このファイルは、見出しのある文書（議事録・サービス資料など）を、見出し・議題の途中で区切らずにチャンク分割するファイルです。
+各チャンクには、見出しの階層（section）と、議事録の場合は開催日（meeting_date）をメタデータとして付与します。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import re
+from langchain_core.documents import Document as LangchainDoc
+import constants as ct
+
+
+############################################################
+# 変数の定義
+############################################################
+# 番号付きの見出し（例: 「1. 基本情報」「3.1 現状の確認」「(1) 柔軟な配送オプション」）
+HEADING_PATTERN = re.compile(r"^(?:(\d+(?:\.\d+)*)\.?|[(（](\d+)[)）])\s+(\S.*)$")
+# 議事録の日時の行（例: 「日時: 2024年1月XX日 13:00 - 15:00」）
+MEETING_DATE_LINE_PATTERN = re.compile(r"^日時\s*[:：]\s*(.+)$", re.MULTILINE)
+# 日時の行から取り出す日付の部分
+MEETING_DATE_PATTERN = re.compile(r"\d{4}\s*[年/-]\s*\d{1,2}\s*[月/-]\s*[^\s（(]*")
+
+
+############################################################
+# クラス定義
+############################################################
+
+class StructuredTextSplitter:
+    """
+    番号付きの見出しで文書を区切り、隣り合う見出し・議題を最大文字数の範囲でまとめてチャンクにするクラス
+    見出しが少ない文書（ページ）は、通常のチャンク分割用のオブジェクトで分割する
+    """
+
+    def __init__(self, fallback_splitter, max_chunk_size=ct.STRUCTURED_CHUNK_MAX_SIZE):
+        """
+        Args:
+            fallback_splitter: 見出しで区切れない文書・長すぎる見出しの本文の分割に使うオブジェクト
+            max_chunk_size: チャンクの最大文字数（1つの見出しだけで超える場合は分割する）
+        """
+        self.fallback_splitter = fallback_splitter
+        self.max_chunk_size = max_chunk_size
+        # PDFのようにページごとに分かれたファイルでも、前のページの見出しと開催日を引き継ぐ
+        # （ページを1つずつ渡された場合も引き継げるよう、呼び出しをまたいで保持する）
+        self._last_source = None
+        self._headings = []
+        self._meeting_date = None
+
+    def split_documents(self, documents):
+        """
+        ドキュメントのリストをチャンク分割
+
+        Args:
+            documents: 読み込んだドキュメントのリスト（同じファイルのページは、呼び出しをまたいでも連続している前提）
+
+        Returns:
+            チャンク分割済みのドキュメントのリスト
+        """
+        splitted_docs = []
+        for doc in documents:
+            source = doc.metadata.get("source")
+            if source != self._last_source:
+                self._last_source = source
+                self._headings = []
+                self._meeting_date = None
+
+            self._meeting_date = find_meeting_date(doc.page_content) or self._meeting_date
+            sections = split_sections(doc.page_content, self._headings)
+            if sum(1 for section in sections if section["heading"]) < ct.STRUCTURED_MIN_HEADINGS:
+                # 見出しで区切れない文書（会話の書き起こしなど）は、通常どおり分割する
+                chunks = self.fallback_splitter.split_documents([doc])
+                for chunk in chunks:
+                    _add_metadata(chunk.metadata, [{"heading": "", "headings": self._headings}], self._meeting_date)
+                splitted_docs.extend(chunks)
+                continue
+
+            for group in group_sections(sections, self.max_chunk_size):
+                splitted_docs.extend(self._group_chunks(doc, group, self._meeting_date))
+            self._headings = sections[-1]["headings"]
+
+        return splitted_docs
+
+    def _group_chunks(self, doc, group, meeting_date):
+        """
+        まとめた見出しの範囲を1つのチャンクにする
+        1つの見出しだけで最大文字数を超える場合は分割し、2つ目以降の先頭にも見出しを付ける
+        """
+        metadata = dict(doc.metadata)
+        _add_metadata(metadata, group, meeting_date)
+        metadata["start_index"] = group[0]["start"]
+        # 見出しの間の空行も含め、元のテキストの連続した範囲をそのままチャンクにする
+        text = doc.page_content[group[0]["start"]:group[-1]["start"] + len(group[-1]["text"])]
+
+        if len(text) <= self.max_chunk_size:
+            return [LangchainDoc(page_content=text, metadata=metadata)]
+
+        section = group[0]
+        chunks = []
+        for i, piece in enumerate(self.fallback_splitter.split_text(text)):
+            piece_metadata = dict(metadata)
+            if i > 0:
+                piece_metadata.pop("start_index")
+                if section["heading"]:
+                    piece = f"{section['heading']}\n{piece}"
+            chunks.append(LangchainDoc(page_content=piece, metadata=piece_metadata))
+        return chunks
+
+
+############################################################
+# 関数定義
+############################################################
+
+def split_sections(text, parent_headings=()):
+    """
+    テキストを番号付きの見出しの位置で区切る
+    本文のない見出し（例: 「3. 議題ごとの記録」の直後に「3.1 ...」が続く場合）は、次の見出しとまとめる
+
+    Args:
+        text: 区切るテキスト
+        parent_headings: テキストの先頭の時点で有効な見出しの階層（前のページから引き継ぐ場合）
+
+    Returns:
+        見出しの範囲ごとの辞書（heading: 見出しの行, headings: 見出しの階層, text: 本文を含むテキスト, start: 開始位置）のリスト
+    """
+    headings = list(parent_headings)
+    sections = []
+    current = {"heading": "", "headings": list(headings), "start": 0}
+
+    position = 0
+    for line in text.splitlines(keepends=True):
+        level = heading_level(line)
+        if level is not None:
+            body = text[current["start"]:position]
+            if body.strip() and body.strip() != current["heading"]:
+                current["text"] = body.strip()
+                current["start"] += len(body) - len(body.lstrip())
+                sections.append(current)
+                current = {"heading": "", "headings": [], "start": position}
+            heading = line.strip()
+            # 同じか上位の階層の見出しが出てきたら、それより下位の見出しを外す
+            headings = [h for h in headings if heading_level(h) < level] + [heading]
+            current["heading"] = heading
+            current["headings"] = list(headings)
+        position += len(line)
+
+    body = text[current["start"]:]
+    if body.strip():
+        current["text"] = body.strip()
+        current["start"] += len(body) - len(body.lstrip())
+        sections.append(current)
+
+    return sections
+
+
+def group_sections(sections, max_size):
+    """
+    隣り合う見出しの範囲を、最大文字数を超えない範囲でまとめる（1つの見出しの範囲が複数に分かれることはない）
+
+    Args:
+        sections: split_sectionsで区切った見出しの範囲のリスト
+        max_size: まとめた範囲の最大文字数
+
+    Returns:
+        まとめた見出しの範囲のリストのリスト
+    """
+    groups = []
+    for section in sections:
+        if groups:
+            last = groups[-1]
+            size = section["start"] + len(section["text"]) - last[0]["start"]
+            if size <= max_size:
+                last.append(section)
+                continue
+        groups.append([section])
+
+    return groups
+
+
+def heading_level(line):
+    """
+    行が番号付きの見出しであれば、その階層を返す
+
+    Args:
+        line: 判定する行
+
+    Returns:
+        見出しの階層（「1.」は1、「1.1」は2、「(1)」は3）。見出しでない場合はNone
+    """
+    line = line.strip()
+    if len(line) > ct.STRUCTURED_HEADING_MAX_LENGTH:
+        return None
+    match = HEADING_PATTERN.match(line)
+    if not match:
+        return None
+    # 「2024. 」のような年や、見出しの後に句点で終わる文が続く行は見出しとみなさない
+    number, paren_number, title = match.groups()
+    if number and int(number.split(".")[0]) > 100 or title.endswith("。"):
+        return None
+    if paren_number:
+        return 3
+    return number.count(".") + 1
+
+
+def find_meeting_date(text):
+    """
+    議事録の「日時」の行から開催日を取り出す
+
+    Args:
+        text: 議事録のテキスト
+
+    Returns:
+        開催日の文字列。「日時」の行がない場合はNone
+    """
+    match = MEETING_DATE_LINE_PATTERN.search(text)
+    if not match:
+        return None
+    value = match.group(1).strip()
+    date = MEETING_DATE_PATTERN.search(value)
+    return date.group(0) if date else value
+
+
+def _add_metadata(metadata, group, meeting_date):
+    # 1つ目の見出しは階層を含めて、2つ目以降は見出しの行だけを「 / 」区切りで付与する
+    titles = []
+    if group and group[0]["headings"]:
+        titles.append(" > ".join(group[0]["headings"]))
+    titles.extend(section["heading"] for section in group[1:] if section["heading"])
+    # ベクターストアのメタデータにはNoneを格納できないため、値がある場合だけ付与する
+    if titles:
+        metadata["section"] = " / ".join(titles)
+    if meeting_date:
+        metadata["meeting_date"] = meeting_date
@@ -0,0 +1,29 @@
+import constants as ct
+from conversation_store import ConversationStore, Turn, _turn_size
+
+
+def test_add_does_not_leave_an_orphan_answer_at_the_head(monkeypatch):
+    monkeypatch.setattr(ct, "SESSION_MAX_TURNS", 4)
+    store = ConversationStore()
+    # 回答取得に失敗した入力（ユーザー入力のみ）で、ユーザー入力と回答の組がずれる
+    store.add(Turn(role="user", text="失敗した質問", in_history=False))
+    store.add(Turn(role="user", text="質問1"))
+    store.add(Turn(role="assistant", text="回答1"))
+    store.add(Turn(role="user", text="質問2"))
+    store.add(Turn(role="assistant", text="回答2"))
+    store.add(Turn(role="user", text="質問3"))
+
+    assert [turn.text for turn in store.turns] == ["質問2", "回答2", "質問3"]
+    assert store.nbytes == sum(_turn_size(turn) for turn in store.turns)
+    assert store.chat_history()[0].type == "human"
+
+
+def test_add_drops_the_answer_and_profile_summary_with_their_question(monkeypatch):
+    store = ConversationStore()
+    store.add(Turn(role="user", text="質問1"))
+    store.add(Turn(role="assistant", text="回答1"))
+    store.add(Turn(role="assistant", text="プロファイル結果", in_history=False))
+    monkeypatch.setattr(ct, "SESSION_MAX_BYTES", store.nbytes)
+    store.add(Turn(role="user", text="質問2"))
+
+    assert [turn.text for turn in store.turns] == ["質問2"]
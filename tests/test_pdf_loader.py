@@ -0,0 +1,61 @@
+from pdf_loader import PdfPageLoader, normalize_page_text
+
+
+def test_normalize_page_text_joins_wrapped_lines():
+    text = (
+        "ＡＢＣ社の　　売上は前年比で大きく増\n"
+        "加しました。 \n"
+        "特に新規顧客の獲得が好調で、今期の\n"
+        "目標を上回りました。\n"
+    )
+
+    assert normalize_page_text(text) == (
+        "ABC社の 売上は前年比で大きく増加しました。\n"
+        "特に新規顧客の獲得が好調で、今期の目標を上回りました。"
+    )
+
+
+def test_normalize_page_text_keeps_headings_bullets_and_page_numbers():
+    text = (
+        "1. 主要商品ラインナップ\n"
+        "当社では、幅広い用途に応じたオーダーメイドの製品を\n"
+        "●​ ベーシックTシャツ: ¥2,500~\n"
+        "\n"
+        "\n"
+        "\n"
+        "当社では、幅広い用途に応じたオーダーメイドの製品を\n"
+        "3\n"
+    )
+
+    assert normalize_page_text(text) == (
+        "1. 主要商品ラインナップ\n"
+        "当社では、幅広い用途に応じたオーダーメイドの製品を\n"
+        "● ベーシックTシャツ: ¥2,500~\n"
+        "\n"
+        "当社では、幅広い用途に応じたオーダーメイドの製品を\n"
+        "3"
+    )
+
+
+def test_normalize_page_text_separates_ascii_words():
+    assert normalize_page_text("The quarterly report covers sales\nand marketing.") == (
+        "The quarterly report covers sales and marketing."
+    )
+
+
+def test_pdf_page_loader_normalizes_each_page(tmp_path):
+    import fitz
+
+    path = tmp_path / "report.pdf"
+    with fitz.open() as doc:
+        page = doc.new_page()
+        page.insert_text((50, 72), "ＡＢＣ社の　　売上は前年比で大きく増", fontname="japan")
+        page.insert_text((50, 90), "加しました。", fontname="japan")
+        page = doc.new_page()
+        page.insert_text((50, 72), "２ページ目", fontname="japan")
+        doc.save(path)
+
+    docs = list(PdfPageLoader(str(path)).lazy_load())
+
+    assert [doc.page_content for doc in docs] == ["ABC社の 売上は前年比で大きく増加しました。", "2ページ目"]
+    assert [doc.metadata["page"] for doc in docs] == [0, 1]
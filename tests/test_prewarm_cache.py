@@ -0,0 +1,44 @@
+import constants as ct
+from answer_cache import get_cache_key
+from prewarm_cache import mine_query_log
+
+
+def write_log(path, records):
+    # initialize.initialize_loggerのフォーマット（行頭のsession_idは、ログの設定を行った最初のセッションのもの）
+    with open(path, "w", encoding="utf8") as f:
+        for record in records:
+            f.write(f"[INFO] 2025-01-01 12:00:00,000 line 155, in <module>, session_id=first-session: {record}\n")
+
+
+def test_mine_query_log_counts_first_question_of_each_session(tmp_path):
+    inquiry = ct.ANSWER_MODE_2
+    write_log(tmp_path / ct.LOG_FILE, [
+        {"message": "株主優待の内容は？", "application_mode": inquiry, "session_id": "a"},
+        {"message": "回答です", "sources": 1, "application_mode": inquiry},
+        {"message": "いつ届きますか？", "application_mode": inquiry, "session_id": "a"},
+        {"message": "株主優待の内容は？", "application_mode": inquiry, "session_id": "b"},
+        {"message": "株主優待の内容は", "application_mode": inquiry, "session_id": "c"},
+        {"message": "会社の所在地は？", "application_mode": inquiry, "session_id": "d"},
+        {"message": "設立はいつですか？", "application_mode": inquiry, "session_id": "d"},
+    ])
+
+    logged = mine_query_log(str(tmp_path))
+
+    assert logged == {
+        get_cache_key(inquiry, "株主優待の内容は？"): ("株主優待の内容は", 3),
+        get_cache_key(inquiry, "会社の所在地は？"): ("会社の所在地は？", 1),
+    }
+
+
+def test_mine_query_log_counts_every_question_without_session_id(tmp_path):
+    search = ct.ANSWER_MODE_1
+    write_log(tmp_path / ct.LOG_FILE, [
+        {"message": "議事録のありかは？", "application_mode": search},
+        {"message": "議事録のありかは？", "application_mode": search},
+        {"message": "商品情報の資料は？", "application_mode": search},
+    ])
+
+    logged = mine_query_log(str(tmp_path))
+
+    assert logged[get_cache_key(search, "議事録のありかは？")][1] == 2
+    assert logged[get_cache_key(search, "商品情報の資料は？")][1] == 1
@@ -7,15 +7,10 @@
 ############################################################
 import os
 import logging
-import pandas as pd
-from datetime import datetime
 from dotenv import load_dotenv
 import streamlit as st
-from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.schema import HumanMessage
-from langchain_openai import ChatOpenAI
-from langchain.chains import create_history_aware_retriever, create_retrieval_chain
-from langchain.chains.combine_documents import create_stuff_documents_chain
+from conversation_store import get_conversation
+from metrics import count_request
 import constants as ct
 
 
@@ -26,6 +21,13 @@ import constants as ct
 load_dotenv()
 
 
+############################################################
+# 変数の定義
+############################################################
+# トークン数の計測に使うエンコーダー（初回利用時に読み込む。読み込めない場合はFalse）
+_token_encoder = None
+
+
 ############################################################
 # 関数定義
 ############################################################
@@ -70,36 +72,37 @@ def build_error_message(message):
     return f"{error_text}\n{ct.COMMON_ERROR_MESSAGE}"
 
 
-def check_files_for_updates(file_paths, reference_time):
+def count_tokens(text):
     """
-    指定されたファイル群が reference_time より後に更新されたかどうかをチェックします
+    テキストのトークン数を、ローカルのトークナイザー（tiktoken）で計測する
+    トークナイザーのデータを取得できない環境では、文字種から概算する
 
     Args:
-        file_paths: チェックするファイルパスのリスト
-        reference_time: 基準となる日時（datetime オブジェクト）
+        text: 計測するテキスト
 
     Returns:
-        更新されたファイル名のリスト
+        トークン数
     """
-    logger = logging.getLogger(ct.LOGGER_NAME)
-    
-    if not file_paths or not reference_time:
-        return []
-        
-    updated_files = []
-    for path in file_paths:
+    global _token_encoder
+
+    if not text:
+        return 0
+
+    if _token_encoder is None:
         try:
-            if not os.path.exists(path):
-                continue
-                
-            mod_time = datetime.fromtimestamp(os.path.getmtime(path))
-            if mod_time > reference_time:
-                updated_files.append(path)
-                logger.info(f"ファイル更新を検知: {path}")
-        except (PermissionError, OSError) as e:
-            logger.warning(f"ファイル更新チェックエラー: {path} - {e}")
-    
-    return updated_files
+            import tiktoken
+            _token_encoder = tiktoken.encoding_for_model(ct.MODEL)
+        except Exception as e:
+            logger = logging.getLogger(ct.LOGGER_NAME)
+            logger.warning(f"トークナイザーを読み込めないため、トークン数を概算します: {e}")
+            _token_encoder = False
+
+    if _token_encoder:
+        return len(_token_encoder.encode(text, disallowed_special=()))
+
+    # 概算: 英数字は約4文字で1トークン、日本語などの非ASCII文字は1文字で約1トークン
+    ascii_count = sum(1 for ch in text if ord(ch) < 128)
+    return (len(text) - ascii_count) + (ascii_count + 3) // 4
 
 
 def detect_special_query_type(query):
@@ -122,6 +125,34 @@ def detect_special_query_type(query):
     return None
 
 
+def is_csv_header_query(query):
+    """
+    CSVファイルのヘッダーに関するクエリかどうかを判定する
+
+    Args:
+        query: ユーザー入力クエリ
+
+    Returns:
+        CSVファイルのヘッダーに関するクエリの場合True
+    """
+    return "csv" in query.lower() and ("ヘッダー" in query or "項目" in query)
+
+
+def get_query_type(query):
+    """
+    メトリクスに記録するクエリの種類を取得する
+
+    Args:
+        query: ユーザー入力クエリ
+
+    Returns:
+        クエリの種類（「csv」、特殊クエリタイプ、該当しない場合は「general」）
+    """
+    if is_csv_header_query(query):
+        return "csv"
+    return detect_special_query_type(query) or "general"
+
+
 def process_employee_query(query):
     """
     従業員情報に関するクエリを特別に処理する
@@ -132,6 +163,8 @@ def process_employee_query(query):
     Returns:
         処理結果の辞書（成功時: {"success": True, "data": データ}, 失敗時: {"success": False, "error": エラー}）
     """
+    import pandas as pd
+
     logger = logging.getLogger(ct.LOGGER_NAME)
     
     try:
@@ -193,6 +226,8 @@ def process_csv_header_query(query):
     Returns:
         処理結果の辞書（成功時: {"success": True, "documents": 見つかったドキュメントのリスト}, 失敗時: {"success": False, "error": エラー}）
     """
+    import pandas as pd
+
     logger = logging.getLogger(ct.LOGGER_NAME)
     
     try:
@@ -255,6 +290,8 @@ def format_csv_results(csv_results):
     Returns:
         フォーマットされたテキスト
     """
+    import pandas as pd
+
     if not csv_results["success"]:
         return csv_results["error"]
     
@@ -275,40 +312,142 @@ def format_csv_results(csv_results):
     return formatted_text
 
 
-def get_llm_response(chat_message):
+def get_llm_response(chat_message, profiling=False):
     """
-    LLMからの回答取得
+    LLMからの回答取得（画面用）
+    回答生成はプロセス内で共有するイベントループで非同期に実行し、同じセッションから新しいメッセージが送信された場合や、
+    画面の再実行・ブラウザを閉じたことで結果を表示できなくなった場合は、実行中のLLM呼び出しをキャンセルする
 
     Args:
         chat_message: ユーザー入力値
+        profiling: 「/profile」で計測中かどうか（cProfileは計測を開始したスレッドの処理のみを記録するため、
+            計測中はイベントループ・先行検索のスレッドを使わず、呼び出し元のスレッドで回答を生成する）
 
     Returns:
         LLMからの回答
     """
     logger = logging.getLogger(ct.LOGGER_NAME)
-    logger.info(f"LLM回答取得開始: {chat_message}")
-    
-    # Retrieverの初期化チェック
-    if "retriever" not in st.session_state:
+
+    mode = st.session_state.mode
+    # 会話履歴は、画面表示と共有の会話ログからその都度作成（会話ログへの追加は回答表示後に行う）
+    chat_history = get_conversation(st.session_state.session_id).chat_history()
+    count_request(mode, get_query_type(chat_message))
+
+    # 会話履歴のない質問は、同じ質問の回答（事前に作成したものを含む）があればLLMを呼び出さずに返す
+    # インデックスの作成を待たずに返せるよう、Retrieverの取得より先に確認する
+    answer_cache = None
+    if ct.ANSWER_CACHE_ENABLED and not chat_history:
+        from answer_cache import get_answer_cache
+
+        answer_cache = get_answer_cache()
+        cached_response = answer_cache.get(mode, chat_message, st.session_state.index_state.update_count)
+        if cached_response is not None:
+            logger.info(f"回答キャッシュから回答します（ヒット{answer_cache.hits}件, ミス{answer_cache.misses}件）: {chat_message}")
+            return dict(cached_response, degraded=False)
+
+    # Retrieverの取得（ベクターストアの作成中は、文字列一致ベースの簡易検索用Retrieverを使う）
+    retriever, degraded = st.session_state.index_state.get_retriever(timeout=ct.INDEX_WAIT_TIMEOUT)
+    if retriever is None:
         error_message = ct.RETRIEVER_NOT_INITIALIZED_ERROR
         logger.error(error_message)
         return {"answer": error_message, "context": []}
+    if degraded:
+        logger.info("ベクターストアの作成中のため、簡易検索で回答します")
+
+    if ct.REQUEST_ASYNC_ENABLED and not profiling:
+        from concurrent.futures import CancelledError
+        from request_runner import get_request_runner
+
+        runner = get_request_runner()
+        session_id = st.session_state.session_id
+        future = runner.submit(
+            session_id,
+            lambda callback: agenerate_answer(chat_message, retriever, mode, chat_history, callbacks=[callback])
+        )
+        try:
+            llm_response = runner.wait(session_id, future, is_abandoned=is_script_run_abandoned)
+        except CancelledError:
+            # 結果を表示する画面の実行はすでに終わっているため、以降の処理を中断する
+            logger.info(f"回答生成がキャンセルされたため、回答を表示せずに終了します: {chat_message}")
+            st.stop()
+    else:
+        speculative = ct.SPECULATIVE_RETRIEVAL_ENABLED and not profiling
+        llm_response = generate_answer(chat_message, retriever, mode, chat_history, speculative=speculative)
+    llm_response["degraded"] = degraded
+
+    # 簡易検索の結果をもとにした回答は、ベクターストアの作成後の回答と異なるためキャッシュしない
+    if answer_cache is not None and llm_response.get("success") and not degraded:
+        answer_cache.put(mode, chat_message, llm_response, st.session_state.index_state.update_count)
+
+    return llm_response
+
+
+def is_script_run_abandoned():
+    """
+    実行中の画面の処理の結果が、表示されなくなったかどうかを判定
+    （新しいメッセージの送信などで画面の再実行が要求された場合、ブラウザを閉じてセッションが終了した場合）
+
+    Returns:
+        結果が表示されなくなった場合True
+    """
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return False
+    try:
+        if Runtime.exists() and not Runtime.instance().is_active_session(ctx.session_id):
+            return True
+        # 画面の再実行（fastReruns）では、実行中の処理に停止が要求される（公開APIが無いため、内部の状態を参照する）
+        state = getattr(ctx.script_requests, "_state", None)
+        return getattr(state, "name", None) == "STOP"
+    except Exception:
+        return False
+
+
+def prepare_answer(chat_message, retriever, mode, chat_history, speculative=ct.SPECULATIVE_RETRIEVAL_ENABLED):
+    """
+    回答取得の準備（特殊クエリの処理と、検索・回答生成のChainの作成）
+
+    Args:
+        chat_message: ユーザー入力値
+        retriever: 検索に使うRetriever
+        mode: 回答モード（ct.ANSWER_MODE_1 / ct.ANSWER_MODE_2）
+        chat_history: LLMとのやりとり用の会話ログ
+        speculative: 質問の言い換えと並行して、ユーザー入力のままで先に検索を始めるかどうか
+
+    Returns:
+        (Chainを実行せずに返す回答, Chainの入力・検索用Chain・回答用Chainの辞書)のタプル（どちらか一方はNone）
+    """
+    # 重いモジュールのため、初回の回答生成時に読み込む
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+    from langchain_openai import ChatOpenAI
+    from langchain.chains.combine_documents import create_stuff_documents_chain
+    from langchain_core.runnables import RunnableLambda
+    from context_packing import pack_documents
+    from query_rewrite import create_rewrite_step
+    from speculative_retrieval import create_speculative_retrieval
+    from llm_usage import UsageLoggingCallback, StageTimingCallback
+
+    logger = logging.getLogger(ct.LOGGER_NAME)
+    logger.info(f"LLM回答取得開始: {chat_message}")
     
     # CSV関連のクエリかどうかをチェック
-    if "csv" in chat_message.lower() and ("ヘッダー" in chat_message or "項目" in chat_message):
+    if is_csv_header_query(chat_message):
         logger.info(f"CSVヘッダーに関するクエリを検出: {chat_message}")
         result = process_csv_header_query(chat_message)
         
         if result["success"]:
             formatted_result = format_csv_results(result)
-            return {"answer": formatted_result, "context": [], "is_csv_result": True}
+            return {"answer": formatted_result, "context": [], "is_csv_result": True}, None
     
     # 特殊クエリのチェック
     query_type = detect_special_query_type(chat_message)
     modified_query = chat_message
     
     # 特殊クエリの処理
-    if query_type == "employee" and st.session_state.mode == ct.ANSWER_MODE_2:
+    if query_type == "employee" and mode == ct.ANSWER_MODE_2:
         logger.info(f"社員情報に関するクエリを検出: {chat_message}")
         result = process_employee_query(chat_message)
         
@@ -319,11 +458,17 @@ def get_llm_response(chat_message):
     
     # LLMのオブジェクトを用意
     try:
-        llm = ChatOpenAI(model_name=ct.MODEL, temperature=ct.TEMPERATURE)
+        if ct.LLM_GATEWAY_ENABLED:
+            # 全セッションのLLM呼び出しを共有のゲートウェイ経由にし、同時実行数の制限・再試行・同一プロンプトの集約を行う
+            # 再試行はゲートウェイで行うため、OpenAIクライアント自身の再試行は無効にする
+            from llm_gateway import GatewayChatModel
+            llm = GatewayChatModel(llm=ChatOpenAI(model_name=ct.MODEL, temperature=ct.TEMPERATURE, max_retries=0))
+        else:
+            llm = ChatOpenAI(model_name=ct.MODEL, temperature=ct.TEMPERATURE)
     except Exception as e:
         error_message = f"LLMオブジェクトの初期化に失敗しました: {e}"
         logger.error(error_message)
-        return {"answer": error_message, "context": []}
+        return {"answer": error_message, "context": []}, None
     
     # 会話履歴なしでもLLMに理解してもらえる、独立した入力テキストを取得するためのプロンプトテンプレートを作成
     question_generator_template = ct.SYSTEM_PROMPT_CREATE_INDEPENDENT_TEXT
@@ -336,7 +481,7 @@ def get_llm_response(chat_message):
     )
 
     # モードによってLLMから回答を取得する用のプロンプトを変更
-    if st.session_state.mode == ct.ANSWER_MODE_1:
+    if mode == ct.ANSWER_MODE_1:
         # モードが「社内文書検索」の場合のプロンプト
         question_answer_template = ct.SYSTEM_PROMPT_DOC_SEARCH
     else:
@@ -344,41 +489,180 @@ def get_llm_response(chat_message):
         question_answer_template = ct.SYSTEM_PROMPT_INQUIRY
         
     # LLMから回答を取得する用のプロンプトテンプレートを作成
+    # 質問ごとに変わる検索結果の文脈は、プロンプトキャッシュが効くよう最後のメッセージに入れる
     question_answer_prompt = ChatPromptTemplate.from_messages(
         [
             ("system", question_answer_template),
             MessagesPlaceholder("chat_history"),
-            ("human", "{input}")
+            ("human", ct.HUMAN_PROMPT_WITH_CONTEXT)
         ]
     )
 
+    # 会話履歴なしでもLLMに理解してもらえる、独立した入力テキストを取得してから検索するRetrieverを作成
+    # 同じ会話履歴・入力での再送信時にLLMを呼び出し直さないよう、言い換え結果はキャッシュする
+    # 言い換え・検索・回答のそれぞれにかかった時間と、トークン数はメトリクスに記録する
+    rewrite_step = create_rewrite_step(
+        llm.with_config(callbacks=[UsageLoggingCallback("質問の言い換え", call="rewrite"), StageTimingCallback("rewrite")]),
+        question_generator_prompt
+    )
+    retriever = retriever.with_config(callbacks=[StageTimingCallback("retrieval")])
+    if speculative:
+        # 言い換えのLLM呼び出しを待つ間に、ユーザー入力のままで検索しておく
+        history_aware_retriever = create_speculative_retrieval(rewrite_step, retriever)
+    else:
+        history_aware_retriever = rewrite_step | retriever
+    # 検索結果のチャンクの重複を除き、トークン数の上限内に関連性の高い順で詰め込む
+    if ct.CONTEXT_PACKING_ENABLED:
+        history_aware_retriever = history_aware_retriever | RunnableLambda(pack_documents)
+    
+    # LLMから回答を取得する用のChainを作成
+    # 応答のトークン数（プロンプトキャッシュに一致した分を含む）はログに出力する
+    question_answer_chain = create_stuff_documents_chain(
+        llm.with_config(callbacks=[UsageLoggingCallback("回答", call="generation"), StageTimingCallback("generation")]),
+        question_answer_prompt
+    )
+
+    return None, {
+        "inputs": {"input": modified_query, "chat_history": chat_history},
+        "retrieval_chain": history_aware_retriever,
+        "answer_chain": question_answer_chain
+    }
+
+
+def generate_answer(chat_message, retriever, mode, chat_history, speculative=ct.SPECULATIVE_RETRIEVAL_ENABLED):
+    """
+    LLMからの回答取得（セッション状態に依存しない本体処理）
+
+    Args:
+        chat_message: ユーザー入力値
+        retriever: 検索に使うRetriever
+        mode: 回答モード（ct.ANSWER_MODE_1 / ct.ANSWER_MODE_2）
+        chat_history: LLMとのやりとり用の会話ログ
+        speculative: 質問の言い換えと並行して、ユーザー入力のままで先に検索を始めるかどうか
+
+    Returns:
+        LLMからの回答（LLMの回答が得られた場合のみ「success」キーがTrue）
+    """
+    logger = logging.getLogger(ct.LOGGER_NAME)
+
     try:
-        # 会話履歴なしでもLLMに理解してもらえる、独立した入力テキストを取得するためのRetrieverを作成
-        history_aware_retriever = create_history_aware_retriever(
-            llm, st.session_state.retriever, question_generator_prompt
-        )
-        
-        # LLMから回答を取得する用のChainを作成
-        question_answer_chain = create_stuff_documents_chain(llm, question_answer_prompt)
-        # 「RAG x 会話履歴の記憶機能」を実現するためのChainを作成
-        chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)
-        
+        response, chains = prepare_answer(chat_message, retriever, mode, chat_history, speculative)
+        if response is not None:
+            return response
+
+        # 「RAG x 会話履歴の記憶機能」: 検索してから、検索結果を文脈としてLLMに回答させる
+        inputs = chains["inputs"]
+        context = chains["retrieval_chain"].invoke(inputs)
+        if not context:
+            return create_no_match_response(inputs, mode)
+
         # LLMへのリクエストとレスポンス取得
-        llm_response = chain.invoke({"input": modified_query, "chat_history": st.session_state.chat_history})
-        
-        # レスポンスの検証
-        if not validate_llm_response(llm_response):
-            error_message = ct.INVALID_RESPONSE_ERROR
-            logger.error(f"無効なLLMレスポンス: {llm_response}")
-            return {"answer": error_message, "context": []}
-        
-        # LLMレスポンスを会話履歴に追加
-        st.session_state.chat_history.extend([HumanMessage(content=chat_message), llm_response["answer"]])
-        
-        logger.info(f"LLM回答取得完了: {llm_response['answer'][:100]}...")
-        return llm_response
+        llm_response = dict(inputs, context=context)
+        llm_response["answer"] = chains["answer_chain"].invoke(llm_response)
+        return finish_llm_response(llm_response)
         
     except Exception as e:
         error_message = f"回答生成中にエラーが発生しました: {e}"
         logger.error(error_message)
-        return {"answer": error_message, "context": []}
\ No newline at end of file
+        return {"answer": error_message, "context": []}
+
+
+async def agenerate_answer(chat_message, retriever, mode, chat_history, callbacks=None):
+    """
+    LLMからの回答取得（generate_answerの非同期版）
+    実行中のタスクがキャンセルされた場合は、その時点のLLM呼び出しを中断してasyncio.CancelledErrorを送出する
+
+    Args:
+        chat_message: ユーザー入力値
+        retriever: 検索に使うRetriever
+        mode: 回答モード（ct.ANSWER_MODE_1 / ct.ANSWER_MODE_2）
+        chat_history: LLMとのやりとり用の会話ログ
+        callbacks: Chainの実行時に追加するコールバック
+
+    Returns:
+        LLMからの回答（LLMの回答が得られた場合のみ「success」キーがTrue）
+    """
+    logger = logging.getLogger(ct.LOGGER_NAME)
+    config = {"callbacks": callbacks or []}
+
+    try:
+        response, chains = prepare_answer(chat_message, retriever, mode, chat_history)
+        if response is not None:
+            return response
+
+        inputs = chains["inputs"]
+        context = await chains["retrieval_chain"].ainvoke(inputs, config)
+        if not context:
+            return create_no_match_response(inputs, mode)
+
+        llm_response = dict(inputs, context=context)
+        llm_response["answer"] = await chains["answer_chain"].ainvoke(llm_response, config)
+        return finish_llm_response(llm_response)
+
+    except Exception as e:
+        # キャンセル（asyncio.CancelledError）はExceptionではないため、ここでは捕捉せずに呼び出し元へ伝える
+        error_message = f"回答生成中にエラーが発生しました: {e}"
+        logger.error(error_message)
+        return {"answer": error_message, "context": []}
+
+
+def create_no_match_response(inputs, mode):
+    """
+    関連度の高いドキュメントが1件も無い場合の回答を作成（LLMは呼び出さない）
+
+    Args:
+        inputs: Chainの入力
+        mode: 回答モード（ct.ANSWER_MODE_1 / ct.ANSWER_MODE_2）
+
+    Returns:
+        「該当なし」の回答
+    """
+    logger = logging.getLogger(ct.LOGGER_NAME)
+    logger.info("関連するドキュメントが無いため、LLMを呼び出さずに回答します")
+    answer = ct.NO_DOC_MATCH_ANSWER if mode == ct.ANSWER_MODE_1 else ct.INQUIRY_NO_MATCH_ANSWER
+    return dict(inputs, context=[], answer=answer, success=True, no_match=True)
+
+
+def finish_llm_response(llm_response):
+    """
+    LLMからの回答を検証し、結果の辞書を仕上げる
+
+    Args:
+        llm_response: 入力・検索結果・LLMの回答の辞書
+
+    Returns:
+        LLMからの回答（検証に失敗した場合はエラーメッセージ）
+    """
+    logger = logging.getLogger(ct.LOGGER_NAME)
+
+    # レスポンスの検証
+    if not validate_llm_response(llm_response):
+        error_message = ct.INVALID_RESPONSE_ERROR
+        logger.error(f"無効なLLMレスポンス: {llm_response}")
+        return {"answer": error_message, "context": []}
+    
+    logger.info(f"LLM回答取得完了: {llm_response['answer'][:100]}...")
+    llm_response["success"] = True
+    return llm_response
+
+
+def get_source_list(documents):
+    """
+    参照元ドキュメントのありか（ファイルパス・ページ番号）を重複なしで取得
+
+    Args:
+        documents: LLMからの回答の「context」に含まれるドキュメントのリスト
+
+    Returns:
+        {"source": ファイルパス, "page": ページ番号}の辞書のリスト
+    """
+    sources = []
+    for document in documents:
+        source = {
+            "source": document.metadata.get("source"),
+            "page": document.metadata.get("page")
+        }
+        if source not in sources:
+            sources.append(source)
+
+    return sources
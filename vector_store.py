@@ -0,0 +1,350 @@
+"""
+このファイルは、NumPyの行列1つで埋め込みベクトルを保持する軽量なベクターストアのファイルです。
+Chromaと同じVectorStoreのインターフェースを持つため、「as_retriever」でそのままRetrieverとして利用できます。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import math
+import threading
+from uuid import uuid4
+import numpy as np
+from langchain_core.documents import Document as LangchainDoc
+from langchain_core.vectorstores import VectorStore
+import constants as ct
+
+
+############################################################
+# クラス定義
+############################################################
+
+class NumpyVectorStore(VectorStore):
+    """
+    正規化済みの埋め込みベクトルを連続したNumPy行列に格納し、全件の内積計算で厳密なtop-k検索を行うベクターストア
+
+    保存形式（dtype）は以下から選択できる
+    - 「float32」: そのまま保持
+    - 「float16」: 半精度で保持（メモリ使用量は半分）
+    - 「int8」: 行ごとのスケールで量子化して保持（メモリ使用量は約1/4）
+    """
+
+    def __init__(self, embedding, dtype=ct.NUMPY_STORE_DTYPE):
+        """
+        Args:
+            embedding: クエリ・ドキュメントの埋め込みに使うモデル
+            dtype: 埋め込みベクトルの保存形式（「float32」「float16」「int8」）
+        """
+        if dtype not in ("float32", "float16", "int8"):
+            raise ValueError(f"未対応の保存形式です: {dtype}")
+
+        self._embedding = embedding
+        self._dtype = dtype
+        # 埋め込みベクトルの行列（次元数は最初の追加時に決まる）
+        self._matrix = None
+        # int8で保存する場合の行ごとのスケール
+        self._scales = None
+        self._texts = []
+        self._metadatas = []
+        self._ids = []
+        # 検索中に追加・削除で行列とテキストの対応がずれないよう、追加・削除・検索を排他する
+        self._lock = threading.RLock()
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    def __len__(self):
+        return len(self._ids)
+
+    @property
+    def nbytes(self):
+        """
+        埋め込みベクトルの保持に使っているバイト数
+        """
+        if self._matrix is None:
+            return 0
+        nbytes = self._matrix.nbytes
+        if self._scales is not None:
+            nbytes += self._scales.nbytes
+        return nbytes
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        """
+        テキストを埋め込んでストアに追加
+
+        Args:
+            texts: 追加するテキスト
+            metadatas: テキストごとのメタデータ
+            ids: テキストごとのID（未指定の場合は自動生成）
+
+        Returns:
+            追加したテキストのIDのリスト
+        """
+        texts = list(texts)
+        vectors = self._embedding.embed_documents(texts)
+        return self.add_embeddings(texts, vectors, metadatas=metadatas, ids=ids)
+
+    def add_embeddings(self, texts, vectors, metadatas=None, ids=None):
+        """
+        埋め込み済みのベクトルをストアに追加
+
+        Args:
+            texts: 追加するテキスト
+            vectors: テキストごとの埋め込みベクトル
+            metadatas: テキストごとのメタデータ
+            ids: テキストごとのID（未指定の場合は自動生成）
+
+        Returns:
+            追加したテキストのIDのリスト
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        if metadatas is None:
+            metadatas = [{} for _ in texts]
+        if ids is None:
+            ids = [uuid4().hex for _ in texts]
+
+        rows, scales = self._encode(_normalize(np.asarray(vectors, dtype=np.float32)))
+        with self._lock:
+            self._materialize()
+            if self._matrix is None:
+                self._matrix = rows
+                self._scales = scales
+            else:
+                self._matrix = np.concatenate([self._matrix, rows])
+                if scales is not None:
+                    self._scales = np.concatenate([self._scales, scales])
+
+            self._texts.extend(texts)
+            self._metadatas.extend(dict(metadata) for metadata in metadatas)
+            self._ids.extend(ids)
+
+        return list(ids)
+
+    def delete(self, ids=None, **kwargs):
+        """
+        指定したIDのテキストをストアから削除
+
+        Args:
+            ids: 削除するテキストのIDのリスト
+
+        Returns:
+            削除できた場合はTrue
+        """
+        if not ids or self._matrix is None:
+            return False
+
+        delete_ids = set(ids)
+        with self._lock:
+            keep = [i for i, doc_id in enumerate(self._ids) if doc_id not in delete_ids]
+            if len(keep) == len(self._ids):
+                return False
+
+            self._matrix = self._matrix[keep]
+            if self._scales is not None:
+                self._scales = self._scales[keep]
+            self._texts = [self._texts[i] for i in keep]
+            self._metadatas = [self._metadatas[i] for i in keep]
+            self._ids = [self._ids[i] for i in keep]
+
+        return True
+
+    def get(self, include=("documents", "metadatas")):
+        """
+        格納済みのテキストを取得（Chromaの「get」と同じ形式）
+
+        Args:
+            include: 取得する項目（「documents」「metadatas」）
+
+        Returns:
+            「ids」と、includeで指定した項目のリストの辞書
+        """
+        with self._lock:
+            result = {"ids": list(self._ids)}
+            if "documents" in include:
+                result["documents"] = list(self._texts)
+            if "metadatas" in include:
+                result["metadatas"] = [dict(metadata) for metadata in self._metadatas]
+        return result
+
+    def get_by_ids(self, ids, /):
+        with self._lock:
+            positions = {doc_id: i for i, doc_id in enumerate(self._ids)}
+            return [self._document(positions[doc_id]) for doc_id in ids if doc_id in positions]
+
+    def similarity_search(self, query, k=ct.RETRIEVER_DOCUMENT_COUNT, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k, **kwargs)]
+
+    def similarity_search_with_score(self, query, k=ct.RETRIEVER_DOCUMENT_COUNT, **kwargs):
+        """
+        クエリと類似度が高い順にドキュメントを検索
+
+        Returns:
+            (ドキュメント, コサイン類似度)のタプルのリスト
+        """
+        vector = self._embedding.embed_query(query)
+        return self.similarity_search_with_score_by_vector(vector, k=k, **kwargs)
+
+    def similarity_search_by_vector(self, embedding, k=ct.RETRIEVER_DOCUMENT_COUNT, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k=k, **kwargs)]
+
+    def similarity_search_with_score_by_vector(self, embedding, k=ct.RETRIEVER_DOCUMENT_COUNT, filter=None, **kwargs):
+        """
+        埋め込みベクトルと類似度が高い順にドキュメントを検索
+
+        Args:
+            embedding: クエリの埋め込みベクトル
+            k: 取得するドキュメント数
+            filter: メタデータの完全一致による絞り込み条件
+
+        Returns:
+            (ドキュメント, コサイン類似度)のタプルのリスト
+        """
+        query = _normalize(np.asarray(embedding, dtype=np.float32))
+        with self._lock:
+            return self._search(query, k, filter)
+
+    def _search(self, query, k, filter):
+        if self._matrix is None or k <= 0:
+            return []
+
+        scores = self._scores(query)
+
+        # 絞り込み条件に合わないドキュメントは候補から除外
+        if filter:
+            mask = np.array([
+                all(metadata.get(key) == value for key, value in filter.items())
+                for metadata in self._metadatas
+            ])
+            scores = np.where(mask, scores, -np.inf)
+
+        # 全件ソートせず、上位k件の候補だけをargpartitionで取り出してから並べ替える
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        return [(self._document(i), float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+    def _select_relevance_score_fn(self):
+        # Chroma（L2距離）と同じ尺度の関連度に変換し、同じしきい値で関連度を判定できるようにする
+        # Chromaは「L2距離の2乗」を返し、正規化済みベクトルでは「2 - 2 * コサイン類似度」となる
+        # LangChainはこれを「1 - 距離 / √2」で関連度に変換する（関連の低いものは0未満になることもある）
+        return lambda score: 1.0 - (2.0 - 2.0 * score) / math.sqrt(2)
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, dtype=ct.NUMPY_STORE_DTYPE, **kwargs):
+        store = cls(embedding, dtype=dtype)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+    @classmethod
+    def from_snapshot(cls, snapshot, embedding):
+        """
+        mmapで読み込んだスナップショットを参照するストアを作成（行列・テキストはコピーしない）
+
+        Args:
+            snapshot: index_snapshot.IndexSnapshot
+            embedding: クエリの埋め込みに使うモデル
+
+        Returns:
+            作成したストア
+        """
+        store = cls(embedding, dtype=snapshot.dtype)
+        store._matrix = snapshot.matrix
+        store._scales = snapshot.scales
+        store._texts = snapshot.texts
+        store._metadatas = snapshot.metadatas
+        store._ids = snapshot.ids
+        return store
+
+    def write_snapshot(self, path, info=None):
+        """
+        ストアの内容をスナップショットファイルに書き出す
+
+        Args:
+            path: スナップショットファイルのパス
+            info: 任意の付加情報
+        """
+        from index_snapshot import write_snapshot
+
+        with self._lock:
+            if self._matrix is None:
+                raise ValueError("空のストアはスナップショットに書き出せません")
+            write_snapshot(
+                path,
+                list(self._texts),
+                list(self._metadatas),
+                list(self._ids),
+                self._matrix,
+                scales=self._scales,
+                dtype=self._dtype,
+                info=info
+            )
+
+    def _materialize(self):
+        """
+        スナップショットを参照している場合、追加・変更できるよう自身のリストにコピー
+        """
+        if not isinstance(self._texts, list):
+            self._texts = list(self._texts)
+            self._metadatas = list(self._metadatas)
+            self._ids = list(self._ids)
+
+    def _encode(self, vectors):
+        """
+        正規化済みのベクトルを保存形式に変換
+
+        Returns:
+            (変換後の行列, 行ごとのスケール（int8以外はNone）)
+        """
+        if self._dtype == "float32":
+            return np.ascontiguousarray(vectors), None
+        if self._dtype == "float16":
+            return vectors.astype(np.float16), None
+
+        # int8の場合、行ごとの最大絶対値が127になるようスケールして量子化
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        rows = np.rint(vectors / scales[:, None]).astype(np.int8)
+        return rows, scales.astype(np.float32)
+
+    def _scores(self, query):
+        """
+        全ドキュメントとクエリのコサイン類似度を計算
+        """
+        if self._dtype == "float32":
+            return self._matrix @ query
+
+        if self._dtype == "int8":
+            # einsumはint8のまま積和を計算するため、float32の一時行列を作らずに済む
+            return np.einsum("ij,j->i", self._matrix, query) * self._scales
+
+        # float16の場合、一時的なfloat32への変換でメモリが膨らまないよう、行ブロックごとに計算
+        scores = np.empty(len(self._matrix), dtype=np.float32)
+        block = ct.NUMPY_STORE_BLOCK_ROWS
+        for start in range(0, len(self._matrix), block):
+            end = start + block
+            scores[start:end] = self._matrix[start:end].astype(np.float32) @ query
+        return scores
+
+    def _document(self, i):
+        return LangchainDoc(page_content=self._texts[i], metadata=dict(self._metadatas[i]), id=self._ids[i])
+
+
+############################################################
+# 関数定義
+############################################################
+
+def _normalize(vectors):
+    """
+    ベクトル（または行列の各行）をL2ノルム1に正規化
+    """
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms